@@ -91,6 +91,35 @@ DATABASES = {
     }
 }
 
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    }
+}
+
+# Catalogue responses are cached in this alias. Local memory is per process, so point it
+# at a shared backend (e.g. Redis or Memcached) in production.
+CATALOGUE_CACHE_ALIAS = 'default'
+CATALOGUE_CACHE_TIMEOUT = 300  # seconds
+
+# Upper bounds of the price bands returned by GET /products/?facets=true (override per request with ?price_buckets=)
+PRODUCT_PRICE_FACET_BOUNDARIES = [25, 50, 100, 250, 500]
+
+# How long a replayed POST /orders/create/ Idempotency-Key is honoured before purge_idempotency_keys removes it
+IDEMPOTENCY_KEY_TTL = 24 * 60 * 60  # seconds
+
+# Times process_order_jobs claims a queued order before giving up on it and marking it failed
+ORDER_JOB_MAX_ATTEMPTS = 3
+
+# Sharded stock for hot SKUs (products.inventory): counters per product when sharding is switched on, and how
+# often at most orders refresh the product's cached stock_quantity. Orders in between are caught up by the next
+# order after the interval, or by process_order_jobs / rebalance_stock_shards once orders stop
+STOCK_SHARDS = 8
+STOCK_SUM_SYNC_INTERVAL = 5  # seconds
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -0,0 +1,196 @@
+"""
+Order placement. Every product in an order is locked in one go, in id order so concurrent checkouts can't
+deadlock. Stock is then taken with a single conditional UPDATE and the line items go in with one bulk insert.
+Orders accepted asynchronously are queued as OrderJobs and placed the same way, a batch at a time.
+Products with sharded stock (products.inventory) are not locked: their stock is taken from StockShard rows instead.
+"""
+from django.db import transaction
+from django.db.models import Case, F, Q, When
+from django.utils import timezone
+from rest_framework import status
+
+from products.cache import catalogue_changed
+from products import inventory
+from products.models import Product
+from products.pricing import PriceBook
+from .models import Order, OrderItem, OrderJob
+
+
+class CheckoutError(Exception):
+    def __init__(self, message, status_code=status.HTTP_400_BAD_REQUEST):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def lock_products(product_ids):
+    # One SELECT ... FOR UPDATE over the products, always in id order so concurrent checkouts can't deadlock.
+    # Sharded products are read without a lock, so orders for a hot SKU don't queue on its row
+    fields = ('id', 'name', 'price', 'stock_quantity', 'sharded_stock')
+    product_ids = sorted(product_ids)
+    products = {
+        product.pk: product
+        for product in Product.objects.select_for_update().filter(pk__in=product_ids, sharded_stock=False).order_by('pk').only(*fields)
+    }
+    if len(products) < len(product_ids):
+        products.update(
+            (product.pk, product) for product in Product.objects.filter(pk__in=product_ids, sharded_stock=True).only(*fields)
+        )
+    return products
+
+
+def split_sharded(quantities, products):
+    # ({product id: quantity} on the product rows, {product id: quantity} on stock shards)
+    sharded = {product_id for product_id, product in products.items() if product.sharded_stock}
+    return (
+        {product_id: quantity for product_id, quantity in quantities.items() if product_id not in sharded},
+        {product_id: quantity for product_id, quantity in quantities.items() if product_id in sharded},
+    )
+
+
+def take_stock(quantities):
+    # Decrement {product id: quantity} with a single UPDATE. The rows are locked, but the WHERE still guards
+    # stock should anything else write it without a lock
+    if not quantities:
+        return
+    in_stock = Q()
+    for product_id, quantity in quantities.items():
+        in_stock |= Q(pk=product_id, stock_quantity__gte=quantity)
+    updated = Product.objects.filter(in_stock).update(stock_quantity=Case(
+        *[When(pk=product_id, then=F('stock_quantity') - quantity) for product_id, quantity in quantities.items()]
+    ))
+    if updated != len(quantities):
+        raise CheckoutError("Stock changed while placing the order, please try again.", status.HTTP_409_CONFLICT)
+
+
+def parse_items(items):
+    # {product id: total quantity}; a product listed twice is ordered once with the summed quantity
+    if not isinstance(items, list):
+        raise CheckoutError("Items must be a list of {'product': product_id, 'quantity': number_of_items}.")
+    quantities = {}
+    for item in items:
+        product_id = item.get('product') if isinstance(item, dict) else None
+        quantity = item.get('quantity') if isinstance(item, dict) else None
+        if not product_id or not quantity:
+            raise CheckoutError("Each item must include 'product' and 'quantity'.")
+        try:
+            product_id, quantity = int(product_id), int(quantity)
+        except (TypeError, ValueError):
+            raise CheckoutError("'product' and 'quantity' must be whole numbers.")
+        if quantity < 1:
+            raise CheckoutError("'quantity' must be at least 1.")
+        quantities[product_id] = quantities.get(product_id, 0) + quantity
+    return quantities
+
+
+def insufficient_stock(product, available):
+    return CheckoutError(f"Insufficient stock for product {product.name}. Available stock: {available}.")
+
+
+def check_stock(quantities, products, stock):
+    # Products missing from `stock` are checked as their shards are reserved
+    for product_id in sorted(quantities):
+        product = products.get(product_id)
+        if product is None:
+            raise CheckoutError(f"Product with id {product_id} not found.", status.HTTP_404_NOT_FOUND)
+        if product_id in stock and stock[product_id] < quantities[product_id]:
+            raise insufficient_stock(product, stock[product_id])
+
+
+def reserve_sharded(quantities, products):
+    # One shard per product, in id order like every other stock lock
+    for product_id in sorted(quantities):
+        try:
+            inventory.reserve(product_id, quantities[product_id])
+        except inventory.InsufficientStock as e:
+            raise insufficient_stock(products[product_id], e.available)
+        except inventory.StockError:
+            raise CheckoutError("Stock changed while placing the order, please try again.", status.HTTP_409_CONFLICT)
+
+
+@transaction.atomic
+def place_order(user, items):
+    """
+    Create an order for `items` and take its stock, or raise CheckoutError and change nothing.
+    Costs a fixed number of queries however many lines the order has, plus two per product with sharded stock.
+    """
+    quantities = parse_items(items)
+    product_ids = sorted(quantities)
+
+    products = lock_products(product_ids)
+    stock = {product_id: product.stock_quantity for product_id, product in products.items() if not product.sharded_stock}
+    check_stock(quantities, products, stock)
+    row_quantities, sharded_quantities = split_sharded(quantities, products)
+    take_stock(row_quantities)
+    reserve_sharded(sharded_quantities, products)
+
+    # Price every product in the order from one discount query, as of the same moment
+    price_book = PriceBook.for_products(product_ids)
+    prices = {product_id: price_book.price_for(products[product_id]) for product_id in product_ids}
+    order = Order.objects.create(
+        user=user,
+        total_amount=sum(prices[product_id] * quantities[product_id] for product_id in product_ids),
+        item_count=sum(quantities.values()),
+    )
+    OrderItem.objects.bulk_create([
+        OrderItem(order=order, product_id=product_id, quantity=quantities[product_id], price_at_order=prices[product_id])
+        for product_id in product_ids
+    ])
+    catalogue_changed()  # update() skips post_save, but listings show stock
+    return order
+
+
+@transaction.atomic
+def enqueue_order(user, items):
+    # Async mode: only parse the items here and leave a pending order for the process_order_jobs worker
+    quantities = parse_items(items)
+    order = Order.objects.create(user=user, status='pending')
+    OrderJob.objects.create(order=order, items=sorted(quantities.items()))
+    return order
+
+
+@transaction.atomic
+def place_queued_orders(jobs):
+    """
+    Place a batch of claimed OrderJobs in one transaction: every product the batch touches is locked once, in id
+    order, and its stock taken with one UPDATE, so a hot SKU is locked once per batch rather than once per
+    order. Sharded products have all their shards locked once per batch and are written back the same way.
+    Jobs are served oldest first; one that can't be filled is marked failed and the rest go ahead.
+    Returns the number of orders placed.
+    """
+    jobs = sorted(jobs, key=lambda job: job.pk)
+    products = lock_products({product_id for job in jobs for product_id, _ in job.items})
+    shards = inventory.lock_shards([product_id for product_id, product in products.items() if product.sharded_stock])
+    stock = {product_id: 0 if product.sharded_stock else product.stock_quantity for product_id, product in products.items()}
+    stock.update((product_id, sum(shard.quantity for shard in product_shards)) for product_id, product_shards in shards.items())
+    price_book = PriceBook.for_products(products.keys())
+    now = timezone.now()
+
+    taken, items, placed = {}, [], 0
+    for job in jobs:
+        order = job.order
+        quantities = {product_id: quantity for product_id, quantity in job.items}
+        try:
+            check_stock(quantities, products, stock)
+        except CheckoutError as e:
+            job.status, job.error, order.status = OrderJob.FAILED, str(e), 'failed'
+        else:
+            prices = {product_id: price_book.price_for(products[product_id]) for product_id in quantities}
+            for product_id, quantity in quantities.items():
+                stock[product_id] -= quantity
+                taken[product_id] = taken.get(product_id, 0) + quantity
+                items.append(OrderItem(order=order, product_id=product_id, quantity=quantity, price_at_order=prices[product_id]))
+            order.total_amount = sum(prices[product_id] * quantity for product_id, quantity in quantities.items())
+            order.item_count = sum(quantities.values())
+            job.status, order.status = OrderJob.COMPLETED, 'completed'
+            placed += 1
+        order.updated_at = now
+
+    if taken:
+        row_taken, sharded_taken = split_sharded(taken, products)
+        take_stock(row_taken)
+        inventory.take_from_shards(shards, sharded_taken)
+        catalogue_changed()
+    OrderItem.objects.bulk_create(items)
+    Order.objects.bulk_update([job.order for job in jobs], ['status', 'total_amount', 'item_count', 'updated_at'])
+    OrderJob.objects.bulk_update(jobs, ['status', 'error'])
+    return placed
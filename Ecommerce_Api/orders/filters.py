@@ -0,0 +1,41 @@
+import django_filters
+from products.registry import categories
+from .models import DailyCategorySales, DailyProductSales, Order
+
+
+class OrderFilter(django_filters.FilterSet):
+    created_after = django_filters.IsoDateTimeFilter(field_name='created_at', lookup_expr='gte')
+    created_before = django_filters.IsoDateTimeFilter(field_name='created_at', lookup_expr='lte')
+    min_total = django_filters.NumberFilter(field_name='total_amount', lookup_expr='gte')
+    max_total = django_filters.NumberFilter(field_name='total_amount', lookup_expr='lte')
+
+    class Meta:
+        model = Order
+        fields = ['status', 'created_after', 'created_before', 'min_total', 'max_total']
+
+
+class SalesFilter(django_filters.FilterSet):
+    # An inclusive range of days, served by the rollups' (day, ...) unique index
+    start = django_filters.DateFilter(field_name='day', lookup_expr='gte')
+    end = django_filters.DateFilter(field_name='day', lookup_expr='lte')
+    category = django_filters.CharFilter(method='filter_category')  # Filter by exact category name
+    # One row per day (default), or totals over the whole range; grouping is done by SalesRollupView
+    group = django_filters.ChoiceFilter(choices=[('day', 'Day'), ('total', 'Total')], method='filter_group')
+
+    def filter_category(self, queryset, name, value):
+        return queryset.filter(category_id=categories.resolve(value))
+
+    def filter_group(self, queryset, name, value):
+        return queryset
+
+
+class ProductSalesFilter(SalesFilter):
+    class Meta:
+        model = DailyProductSales
+        fields = ['start', 'end', 'product', 'category', 'group']
+
+
+class CategorySalesFilter(SalesFilter):
+    class Meta:
+        model = DailyCategorySales
+        fields = ['start', 'end', 'category', 'group']
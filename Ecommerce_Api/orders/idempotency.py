@@ -0,0 +1,94 @@
+"""
+Idempotency-Key handling for order creation.
+
+The key row is inserted at the start of the checkout transaction and filled in with the response before it
+commits, so the order and its key are saved together or not at all. A retry that arrives while the first
+request is still running blocks on the unique (user, key) index entry until that transaction ends, then
+replays the committed response; if the first attempt rolled back, the retry runs checkout itself. Answers that
+ask the client to try again (409 and 5xx) roll the key back too, so the retry isn't answered with them forever.
+"""
+import hashlib
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import IdempotencyKey
+
+
+class IdempotencyError(Exception):
+    pass
+
+
+class RetryableOutcome(Exception):
+    # Raised inside the key's transaction to roll it back while still returning the handler's answer
+    def __init__(self, status_code, body):
+        super().__init__(status_code)
+        self.status_code = status_code
+        self.body = body
+
+
+def is_retryable(status_code):
+    return status_code == 409 or status_code >= 500
+
+
+def key_ttl():
+    return timedelta(seconds=getattr(settings, 'IDEMPOTENCY_KEY_TTL', 24 * 60 * 60))
+
+
+def request_hash(data):
+    body = json.dumps(data, sort_keys=True, separators=(',', ':'), cls=DjangoJSONEncoder)
+    return hashlib.sha256(body.encode('utf-8')).hexdigest()
+
+
+def replay(record, body_hash):
+    if record.request_hash != body_hash:
+        raise IdempotencyError("This Idempotency-Key was already used for a different request.")
+    return record.status_code, record.response, True
+
+
+def run_once(user, key, body_hash, handler):
+    """
+    Call handler() -> (status_code, body, order) at most once per user and key. Returns
+    (status_code, body, replayed). Exceptions from handler and retryable answers (see is_retryable) roll the key
+    back so the request can be retried.
+    """
+    record = IdempotencyKey.objects.filter(user=user, key=key).first()
+    if record is not None:
+        if record.created_at >= timezone.now() - key_ttl():
+            return replay(record, body_hash)
+        record.delete()  # Expired but not purged yet; the key is free again
+
+    claimed = False
+    try:
+        with transaction.atomic():
+            record = IdempotencyKey.objects.create(user=user, key=key, request_hash=body_hash)
+            claimed = True
+            status_code, body, order = handler()
+            if is_retryable(status_code):
+                raise RetryableOutcome(status_code, body)
+            record.status_code, record.response, record.order = status_code, body, order
+            record.save(update_fields=['status_code', 'response', 'order'])
+    except RetryableOutcome as outcome:
+        return outcome.status_code, outcome.body, False
+    except IntegrityError:
+        if claimed:
+            raise
+        # Another request with this key committed first (we waited on its index lock); replay its outcome
+        return replay(IdempotencyKey.objects.get(user=user, key=key), body_hash)
+    return status_code, body, False
+
+
+def purge_expired_keys(batch_size=1000):
+    # Delete keys past their TTL a batch at a time, so no single statement holds locks for long
+    cutoff = timezone.now() - key_ttl()
+    expired = IdempotencyKey.objects.filter(created_at__lt=cutoff).order_by('created_at')
+    purged = 0
+    while True:
+        ids = list(expired.values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return purged
+        purged += IdempotencyKey.objects.filter(pk__in=ids).delete()[0]
@@ -0,0 +1,86 @@
+"""
+The database-backed queue behind asynchronous order placement. Workers claim the oldest queued OrderJobs a
+batch at a time and hand them to orders.checkout.place_queued_orders.
+
+A batch that fails as a whole (e.g. on a lock wait timeout) is put back in the queue. Jobs being retried are
+claimed one at a time, so a job that keeps failing can't take the rest of its batch down with it, and a job
+claimed ORDER_JOB_MAX_ATTEMPTS times is marked failed instead of being retried forever.
+"""
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .checkout import place_queued_orders
+from .models import Order, OrderJob
+
+
+def max_attempts():
+    return getattr(settings, 'ORDER_JOB_MAX_ATTEMPTS', 3)
+
+
+def claim_jobs(batch_size):
+    # SKIP LOCKED lets several workers claim disjoint batches without waiting on each other; the conditional
+    # UPDATE keeps claims exclusive on databases without it (e.g. sqlite)
+    token = uuid.uuid4().hex
+    with transaction.atomic():
+        rows = list(
+            OrderJob.objects.select_for_update(skip_locked=True).filter(status=OrderJob.QUEUED)
+            .order_by('id').values_list('id', 'attempts')[:batch_size]
+        )
+        if not rows:
+            return []
+        if rows[0][1]:
+            job_ids = [rows[0][0]]  # A retry goes alone
+        else:
+            job_ids = []
+            for job_id, attempts in rows:
+                if attempts:
+                    break
+                job_ids.append(job_id)
+        OrderJob.objects.filter(pk__in=job_ids, status=OrderJob.QUEUED).update(
+            status=OrderJob.PROCESSING, claimed_by=token, claimed_at=timezone.now(), attempts=F('attempts') + 1,
+        )
+    return list(OrderJob.objects.filter(claimed_by=token, status=OrderJob.PROCESSING).select_related('order'))
+
+
+def give_up_or_requeue(jobs, error):
+    # Fail the claimed jobs that have used up their attempts, with `error` on the job, and queue the rest again
+    exhausted = jobs.filter(attempts__gte=max_attempts())
+    with transaction.atomic():
+        Order.objects.filter(job__in=exhausted).update(status='failed', updated_at=timezone.now())
+        failed = exhausted.update(status=OrderJob.FAILED, error=error, claimed_by='', claimed_at=None)
+        requeued = jobs.update(status=OrderJob.QUEUED, claimed_by='', claimed_at=None)
+    return requeued, failed
+
+
+def release_jobs(jobs, error):
+    # Put jobs back in the queue after a batch failed as a whole
+    return give_up_or_requeue(
+        OrderJob.objects.filter(pk__in=[job.pk for job in jobs], status=OrderJob.PROCESSING), error,
+    )
+
+
+def requeue_stale_jobs(older_than):
+    # Jobs claimed by a worker that died before finishing them. Returns (requeued, failed)
+    cutoff = timezone.now() - timedelta(seconds=older_than)
+    return give_up_or_requeue(
+        OrderJob.objects.filter(status=OrderJob.PROCESSING, claimed_at__lt=cutoff),
+        "The worker placing this order stopped before finishing it.",
+    )
+
+
+def process_batch(batch_size):
+    # Returns the number of jobs handled, placed or failed
+    jobs = claim_jobs(batch_size)
+    if not jobs:
+        return 0
+    try:
+        place_queued_orders(jobs)
+    except Exception as e:
+        release_jobs(jobs, f"Could not be placed after {max_attempts()} attempts: {e}")
+        raise
+    return len(jobs)
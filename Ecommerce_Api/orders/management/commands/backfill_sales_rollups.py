@@ -0,0 +1,51 @@
+import multiprocessing
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.models import Max, Min
+
+from orders.rollups import roll_up, unrolled_orders
+
+
+def roll_up_chunk(args):
+    # With --workers > 1 this runs in a forked process, which opens its own database connection
+    first_id, last_id, batch_size = args
+    rolled_up = 0
+    while True:
+        count = roll_up(batch_size, first_id, last_id)
+        if not count:
+            break
+        rolled_up += count
+    return rolled_up
+
+
+class Command(BaseCommand):
+    help = (
+        "Adds historical orders to the daily sales rollups, splitting them into id ranges rolled up in parallel. "
+        "Safe to run alongside compact_sales_rollups or again after an interruption."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--chunk-size', type=int, default=50000, help="Order ids per chunk handed to a worker.")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Orders rolled up per transaction.")
+
+    def handle(self, *args, **options):
+        bounds = unrolled_orders().aggregate(first=Min('pk'), last=Max('pk'))
+        if bounds['first'] is None:
+            self.stdout.write(self.style.SUCCESS("Rolled up 0 orders."))
+            return
+
+        chunk_size = options['chunk_size']
+        chunks = [
+            (first_id, min(first_id + chunk_size - 1, bounds['last']), options['batch_size'])
+            for first_id in range(bounds['first'], bounds['last'] + 1, chunk_size)
+        ]
+        self.stdout.write(f"Rolling up orders {bounds['first']} to {bounds['last']} in {len(chunks)} chunks...")
+        if options['workers'] <= 1:
+            rolled_up = sum(map(roll_up_chunk, chunks))
+        else:
+            connections.close_all()  # Forked workers must not share the parent's connection
+            with multiprocessing.get_context('fork').Pool(options['workers']) as pool:
+                rolled_up = sum(pool.imap_unordered(roll_up_chunk, chunks))
+        self.stdout.write(self.style.SUCCESS(f"Rolled up {rolled_up} orders."))
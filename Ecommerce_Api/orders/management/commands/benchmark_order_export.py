@@ -0,0 +1,103 @@
+import io
+import time
+import tracemalloc
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from orders.export import EXPORT_FIELDS, export_rows
+from orders.models import Order, OrderItem
+from orders.serializers import OrderHistorySerializer
+from products.bulk import stream_export
+from products.models import Category, Product
+
+
+class NullWriter(io.TextIOBase):
+    # Counts what would be written instead of keeping it, so only the export itself uses memory
+    def write(self, value):
+        return len(value)
+
+
+class Command(BaseCommand):
+    help = (
+        "Times the streaming order export in rows/s and compares its peak memory on a tenth of the orders and on "
+        "all of them with building the whole result in lists. Runs on throwaway rows inside a transaction that "
+        "is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=20000)
+        parser.add_argument('--items-per-order', type=int, default=3)
+        parser.add_argument('--chunk-size', type=int, default=2000)
+        parser.add_argument('--format', choices=['ndjson', 'csv'], default='csv')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            orders = self.create_orders(options['orders'], options['items_per_order'])
+            order_count = orders.count()
+            tenth = orders.filter(pk__lte=orders.order_by('pk').values_list('pk', flat=True)[max(order_count // 10, 1) - 1])
+
+            rows, elapsed = self.export(orders, options)
+            _, small_peak = self.measure_memory(lambda: self.export(tenth, options))
+            _, full_peak = self.measure_memory(lambda: self.export(orders, options))
+            _, list_peak = self.measure_memory(lambda: OrderHistorySerializer(orders.with_items(), many=True).data)
+            transaction.set_rollback(True)
+
+        self.stdout.write(f"{order_count} orders, {rows} rows, {options['format']}")
+        self.stdout.write(self.style.SUCCESS(f"Streaming export: {elapsed:.2f}s, {rows / elapsed:.0f} rows/s"))
+        self.stdout.write(f"Peak memory streaming a tenth of the orders: {small_peak / 2**20:.1f} MB")
+        self.stdout.write(f"Peak memory streaming all orders:            {full_peak / 2**20:.1f} MB")
+        self.stdout.write(f"Peak memory building all orders in lists:   {list_peak / 2**20:.1f} MB")
+
+    def export(self, orders, options):
+        count = 0
+        started = time.perf_counter()
+        output = NullWriter()
+        for chunk in stream_export(EXPORT_FIELDS, export_rows(orders, options['chunk_size']), options['format']):
+            output.write(chunk)
+            count += 1
+        rows = count - 1 if options['format'] == 'csv' else count  # Less the CSV header
+        return rows, time.perf_counter() - started
+
+    def measure_memory(self, fn):
+        tracemalloc.start()
+        try:
+            result = fn()
+            return result, tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    def create_orders(self, count, items_per_order):
+        user = get_user_model()(email='export-benchmark@example.invalid', username='export-benchmark')
+        user.set_unusable_password()
+        user.save()
+        category = Category.objects.create(name='Export benchmark')
+        products = Product.objects.bulk_create([
+            Product(
+                name=f'Export benchmark product {i}',
+                description='Export benchmark',
+                price=Decimal(10 + i),
+                effective_price=Decimal(10 + i),
+                category=category,
+                stock_quantity=1,
+                image_url='https://example.com/benchmark.jpg',
+                created_by=user,
+            )
+            for i in range(items_per_order)
+        ])
+        if not connection.features.can_return_rows_from_bulk_insert:
+            products = list(Product.objects.filter(category=category).order_by('id'))
+
+        Order.objects.bulk_create([
+            Order(user=user, total_amount=sum(product.price for product in products), item_count=items_per_order)
+            for _ in range(count)
+        ], batch_size=1000)
+        orders = Order.objects.filter(user=user)
+        OrderItem.objects.bulk_create([
+            OrderItem(order_id=order_id, product=product, quantity=1, price_at_order=product.price)
+            for order_id in orders.values_list('pk', flat=True).iterator()
+            for product in products
+        ], batch_size=1000)
+        return orders
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from orders.rollups import roll_up
+
+
+class Command(BaseCommand):
+    help = (
+        "Adds orders placed since the last run to the daily sales rollups read by the analytics API. "
+        "Schedule it every few minutes; each order is only ever counted once."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help="Orders rolled up per transaction.")
+
+    def handle(self, *args, **options):
+        rolled_up = 0
+        while True:
+            count = roll_up(options['batch_size'])
+            if not count:
+                break
+            rolled_up += count
+        self.stdout.write(self.style.SUCCESS(f"Rolled up {rolled_up} orders."))
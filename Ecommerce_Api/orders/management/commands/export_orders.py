@@ -0,0 +1,46 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from orders.export import EXPORT_FIELDS, export_rows
+from orders.filters import OrderFilter
+from orders.models import Order
+from products.bulk import FORMATS, stream_export
+
+
+class Command(BaseCommand):
+    help = "Streams orders and their line items as NDJSON or CSV for accounting, and reports rows/s."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=FORMATS, default='ndjson')
+        parser.add_argument('--output', default='-', help="File to write, or - for standard output.")
+        parser.add_argument('--created-after', help="ISO date or datetime.")
+        parser.add_argument('--created-before', help="ISO date or datetime.")
+        parser.add_argument('--status')
+        parser.add_argument('--chunk-size', type=int, default=2000, help="Orders fetched per chunk.")
+
+    def handle(self, *args, **options):
+        filters = {name: options[name] for name in ('created_after', 'created_before', 'status') if options[name]}
+        filterset = OrderFilter(filters, queryset=Order.objects.all())
+        if not filterset.is_valid():
+            raise CommandError(filterset.errors.as_text())
+
+        exported = 0
+
+        def counted(rows):
+            nonlocal exported
+            for row in rows:
+                exported += 1
+                yield row
+
+        started = time.perf_counter()
+        chunks = stream_export(EXPORT_FIELDS, counted(export_rows(filterset.qs, options['chunk_size'])), options['format'])
+        if options['output'] == '-':
+            sys.stdout.writelines(chunks)
+        else:
+            with open(options['output'], 'w', newline='', encoding='utf-8') as output:
+                output.writelines(chunks)
+        elapsed = time.perf_counter() - started
+        # On stderr, so it never ends up in an export written to standard output
+        self.stderr.write(f"Exported {exported} rows in {elapsed:.2f}s ({exported / elapsed if elapsed else 0:.0f} rows/s)")
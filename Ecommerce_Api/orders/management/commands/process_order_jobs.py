@@ -0,0 +1,62 @@
+import logging
+import multiprocessing
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from orders.jobs import process_batch, requeue_stale_jobs
+from products.inventory import sync_dirty_stock_sums
+
+logger = logging.getLogger(__name__)
+
+
+def work(args):
+    # Worker loop; with --workers > 1 each one runs in its own process with its own database connection
+    batch_size, once, poll_interval = args
+    handled = 0
+    while True:
+        try:
+            count = process_batch(batch_size)
+        except Exception:
+            if once:
+                raise
+            logger.exception("Order batch failed; its jobs were requeued or, out of attempts, failed")
+            count = 0
+        handled += count
+        if count:
+            continue
+        try:
+            sync_dirty_stock_sums()  # Sharded stock sums left behind by the last burst of orders
+        except Exception:
+            if once:
+                raise
+            logger.exception("Refreshing sharded stock sums failed")
+        if once:
+            return handled
+        time.sleep(poll_interval)
+
+
+class Command(BaseCommand):
+    help = "Places orders accepted with ?async=true, in batches, from a pool of worker processes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--batch-size', type=int, default=50, help="Queued orders placed per transaction.")
+        parser.add_argument('--once', action='store_true', help="Exit once the queue is empty instead of polling.")
+        parser.add_argument('--poll-interval', type=float, default=1.0, help="Pause when the queue is empty, in seconds.")
+        parser.add_argument('--stale-after', type=float, default=300, help="Requeue jobs claimed longer ago than this, in seconds.")
+
+    def handle(self, *args, **options):
+        requeued, failed = requeue_stale_jobs(options['stale_after'])
+        if requeued or failed:
+            self.stdout.write(f"Requeued {requeued} and failed {failed} jobs left behind by a stopped worker.")
+
+        args = (options['batch_size'], options['once'], options['poll_interval'])
+        if options['workers'] <= 1:
+            handled = work(args)
+        else:
+            connections.close_all()  # Forked workers must not share the parent's connection
+            with multiprocessing.get_context('fork').Pool(options['workers']) as pool:
+                handled = sum(pool.map(work, [args] * options['workers']))
+        self.stdout.write(self.style.SUCCESS(f"Processed {handled} queued orders."))
@@ -0,0 +1,46 @@
+from django.db import migrations
+from django.db.models import DecimalField, F, Sum
+
+BATCH_SIZE = 1000
+
+
+def backfill_order_totals(apps, schema_editor):
+    # Fill in total_amount and item_count for orders placed before they were stored, so the columns can be made
+    # NOT NULL. Walks the primary key so each batch is an index range scan, however many orders are left
+    Order = apps.get_model('orders', 'Order')
+    OrderItem = apps.get_model('orders', 'OrderItem')
+    pending = Order.objects.filter(total_amount__isnull=True).order_by('pk')
+    last_pk = 0
+    while True:
+        order_ids = list(pending.filter(pk__gt=last_pk).values_list('pk', flat=True)[:BATCH_SIZE])
+        if not order_ids:
+            break
+        last_pk = order_ids[-1]
+
+        totals = {
+            row['order_id']: row
+            for row in OrderItem.objects.filter(order_id__in=order_ids).values('order_id').annotate(
+                total=Sum(F('price_at_order') * F('quantity'), output_field=DecimalField(max_digits=12, decimal_places=2)),
+                count=Sum('quantity'),
+            ).order_by()
+        }
+        orders = [Order(pk=order_id) for order_id in order_ids]
+        for order in orders:
+            row = totals.get(order.pk, {})
+            order.total_amount = row.get('total') or 0
+            order.item_count = row.get('count') or 0
+        Order.objects.bulk_update(orders, ['total_amount', 'item_count'])
+
+    # Orders with a total but no count (never written that way, but the column allowed it)
+    Order.objects.filter(item_count__isnull=True).update(item_count=0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0009_sales_rollups'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_order_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.1 on 2026-10-18 18:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0011_order_totals_not_null'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderjob',
+            name='attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+    ]
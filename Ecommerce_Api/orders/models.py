@@ -1,18 +1,43 @@
 from django.db import models
 from django.conf import settings
-from products.models import Product  # Assuming you have a Product model in the products app
+from products.models import Category, Product  # Assuming you have a Product model in the products app
+
+class OrderQuerySet(models.QuerySet):
+    def with_items(self):
+        # One extra query for all the lines of the fetched orders, product names joined in
+        return self.prefetch_related(models.Prefetch(
+            'items',
+            queryset=OrderItem.objects.select_related('product').only(
+                'id', 'order', 'product', 'quantity', 'price_at_order', 'product__name'
+            ).order_by('id'),
+        ))
+
 
 class Order(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
-    status = models.CharField(max_length=20, default='completed')  # pending, completed, canceled
+    status = models.CharField(max_length=20, default='completed')  # pending, completed, canceled, failed
+    # Stored at checkout since the items never change afterwards; 0 while a queued order waits to be placed
+    total_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    item_count = models.PositiveIntegerField(default=0)  # Total quantity across the order's lines
+    rolled_up = models.BooleanField(default=False, editable=False)  # Counted in the sales rollups (orders.rollups)
+
+    objects = OrderQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # A user's order history, newest first and filtered by date
+            models.Index(fields=['user', 'created_at'], name='order_user_created_idx'),
+            # compact_sales_rollups takes the oldest orders not rolled up yet
+            models.Index(fields=['rolled_up', 'id'], name='order_rolled_up_id_idx'),
+        ]
 
     def __str__(self):
         return f"Order {self.id} by {self.user}"
 
     def total_price(self):
-        return sum(item.total_price() for item in self.items.all())
+        return self.total_amount
 
     def reduce_stock(self):
         for item in self.items.all():
@@ -29,3 +54,93 @@ class OrderItem(models.Model):
 
     def __str__(self):
         return f"{self.quantity} of {self.product.name}"
+
+
+class IdempotencyKey(models.Model):
+    # The outcome of one POST /orders/create/ per client-chosen Idempotency-Key, replayed to retries
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    key = models.CharField(max_length=255)
+    request_hash = models.CharField(max_length=64)  # sha256 of the request body, to catch a key reused for another order
+    status_code = models.PositiveSmallIntegerField(null=True)
+    response = models.JSONField(null=True)
+    order = models.ForeignKey(Order, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='idempotencykey_user_key_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.key} ({self.user})"
+
+
+class OrderJob(models.Model):
+    # An order accepted with ?async=true, waiting for the process_order_jobs worker to place it
+    QUEUED = 'queued'
+    PROCESSING = 'processing'
+    COMPLETED = 'completed'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(QUEUED, 'Queued'), (PROCESSING, 'Processing'), (COMPLETED, 'Completed'), (FAILED, 'Failed')]
+
+    order = models.OneToOneField(Order, on_delete=models.CASCADE, related_name='job')  # Pending until placed
+    items = models.JSONField()  # [[product_id, quantity], ...] as parsed by orders.checkout.parse_items
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=QUEUED)
+    error = models.TextField(blank=True)
+    claimed_by = models.CharField(max_length=64, blank=True)  # Token of the worker batch that took the job
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)  # Claims so far, including ones whose batch failed
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # Workers take the oldest queued jobs first
+            models.Index(fields=['status', 'id'], name='orderjob_status_id_idx'),
+        ]
+
+    def __str__(self):
+        return f"Job for order {self.order_id} ({self.status})"
+
+
+class SalesRollup(models.Model):
+    # Revenue, units and orders for one day, added to by orders.rollups as orders are rolled up
+    day = models.DateField()
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    units = models.PositiveIntegerField(default=0)
+    orders = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        abstract = True
+
+
+class DailyProductSales(SalesRollup):
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='+')  # The product's category when this row was first rolled up
+
+    class Meta:
+        constraints = [
+            # Also serves range queries across all products
+            models.UniqueConstraint(fields=['day', 'product'], name='productsales_day_product_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['product', 'day'], name='productsales_product_day_idx'),
+            models.Index(fields=['category', 'day'], name='productsales_category_day_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.day} product {self.product_id}: {self.units} units, {self.revenue}"
+
+
+class DailyCategorySales(SalesRollup):
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='+')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'category'], name='categorysales_day_category_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['category', 'day'], name='categorysales_category_day_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.day} category {self.category_id}: {self.units} units, {self.revenue}"
@@ -0,0 +1,16 @@
+from rest_framework.pagination import PageNumberPagination
+
+from products.pagination import KeysetPagination
+
+
+class OrderKeysetPagination(KeysetPagination):
+    # Newest first; seeks on (created_at, id) within the user's orders via the (user, created_at) index
+    ordering_fields = ('created_at', 'total_amount')
+    default_ordering = '-created_at'
+
+
+class SalesPagination(PageNumberPagination):
+    # Rollup rows are small; a report over a few months fits in a page or two
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
@@ -0,0 +1,88 @@
+"""
+Daily sales rollups per product and per category, so sales reports never scan OrderItem.
+
+Orders are folded in after checkout rather than during it, which would make each (product, day) row as hot as
+the product row itself: compact_sales_rollups rolls up new orders a batch at a time, and backfill_sales_rollups
+works through historical ones from several processes. Each order is locked and marked rolled_up in the same
+transaction that adds it to the rollups, so it is counted exactly once whichever job gets to it.
+"""
+from django.db import transaction
+from django.db.models import Count, DecimalField, F, Sum
+from django.db.models.functions import TruncDate
+
+from .models import DailyCategorySales, DailyProductSales, Order, OrderItem
+
+
+def unrolled_orders():
+    # Orders not counted yet; pending ones wait until the worker has placed them
+    return Order.objects.filter(rolled_up=False).exclude(status='pending')
+
+
+def sales_by(order_ids, *keys):
+    # {(day, *keys): (revenue, units, orders)} for the completed orders among `order_ids`, in one query
+    rows = OrderItem.objects.filter(order_id__in=order_ids, order__status='completed').annotate(
+        day=TruncDate('order__created_at'),
+    ).values('day', *keys).annotate(
+        revenue=Sum(F('price_at_order') * F('quantity'), output_field=DecimalField(max_digits=14, decimal_places=2)),
+        units=Sum('quantity'),
+        order_count=Count('order_id', distinct=True),
+    ).order_by()
+    return {
+        (row['day'], *(row[key] for key in keys)): (row['revenue'], row['units'], row['order_count'])
+        for row in rows
+    }
+
+
+def add_to_rollup(model, key, sales, defaults=None):
+    """
+    Add {(day, key value): (revenue, units, orders)} to `model`'s rows. Missing rows are inserted empty first
+    (with any `defaults` for their key) so every row can be locked, in (day, key) order like any other rollup
+    writer, and added to in memory.
+    """
+    if not sales:
+        return
+    defaults = defaults or {}
+    model.objects.bulk_create(
+        [model(day=day, **{key: value}, **defaults.get((day, value), {})) for day, value in sorted(sales)],
+        ignore_conflicts=True,
+    )
+    rows = model.objects.select_for_update().filter(
+        day__in={day for day, _ in sales}, **{f'{key}__in': {value for _, value in sales}},
+    ).order_by('day', key)
+    changed = []
+    for row in rows:
+        added = sales.get((row.day, getattr(row, key)))
+        if added:
+            revenue, units, orders = added
+            row.revenue += revenue
+            row.units += units
+            row.orders += orders
+            changed.append(row)
+    model.objects.bulk_update(changed, ['revenue', 'units', 'orders'])
+
+
+@transaction.atomic
+def roll_up(limit, first_id=None, last_id=None):
+    """
+    Add up to `limit` unrolled orders, oldest first and optionally within an id range, to the daily rollups.
+    Orders another job holds are skipped. Returns how many orders were rolled up.
+    """
+    orders = unrolled_orders()
+    if first_id is not None:
+        orders = orders.filter(pk__gte=first_id, pk__lte=last_id)
+    order_ids = list(
+        orders.select_for_update(skip_locked=True).order_by('pk').values_list('pk', flat=True)[:limit]
+    )
+    if not order_ids:
+        return 0
+
+    # Products' categories as they are now, not when the orders were placed
+    by_product = sales_by(order_ids, 'product_id', 'product__category_id')
+    add_to_rollup(
+        DailyProductSales, 'product_id',
+        {(day, product_id): totals for (day, product_id, _), totals in by_product.items()},
+        defaults={(day, product_id): {'category_id': category_id} for day, product_id, category_id in by_product},
+    )
+    add_to_rollup(DailyCategorySales, 'category_id', sales_by(order_ids, 'product__category_id'))
+    Order.objects.filter(pk__in=order_ids).update(rolled_up=True)
+    return len(order_ids)
@@ -1,6 +1,8 @@
 from rest_framework import serializers
 from .models import Order, OrderItem
 from products.models import Product
+from products.pricing import PriceBook
+from products.serializers import CategoryNameField
 
 class OrderItemSerializer(serializers.ModelSerializer):
     product = serializers.PrimaryKeyRelatedField(queryset=Product.objects.all(), required=True)
@@ -15,20 +17,25 @@ class OrderSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Order
-        fields = ['id', 'user', 'status', 'items', 'created_at', 'updated_at']
-        read_only_fields = ['id', 'user', 'created_at', 'updated_at']
+        fields = ['id', 'user', 'status', 'items', 'total_amount', 'item_count', 'created_at', 'updated_at']
+        read_only_fields = ['id', 'user', 'total_amount', 'item_count', 'created_at', 'updated_at']
 
     def create(self, validated_data):
         items_data = validated_data.pop('items')
         if not items_data:
             raise serializers.ValidationError({"items": "You must provide at least one product and its quantity."})
         
-        order = Order.objects.create(**validated_data)
+        price_book = PriceBook.for_products({item_data['product'].pk for item_data in items_data})
+        order = Order.objects.create(
+            total_amount=sum(price_book.price_for(item_data['product']) * item_data['quantity'] for item_data in items_data),
+            item_count=sum(item_data['quantity'] for item_data in items_data),
+            **validated_data
+        )
 
         for item_data in items_data:
             product = item_data['product']
             quantity = item_data['quantity']
-            OrderItem.objects.create(order=order, product=product, quantity=quantity)
+            OrderItem.objects.create(order=order, product=product, quantity=quantity, price_at_order=price_book.price_for(product))
             product.reduce_stock_quantity(quantity)
 
         return order
@@ -39,3 +46,42 @@ class OrderSerializer(serializers.ModelSerializer):
                 "items": "No items provided. Please include at least one product with a quantity in the format: 'items': [{'product': 1, 'quantity': 2}]"
             })
         return value
+
+
+class OrderHistoryItemSerializer(serializers.ModelSerializer):
+    product_name = serializers.CharField(source='product.name', read_only=True)
+    total_price = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True, coerce_to_string=False)
+
+    class Meta:
+        model = OrderItem
+        fields = ['product_name', 'quantity', 'total_price']
+
+
+class OrderHistorySerializer(serializers.ModelSerializer):
+    # Expects the items prefetched by Order.objects.with_items()
+    order_id = serializers.IntegerField(source='id', read_only=True)
+    total_price = serializers.DecimalField(
+        source='total_amount', max_digits=12, decimal_places=2, read_only=True, coerce_to_string=False,
+    )
+    items = OrderHistoryItemSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = Order
+        fields = ['order_id', 'status', 'created_at', 'updated_at', 'total_price', 'item_count', 'items']
+
+
+class SalesSerializer(serializers.Serializer):
+    # A grouped rollup row from SalesRollupView; `day` is left out of totals over a range
+    day = serializers.DateField(required=False)
+    revenue = serializers.DecimalField(source='revenue_total', max_digits=14, decimal_places=2, coerce_to_string=False)
+    units = serializers.IntegerField(source='units_total')
+    orders = serializers.IntegerField(source='orders_total')
+
+
+class ProductSalesSerializer(SalesSerializer):
+    product = serializers.IntegerField(source='product_id')
+    category = CategoryNameField(source='category_id')
+
+
+class CategorySalesSerializer(SalesSerializer):
+    category = CategoryNameField(source='category_id')
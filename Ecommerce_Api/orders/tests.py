@@ -1,3 +1,671 @@
-from django.test import TestCase
+import csv
+import json
+import multiprocessing
+import random
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection, connections
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models import Sum
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from products import inventory
+from products.cache import get_cache
+from products.models import Category, Discount, Product, StockShard
+from products.registry import categories
+from . import jobs
+from .checkout import CheckoutError, enqueue_order, place_order
+from .export import EXPORT_FIELDS, export_rows
+from .models import DailyCategorySales, DailyProductSales, IdempotencyKey, Order, OrderItem, OrderJob
+
+User = get_user_model()
+
+
+def run_orders(args):
+    # Runs in a forked worker process with its own database connection
+    user_id, hot_id, cold_ids, orders = args
+    connections.close_all()
+    user = User.objects.get(pk=user_id)
+    placed = 0
+    for _ in range(orders):
+        items = [{'product': product_id, 'quantity': 1} for product_id in [hot_id, *cold_ids]]
+        random.shuffle(items)  # place_order locks in id order whatever order the lines come in
+        try:
+            place_order(user, items)
+            placed += 1
+        except CheckoutError:
+            pass
+    connections.close_all()
+    return placed
+
+
+def create_product(user, category, name, stock, price=Decimal('10.00')):
+    return Product.objects.create(
+        name=name, description='Checkout test', price=price, category=category,
+        stock_quantity=stock, image_url='https://example.com/product.jpg', created_by=user,
+    )
+
+
+def create_order(user, lines, status='completed', created_at=None):
+    # An order of [(product, quantity, price)] lines, without going through checkout
+    order = Order.objects.create(
+        user=user, status=status, total_amount=sum((price * quantity for _, quantity, price in lines), Decimal('0')),
+        item_count=sum(quantity for _, quantity, _ in lines),
+    )
+    OrderItem.objects.bulk_create([
+        OrderItem(order=order, product=product, quantity=quantity, price_at_order=price)
+        for product, quantity, price in lines
+    ])
+    if created_at:
+        Order.objects.filter(pk=order.pk).update(created_at=created_at)
+    return order
+
+
+@skipUnless(connection.vendor in ('mysql', 'postgresql'), "Needs a database server that allows concurrent writers.")
+class CheckoutStressTests(TransactionTestCase):
+    processes = 8
+    orders_per_process = 25
+    hot_stock = 100  # Half of the orders fired at the hot SKU can succeed
+    cold_skus = 9
+
+    def setUp(self):
+        self.user = User.objects.create_user(email='stress@example.com', password='pass12345')
+        self.category = Category.objects.create(name='Stress')
+
+    def test_concurrent_orders_never_oversell(self):
+        hot = create_product(self.user, self.category, 'Hot SKU', self.hot_stock)
+        cold = [create_product(self.user, self.category, f'Cold SKU {i}', 100000) for i in range(self.cold_skus)]
+        args = (self.user.pk, hot.pk, [product.pk for product in cold], self.orders_per_process)
+        connections.close_all()  # Forked workers must not share the parent's connection
+        with multiprocessing.get_context('fork').Pool(self.processes) as pool:
+            placed = sum(pool.map(run_orders, [args] * self.processes))
+
+        hot.refresh_from_db()
+        sold = OrderItem.objects.filter(product=hot).aggregate(total=Sum('quantity'))['total']
+        self.assertEqual(placed, self.hot_stock)
+        self.assertEqual(sold, self.hot_stock)
+        self.assertEqual(hot.stock_quantity, 0)
+        self.assertEqual(Order.objects.count(), placed)  # Rejected orders leave nothing behind
+
+
+class CheckoutTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='checkout@example.com', password='pass12345')
+        category = Category.objects.create(name='Checkout')
+        cls.cheap = create_product(cls.user, category, 'Cheap SKU', 10, Decimal('2.50'))
+        cls.scarce = create_product(cls.user, category, 'Scarce SKU', 1, Decimal('40.00'))
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def order(self, items):
+        return self.client.post('/orders/create/', {'items': items}, format='json', secure=True)
+
+    def stock(self):
+        return dict(Product.objects.values_list('pk', 'stock_quantity'))
+
+    def test_insufficient_stock_rolls_back_the_whole_order(self):
+        response = self.order([{'product': self.cheap.pk, 'quantity': 3}, {'product': self.scarce.pk, 'quantity': 2}])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Available stock: 1', response.data['error'])
+        self.assertEqual(self.stock(), {self.cheap.pk: 10, self.scarce.pk: 1})
+        self.assertFalse(Order.objects.exists())
+
+    def test_duplicate_lines_are_merged(self):
+        response = self.order([
+            {'product': self.cheap.pk, 'quantity': 2}, {'product': self.scarce.pk, 'quantity': 1},
+            {'product': self.cheap.pk, 'quantity': 3},
+        ])
+        self.assertEqual(response.status_code, 201)
+        order = Order.objects.get(pk=response.data['order_id'])
+        self.assertEqual(sorted(order.items.values_list('product_id', 'quantity')), [(self.cheap.pk, 5), (self.scarce.pk, 1)])
+        self.assertEqual((order.total_amount, order.item_count), (Decimal('52.50'), 6))
+        self.assertEqual(self.stock(), {self.cheap.pk: 5, self.scarce.pk: 0})
+
+        # Merged lines are checked against stock together
+        response = self.order([{'product': self.cheap.pk, 'quantity': 3}, {'product': self.cheap.pk, 'quantity': 3}])
+        self.assertEqual(response.status_code, 400)
+
+    def test_unknown_product_is_404(self):
+        response = self.order([{'product': self.cheap.pk, 'quantity': 1}, {'product': 999999, 'quantity': 1}])
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.stock()[self.cheap.pk], 10)
+
+    def test_lines_are_priced_after_discounts(self):
+        now = timezone.now()
+        Discount.objects.create(
+            product=self.scarce, discount_percentage=Decimal('12.50'),
+            start_date=now - timedelta(hours=1), end_date=now + timedelta(hours=1),
+        )
+        response = self.order([{'product': self.scarce.pk, 'quantity': 1}, {'product': self.cheap.pk, 'quantity': 2}])
+        self.assertEqual(response.status_code, 201)
+        order = Order.objects.get(pk=response.data['order_id'])
+        prices = dict(order.items.values_list('product_id', 'price_at_order'))
+        self.assertEqual(prices, {self.scarce.pk: Decimal('35.00'), self.cheap.pk: Decimal('2.50')})
+        self.assertEqual(order.total_amount, Decimal('40.00'))
+
+
+class ShardedCheckoutTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='hot@example.com', password='pass12345')
+        category = Category.objects.create(name='Sharded')
+        cls.hot = create_product(cls.user, category, 'Hot SKU', 12, Decimal('5.00'))
+        cls.plain = create_product(cls.user, category, 'Plain SKU', 3, Decimal('1.00'))
+
+    def setUp(self):
+        inventory.enable_sharding(self.hot.pk, shards=3)
+
+    def shard_total(self):
+        return sum(StockShard.objects.filter(product=self.hot).values_list('quantity', flat=True))
+
+    def test_order_worker_catches_up_stock_sums(self):
+        get_cache().clear()
+        for quantity in (2, 3):
+            with self.captureOnCommitCallbacks(execute=True):
+                place_order(self.user, [{'product': self.hot.pk, 'quantity': quantity}])
+        self.assertEqual(Product.objects.get(pk=self.hot.pk).stock_quantity, 10)  # Second order inside the interval
+        call_command('process_order_jobs', '--once', '--workers', '1', stdout=StringIO())
+        self.assertEqual(Product.objects.get(pk=self.hot.pk).stock_quantity, 7)
+
+    def test_place_order_reserves_from_shards(self):
+        order = place_order(self.user, [{'product': self.hot.pk, 'quantity': 3}, {'product': self.plain.pk, 'quantity': 1}])
+        self.assertEqual((order.total_amount, order.item_count), (Decimal('16.00'), 4))
+        self.assertEqual(self.shard_total(), 9)
+        self.assertEqual(Product.objects.get(pk=self.plain.pk).stock_quantity, 2)
+
+        # More than any single shard holds: merged
+        place_order(self.user, [{'product': self.hot.pk, 'quantity': 8}])
+        self.assertEqual(self.shard_total(), 1)
+
+    def test_insufficient_sharded_stock_rolls_back_the_order(self):
+        with self.assertRaises(CheckoutError) as raised:
+            place_order(self.user, [{'product': self.plain.pk, 'quantity': 2}, {'product': self.hot.pk, 'quantity': 13}])
+        self.assertIn('Available stock: 12', str(raised.exception))
+        self.assertEqual(self.shard_total(), 12)
+        self.assertEqual(Product.objects.get(pk=self.plain.pk).stock_quantity, 3)
+        self.assertFalse(Order.objects.exists())
+
+    def test_queued_orders_take_from_shards(self):
+        orders = [enqueue_order(self.user, [{'product': self.hot.pk, 'quantity': quantity}]) for quantity in (5, 6, 4)]
+        call_command('process_order_jobs', workers=1, once=True, stdout=StringIO())
+        statuses = [Order.objects.get(pk=order.pk).status for order in orders]
+        self.assertEqual(statuses, ['completed', 'completed', 'failed'])
+        self.assertEqual(self.shard_total(), 1)
+        self.assertEqual(sorted(StockShard.objects.filter(product=self.hot).values_list('quantity', flat=True)), [0, 0, 1])
+
+
+class OrderQueueTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='queue@example.com', password='pass12345')
+        category = Category.objects.create(name='Queue')
+        self.product = Product.objects.create(
+            name='Queued SKU', description='Queue test', price=Decimal('4.00'), category=category,
+            stock_quantity=5, image_url='https://example.com/product.jpg', created_by=self.user,
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def enqueue(self, quantity):
+        response = self.client.post(
+            '/orders/create/?async=true', {'items': [{'product': self.product.pk, 'quantity': quantity}]},
+            format='json', secure=True,
+        )
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response['Location'], response.data['status_url'])
+        return response.data['status_url']
+
+    def test_queued_orders_are_placed_by_the_worker(self):
+        first, second, third = self.enqueue(3), self.enqueue(3), self.enqueue(2)
+
+        pending = self.client.get(first, secure=True)
+        self.assertEqual(pending.data['status'], 'pending')
+        self.assertEqual(pending.data['items'], [])
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock_quantity, 5)  # Nothing is reserved until the worker runs
+
+        call_command('process_order_jobs', workers=1, batch_size=2, once=True, stdout=StringIO())
+
+        placed = self.client.get(first, secure=True).data
+        self.assertEqual(placed['status'], 'completed')
+        self.assertEqual(placed['total_price'], Decimal('12.00'))
+        self.assertEqual(placed['items'][0]['quantity'], 3)
+
+        # Oldest first: the second order no longer fits, the third still does
+        failed = self.client.get(second, secure=True).data
+        self.assertEqual(failed['status'], 'failed')
+        self.assertIn('Insufficient stock', failed['error'])
+        self.assertEqual(self.client.get(third, secure=True).data['status'], 'completed')
+
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock_quantity, 0)
+        self.assertFalse(OrderJob.objects.exclude(status__in=[OrderJob.COMPLETED, OrderJob.FAILED]).exists())
+
+
+    def test_failing_batch_is_retried_job_by_job_then_given_up(self):
+        good, bad = self.enqueue(1), self.enqueue(1)
+        bad_job = OrderJob.objects.order_by('pk').last()
+        place_queued_orders = jobs.place_queued_orders
+
+        def place(batch):
+            if any(job.pk == bad_job.pk for job in batch):
+                raise RuntimeError("Lock wait timeout exceeded")
+            return place_queued_orders(batch)
+
+        handled = []
+        with mock.patch.object(jobs, 'place_queued_orders', place):
+            for _ in range(5):
+                try:
+                    handled.append(jobs.process_batch(10))
+                except RuntimeError:
+                    handled.append('failed')
+        # Both fail together, then the good one goes through alone and the bad one uses up its attempts
+        self.assertEqual(handled, ['failed', 1, 'failed', 'failed', 0])
+
+        self.assertEqual(self.client.get(good, secure=True).data['status'], 'completed')
+        failed = self.client.get(bad, secure=True).data
+        self.assertEqual(failed['status'], 'failed')
+        self.assertIn('after 3 attempts: Lock wait timeout exceeded', failed['error'])
+        bad_job.refresh_from_db()
+        self.assertEqual((bad_job.status, bad_job.attempts), (OrderJob.FAILED, 3))
+
+    def test_stale_jobs_are_requeued_until_out_of_attempts(self):
+        self.enqueue(1)
+        self.enqueue(1)
+        stale, exhausted = jobs.claim_jobs(10)
+        OrderJob.objects.filter(pk=exhausted.pk).update(attempts=3)
+        OrderJob.objects.update(claimed_at=timezone.now() - timedelta(hours=1))
+
+        out = StringIO()
+        call_command('process_order_jobs', workers=1, once=True, stale_after=60, stdout=out)
+        self.assertIn('Requeued 1 and failed 1 jobs', out.getvalue())
+        self.assertEqual(OrderJob.objects.get(pk=stale.pk).status, OrderJob.COMPLETED)
+        exhausted.refresh_from_db()
+        self.assertEqual((exhausted.status, exhausted.order.status), (OrderJob.FAILED, 'failed'))
+
+
+class OrderTotalsMigrationTests(TransactionTestCase):
+    before = [('orders', '0009_sales_rollups')]
+
+    def migrate(self, targets=None):
+        # To `targets`, or back to the latest migrations
+        executor = MigrationExecutor(connection)
+        targets = targets or executor.loader.graph.leaf_nodes()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def test_orders_without_stored_totals_are_backfilled(self):
+        apps = self.migrate(self.before)
+        Order = apps.get_model('orders', 'Order')
+        OrderItem = apps.get_model('orders', 'OrderItem')
+        Product = apps.get_model('products', 'Product')
+        user = apps.get_model('users', 'User').objects.create(email='old@example.com', username='old', password='!')
+        category = apps.get_model('products', 'Category').objects.create(name='Old')
+        product = Product.objects.create(
+            name='Old SKU', description='Legacy', price=Decimal('3.00'), effective_price=Decimal('3.00'),
+            category=category, stock_quantity=5, image_url='https://example.com/product.jpg', created_by=user,
+        )
+        legacy = Order.objects.create(user=user)  # Placed before totals were stored
+        OrderItem.objects.create(order=legacy, product=product, quantity=2, price_at_order=Decimal('3.00'))
+        OrderItem.objects.create(order=legacy, product=product, quantity=1, price_at_order=Decimal('2.25'))
+        empty = Order.objects.create(user=user)
+        stored = Order.objects.create(user=user, total_amount=Decimal('9.99'), item_count=4)
+        self.assertIsNone(Order.objects.get(pk=legacy.pk).total_amount)
+
+        self.migrate()
+        totals = {order.pk: (order.total_amount, order.item_count) for order in Order.objects.all()}
+        self.assertEqual(totals, {
+            legacy.pk: (Decimal('8.25'), 3),
+            empty.pk: (Decimal('0.00'), 0),
+            stored.pk: (Decimal('9.99'), 4),
+        })
+
+
+class OrderListTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='history@example.com', password='pass12345')
+        other = User.objects.create(email='someone@example.com', username='someone', password='!')
+        now = timezone.now()
+        totals = [Decimal('5.00'), Decimal('20.00'), Decimal('0'), Decimal('20.00'), Decimal('75.50'), Decimal('12.00'), Decimal('3.10')]
+        for i, total in enumerate(totals):
+            order = Order.objects.create(
+                user=cls.user, total_amount=total, item_count=1, status='pending' if not total else 'completed',
+            )
+            Order.objects.filter(pk=order.pk).update(created_at=now - timedelta(days=len(totals) - i))
+        Order.objects.create(user=other, total_amount=Decimal('50.00'), item_count=1)
+        cls.orders = list(Order.objects.filter(user=cls.user))
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def walk(self, params):
+        url, ids = '/orders/list/', []
+        while url:
+            response = self.client.get(url, params, secure=True)
+            self.assertEqual(response.status_code, 200)
+            ids += [order['order_id'] for order in response.data['results']]
+            url, params = response.data['next'], None
+        return ids
+
+    def test_newest_first_by_default(self):
+        expected = sorted(self.orders, key=lambda order: (order.created_at, order.pk), reverse=True)
+        self.assertEqual(self.walk({'page_size': 3}), [order.pk for order in expected])
+
+    def test_ordering_by_total_keeps_every_order(self):
+        expected = sorted(self.orders, key=lambda order: (order.total_amount, order.pk))
+        self.assertEqual(self.walk({'ordering': 'total_amount', 'page_size': 2}), [order.pk for order in expected])
+        self.assertEqual(self.walk({'ordering': '-total_amount', 'page_size': 2}), [order.pk for order in reversed(expected)])
+
+    def test_filters(self):
+        now = timezone.now()
+        by_id = {order.pk: order for order in self.orders}
+        ids = self.walk({'status': 'pending'})
+        self.assertEqual([by_id[pk].total_amount for pk in ids], [Decimal('0')])
+
+        ids = self.walk({'min_total': '5', 'max_total': '20', 'ordering': 'total_amount'})
+        self.assertEqual([by_id[pk].total_amount for pk in ids], [Decimal('5.00'), Decimal('12.00'), Decimal('20.00'), Decimal('20.00')])
+
+        ids = self.walk({'created_after': (now - timedelta(days=3, hours=1)).isoformat(), 'created_before': (now - timedelta(days=1, hours=12)).isoformat()})
+        self.assertEqual([by_id[pk].total_amount for pk in ids], [Decimal('12.00'), Decimal('75.50')])
+
+
+class IdempotencyTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='retry@example.com', password='pass12345')
+        cls.product = create_product(cls.user, Category.objects.create(name='Retry'), 'Retried SKU', 10)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def order(self, key, quantity=1):
+        return self.client.post(
+            '/orders/create/', {'items': [{'product': self.product.pk, 'quantity': quantity}]},
+            format='json', secure=True, HTTP_IDEMPOTENCY_KEY=key,
+        )
+
+    def stock(self):
+        return Product.objects.get(pk=self.product.pk).stock_quantity
+
+    def test_replay_returns_the_stored_response(self):
+        first = self.order('key-1')
+        self.assertEqual(first.status_code, 201)
+        self.assertNotIn('Idempotent-Replayed', first)
+
+        again = self.order('key-1')
+        self.assertEqual(again.status_code, 201)
+        self.assertEqual(again.data, first.data)
+        self.assertEqual(again['Idempotent-Replayed'], 'true')
+        self.assertEqual((Order.objects.count(), self.stock()), (1, 9))
+
+        # Refusals are replayed too, even once stock would allow the order
+        refused = self.order('key-2', quantity=50)
+        self.assertEqual(refused.status_code, 400)
+        Product.objects.filter(pk=self.product.pk).update(stock_quantity=100)
+        self.assertEqual(self.order('key-2', quantity=50).status_code, 400)
+
+    def test_retry_after_a_conflict_runs_checkout_again(self):
+        calls = []
+
+        def conflict_once(user, items):
+            calls.append(items)
+            if len(calls) == 1:
+                raise CheckoutError("Stock changed while placing the order, please try again.", 409)
+            return place_order(user, items)
+
+        with mock.patch('orders.views.place_order', side_effect=conflict_once):
+            self.assertEqual(self.order('key-1').status_code, 409)
+            self.assertFalse(IdempotencyKey.objects.exists())
+            response = self.order('key-1')
+        self.assertEqual(response.status_code, 201)
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.assertEqual((Order.objects.count(), self.stock()), (1, 9))
+        self.assertEqual(self.order('key-1')['Idempotent-Replayed'], 'true')
+
+    def test_same_key_with_a_different_body_is_422(self):
+        self.order('key-1')
+        response = self.order('key-1', quantity=2)
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual((Order.objects.count(), self.stock()), (1, 9))
+
+    def test_expired_key_runs_again(self):
+        self.order('key-1')
+        IdempotencyKey.objects.update(created_at=timezone.now() - timedelta(days=2))
+        response = self.order('key-1')
+        self.assertEqual(response.status_code, 201)
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.assertEqual((Order.objects.count(), self.stock()), (2, 8))
+        self.assertEqual(IdempotencyKey.objects.count(), 1)
+
+    def test_purge_removes_only_expired_keys(self):
+        for key in ('old-1', 'old-2', 'fresh'):
+            self.order(key)
+        IdempotencyKey.objects.exclude(key='fresh').update(created_at=timezone.now() - timedelta(days=2))
+        out = StringIO()
+        call_command('purge_idempotency_keys', '--batch-size', '1', stdout=out)
+        self.assertIn('Purged 2', out.getvalue())
+        self.assertEqual(list(IdempotencyKey.objects.values_list('key', flat=True)), ['fresh'])
+
+
+class SalesRollupTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='shopper@example.com', password='pass12345')
+        cls.staff = User.objects.create(email='analyst@example.com', username='analyst', password='!', is_staff=True)
+        cls.books = Category.objects.create(name='Rollup Books')
+        cls.games = Category.objects.create(name='Rollup Games')
+        cls.novel = create_product(cls.user, cls.books, 'Novel', 100)
+        cls.atlas = create_product(cls.user, cls.books, 'Atlas', 100)
+        cls.chess = create_product(cls.user, cls.games, 'Chess', 100)
+        cls.day1 = timezone.now().replace(hour=12) - timedelta(days=3)
+        cls.day2 = cls.day1 + timedelta(days=1)
+
+    def setUp(self):
+        get_cache().clear()
+        categories.refresh()
+        self.client = APIClient()
+        self.client.force_authenticate(self.staff)
+
+    def place_orders(self):
+        create_order(self.user, [(self.novel, 2, Decimal('10.00')), (self.chess, 1, Decimal('25.00'))], created_at=self.day1)
+        create_order(self.user, [(self.novel, 1, Decimal('12.00'))], created_at=self.day1)
+        create_order(self.user, [(self.atlas, 3, Decimal('5.00'))], created_at=self.day2)
+
+    def product_rows(self):
+        return {
+            (row.day, row.product_id): (row.revenue, row.units, row.orders, row.category_id)
+            for row in DailyProductSales.objects.all()
+        }
+
+    def category_rows(self):
+        return {
+            (row.day, row.category_id): (row.revenue, row.units, row.orders)
+            for row in DailyCategorySales.objects.all()
+        }
+
+    def compact(self, batch_size=2):
+        out = StringIO()
+        call_command('compact_sales_rollups', '--batch-size', str(batch_size), stdout=out)
+        return out.getvalue()
+
+    def test_compaction_counts_each_order_once(self):
+        self.place_orders()
+        self.assertIn('Rolled up 3 orders', self.compact())
+        self.assertIn('Rolled up 0 orders', self.compact())
+        day1, day2 = self.day1.date(), self.day2.date()
+        self.assertEqual(self.product_rows(), {
+            (day1, self.novel.pk): (Decimal('32.00'), 3, 2, self.books.pk),
+            (day1, self.chess.pk): (Decimal('25.00'), 1, 1, self.games.pk),
+            (day2, self.atlas.pk): (Decimal('15.00'), 3, 1, self.books.pk),
+        })
+        self.assertEqual(self.category_rows(), {
+            (day1, self.books.pk): (Decimal('32.00'), 3, 2),
+            (day1, self.games.pk): (Decimal('25.00'), 1, 1),
+            (day2, self.books.pk): (Decimal('15.00'), 3, 1),
+        })
+
+        # A later order is added to the existing rows
+        create_order(self.user, [(self.chess, 2, Decimal('25.00'))], created_at=self.day1)
+        self.assertIn('Rolled up 1 orders', self.compact())
+        self.assertEqual(self.product_rows()[(day1, self.chess.pk)], (Decimal('75.00'), 3, 2, self.games.pk))
+        self.assertEqual(self.category_rows()[(day1, self.games.pk)], (Decimal('75.00'), 3, 2))
+
+    def test_pending_orders_wait_until_placed(self):
+        order = create_order(self.user, [(self.novel, 1, Decimal('10.00'))], status='pending', created_at=self.day1)
+        self.assertIn('Rolled up 0 orders', self.compact())
+        self.assertFalse(Order.objects.get(pk=order.pk).rolled_up)
+
+        Order.objects.filter(pk=order.pk).update(status='completed')
+        self.assertIn('Rolled up 1 orders', self.compact())
+        self.assertEqual(self.product_rows(), {(self.day1.date(), self.novel.pk): (Decimal('10.00'), 1, 1, self.books.pk)})
+
+    def test_failed_orders_are_left_out(self):
+        create_order(self.user, [(self.novel, 1, Decimal('10.00'))], created_at=self.day1)
+        failed = create_order(self.user, [(self.novel, 5, Decimal('10.00'))], status='failed', created_at=self.day1)
+        self.assertIn('Rolled up 2 orders', self.compact())
+        self.assertTrue(Order.objects.get(pk=failed.pk).rolled_up)  # Marked, so it isn't looked at again
+        self.assertEqual(self.product_rows(), {(self.day1.date(), self.novel.pk): (Decimal('10.00'), 1, 1, self.books.pk)})
+
+    def test_backfill_matches_compaction(self):
+        self.place_orders()
+        self.compact()
+        expected = (self.product_rows(), self.category_rows())
+        DailyProductSales.objects.all().delete()
+        DailyCategorySales.objects.all().delete()
+        Order.objects.update(rolled_up=False)
+
+        out = StringIO()
+        call_command('backfill_sales_rollups', '--workers', '1', '--chunk-size', '2', '--batch-size', '1', stdout=out)
+        self.assertIn('in 2 chunks', out.getvalue())
+        self.assertIn('Rolled up 3 orders', out.getvalue())
+        self.assertEqual((self.product_rows(), self.category_rows()), expected)
+
+    def test_backfill_counts_sales_under_the_current_category(self):
+        create_order(self.user, [(self.novel, 1, Decimal('10.00'))], created_at=self.day1)
+        Product.objects.filter(pk=self.novel.pk).update(category=self.games)
+        call_command('backfill_sales_rollups', '--workers', '1', stdout=StringIO())
+        self.assertEqual(self.product_rows(), {(self.day1.date(), self.novel.pk): (Decimal('10.00'), 1, 1, self.games.pk)})
+        self.assertEqual(self.category_rows(), {(self.day1.date(), self.games.pk): (Decimal('10.00'), 1, 1)})
+
+    def test_analytics_filters_and_totals(self):
+        self.place_orders()
+        self.compact()
+        day1, day2 = self.day1.date().isoformat(), self.day2.date().isoformat()
+
+        response = self.client.get('/orders/analytics/products/', {'start': day2, 'end': day2}, secure=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([dict(row) for row in response.data['results']], [
+            {'day': day2, 'revenue': Decimal('15.00'), 'units': 3, 'orders': 1, 'product': self.atlas.pk, 'category': 'Rollup Books'},
+        ])
+
+        response = self.client.get('/orders/analytics/products/', {'category': 'rollup games'}, secure=True)
+        self.assertEqual([row['product'] for row in response.data['results']], [self.chess.pk])
+
+        response = self.client.get('/orders/analytics/categories/', {'group': 'total'}, secure=True)
+        self.assertEqual([dict(row) for row in response.data['results']], [
+            {'revenue': Decimal('47.00'), 'units': 6, 'orders': 3, 'category': 'Rollup Books'},
+            {'revenue': Decimal('25.00'), 'units': 1, 'orders': 1, 'category': 'Rollup Games'},
+        ])
+
+        response = self.client.get('/orders/analytics/categories/', {'start': day1, 'end': day1}, secure=True)
+        self.assertEqual([(row['day'], row['category']) for row in response.data['results']], [
+            (day1, 'Rollup Books'), (day1, 'Rollup Games'),
+        ])
+
+    def test_staff_only(self):
+        self.client.force_authenticate(self.user)
+        for url in ('/orders/analytics/products/', '/orders/analytics/categories/'):
+            self.assertEqual(self.client.get(url, secure=True).status_code, 403)
+
+
+class OrderExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='customer@example.com', password='pass12345')
+        cls.staff = User.objects.create(email='accounts@example.com', username='accounts', password='!', is_staff=True)
+        cls.category = Category.objects.create(name='Export Books')
+        cls.novel = create_product(cls.user, cls.category, 'Novel', 100)
+        cls.atlas = create_product(cls.user, cls.category, 'Atlas', 100)
+        now = timezone.now()
+        cls.old = create_order(
+            cls.user, [(cls.novel, 2, Decimal('10.00')), (cls.atlas, 1, Decimal('5.50'))], created_at=now - timedelta(days=10),
+        )
+        cls.empty = create_order(cls.user, [], status='pending', created_at=now - timedelta(days=2))
+        cls.recent = create_order(cls.user, [(cls.atlas, 3, Decimal('5.50'))], created_at=now - timedelta(days=1))
+
+    def setUp(self):
+        get_cache().clear()
+        categories.refresh()
+        self.client = APIClient()
+        self.client.force_authenticate(self.staff)
+
+    def export(self, **params):
+        response = self.client.get('/orders/export/', params, secure=True)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+
+    def test_ndjson_has_one_row_per_line(self):
+        rows = [json.loads(line) for line in self.export().splitlines()]
+        self.assertEqual([(row['order_id'], row['product_name']) for row in rows], [
+            (self.old.pk, 'Novel'), (self.old.pk, 'Atlas'), (self.empty.pk, None), (self.recent.pk, 'Atlas'),
+        ])
+        self.assertEqual(rows[0]['user_email'], 'customer@example.com')
+        self.assertEqual(rows[0]['category'], 'Export Books')
+        self.assertEqual((rows[0]['order_total'], rows[0]['item_count'], rows[0]['line_total']), ('25.50', 3, '20.00'))
+        self.assertEqual(
+            {key: rows[2][key] for key in ('status', 'product_id', 'category', 'quantity', 'line_total')},
+            {'status': 'pending', 'product_id': None, 'category': None, 'quantity': None, 'line_total': None},
+        )
+
+    def test_csv_has_a_header_and_one_row_per_line(self):
+        header, *rows = list(csv.reader(StringIO(self.export(file_format='csv'))))
+        self.assertEqual(header, EXPORT_FIELDS)
+        self.assertEqual([(int(row[0]), row[7]) for row in rows], [
+            (self.old.pk, 'Novel'), (self.old.pk, 'Atlas'), (self.empty.pk, ''), (self.recent.pk, 'Atlas'),
+        ])
+        self.assertEqual(rows[3][-3:], ['3', '5.50', '16.50'])
+
+    def test_filters(self):
+        since = (timezone.now() - timedelta(days=3)).isoformat()
+        rows = [json.loads(line) for line in self.export(created_after=since).splitlines()]
+        self.assertEqual([row['order_id'] for row in rows], [self.empty.pk, self.recent.pk])
+
+        rows = [json.loads(line) for line in self.export(created_before=since, status='completed').splitlines()]
+        self.assertEqual({row['order_id'] for row in rows}, {self.old.pk})
+        self.assertEqual(self.export(status='canceled'), '')
+
+        response = self.client.get('/orders/export/', {'file_format': 'xml'}, secure=True)
+        self.assertEqual(response.status_code, 400)
+
+    def test_query_count_does_not_grow_with_rows(self):
+        def count_queries():
+            with CaptureQueriesContext(connection) as context:
+                rows = list(export_rows())
+            return len(rows), len(context.captured_queries)
+
+        rows, queries = count_queries()
+        for _ in range(20):
+            create_order(self.user, [(self.novel, 1, Decimal('10.00')), (self.atlas, 2, Decimal('5.50'))])
+        self.assertEqual(count_queries(), (rows + 40, queries))
+
+        # Two queries per chunk, plus the one that finds no more orders
+        with CaptureQueriesContext(connection) as context:
+            list(export_rows(chunk_size=10))
+        self.assertEqual(len(context.captured_queries), 3 * 2 + 1)
+
+    def test_staff_only(self):
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.client.get('/orders/export/', secure=True).status_code, 403)
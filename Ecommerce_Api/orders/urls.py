@@ -1,9 +1,12 @@
 from django.urls import path
-from .views import OrderCreateAPIView, OrderListAPIView, OrderDetailAPIView
+from .views import OrderCreateAPIView, OrderListAPIView, OrderDetailAPIView, ProductSalesAPIView, CategorySalesAPIView, OrderExportView
 
 urlpatterns = [
     path('create/', OrderCreateAPIView.as_view(), name='order-create'),
     path('list/', OrderListAPIView.as_view(), name='order-list'),
     path('<int:order_id>/', OrderDetailAPIView.as_view(), name='order-detail'),
+    path('analytics/products/', ProductSalesAPIView.as_view(), name='sales-by-product'),
+    path('analytics/categories/', CategorySalesAPIView.as_view(), name='sales-by-category'),
+    path('export/', OrderExportView.as_view(), name='order-export'),
 
 ]
@@ -1,10 +1,17 @@
 from rest_framework import generics, status
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated
-from .models import Order, OrderItem
-from products.models import Product
-from .serializers import OrderSerializer
-from django.db import transaction
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
+from .models import DailyCategorySales, DailyProductSales, Order
+from .serializers import CategorySalesSerializer, OrderSerializer, OrderHistorySerializer, ProductSalesSerializer
+from .filters import CategorySalesFilter, OrderFilter, ProductSalesFilter
+from .pagination import OrderKeysetPagination, SalesPagination
+from .checkout import CheckoutError, enqueue_order, place_order
+from .idempotency import IdempotencyError, request_hash, run_once
+from .export import EXPORT_FIELDS, export_rows
+from products.bulk import FORMATS, stream_export
+from django.db.models import Sum
+from django.http import StreamingHttpResponse
+from django.urls import reverse
 from rest_framework.views import APIView
 
 class OrderCreateAPIView(APIView):
@@ -27,88 +34,67 @@ class OrderCreateAPIView(APIView):
         if not items:
             return Response({"error": "No items provided in the order."}, status=status.HTTP_400_BAD_REQUEST)
 
+        # Clients retrying after a timeout send the same Idempotency-Key and get the first attempt's response
+        key = request.headers.get('Idempotency-Key')
+        replayed = False
         try:
-            # Create order within a transaction to handle stock updates safely
-            with transaction.atomic():
-                order = Order.objects.create(user=request.user)
-
-                # Process each item in the order
-                for item in items:
-                    product_id = item.get('product')
-                    quantity = item.get('quantity')
-
-                    if not product_id or not quantity:
-                        return Response({
-                            "error": "Each item must include 'product' and 'quantity'."
-                        }, status=status.HTTP_400_BAD_REQUEST)
-
-                    try:
-                        product = Product.objects.get(id=product_id)
-                    except Product.DoesNotExist:
-                        return Response({"error": f"Product with id {product_id} not found."}, status=status.HTTP_404_NOT_FOUND)
-
-                    if product.stock_quantity < quantity:
-                        return Response({
-                            "error": f"Insufficient stock for product {product.name}. Available stock: {product.stock_quantity}."
-                        }, status=status.HTTP_400_BAD_REQUEST)
-
-                    # Automatically set price_at_order based on the current product price
-                    price_at_order = product.price
-
-                    # Create OrderItem for each product and save the price at the time of order
-                    OrderItem.objects.create(
-                        order=order,
-                        product=product,
-                        quantity=quantity,
-                        price_at_order=price_at_order
-                    )
-
-                    # Reduce stock quantity
-                    product.stock_quantity -= quantity
-                    product.save()
-
-                return Response({"message": "Order created successfully!", "order_id": order.id}, status=status.HTTP_201_CREATED)
-
+            if key is None:
+                status_code, body, order = self.create_order(request, items)
+            elif not key or len(key) > 255:
+                return Response({"error": "Idempotency-Key must be 1 to 255 characters."}, status=status.HTTP_400_BAD_REQUEST)
+            else:
+                status_code, body, replayed = run_once(
+                    request.user, key, request_hash(request.data), lambda: self.create_order(request, items)
+                )
+        except IdempotencyError as e:
+            return Response({"error": str(e)}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
         except Exception as e:
             return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-class OrderListAPIView(APIView):
-    permission_classes = [IsAuthenticated]
-
-    def get(self, request, *args, **kwargs):
-        user = request.user
-        orders = Order.objects.filter(user=user)
-        data = []
-
-        for order in orders:
-            order_items = order.items.all()
-            items_data = []
-            total_price = 0
-
-            # Loop through each order item to calculate total price and format the response
-            for item in order_items:
-                item_total_price = item.price_at_order * item.quantity  # Calculate total price for the item
-                total_price += item_total_price  # Add to order total
-
-                # Add product name and other details to the items_data list
-                items_data.append({
-                    "product_name": item.product.name,
-                    "quantity": item.quantity,
-                    "total_price": item_total_price
-                })
-
-            # Add the total price to the order response and include items data
-            data.append({
+        response = Response(body, status=status_code)
+        if status_code == status.HTTP_202_ACCEPTED:
+            response['Location'] = body['status_url']
+        if replayed:
+            response['Idempotent-Replayed'] = 'true'
+        return response
+
+    def wants_async(self, request):
+        # ?async=true or "Prefer: respond-async" queues the order for the process_order_jobs worker
+        return (request.query_params.get('async', '').lower() in ('1', 'true')
+                or 'respond-async' in request.headers.get('Prefer', ''))
+
+    def create_order(self, request, items):
+        # Returns (status code, body, order); stock and price problems are answers, not failures
+        if self.wants_async(request):
+            try:
+                order = enqueue_order(request.user, items)
+            except CheckoutError as e:
+                return e.status_code, {"error": str(e)}, None
+            return status.HTTP_202_ACCEPTED, {
+                "message": "Order accepted and queued.",
                 "order_id": order.id,
                 "status": order.status,
-                "created_at": order.created_at,
-                "updated_at": order.updated_at,
-                "total_price": total_price,
-                "items": items_data
-            })
+                "status_url": request.build_absolute_uri(reverse('order-detail', args=[order.id])),
+            }, order
 
-        return Response(data, status=status.HTTP_200_OK)
+        try:
+            # Locks the products, takes the stock and creates the order in one transaction
+            order = place_order(request.user, items)
+        except CheckoutError as e:
+            return e.status_code, {"error": str(e)}, None
+        return status.HTTP_201_CREATED, {"message": "Order created successfully!", "order_id": order.id}, order
+
+class OrderListAPIView(generics.ListAPIView):
+    # Keyset pages of the user's history (?cursor=), filtered by ?status=, ?created_after=, ?created_before=,
+    # ?min_total= and ?max_total=
+    serializer_class = OrderHistorySerializer
+    pagination_class = OrderKeysetPagination
+    filterset_class = OrderFilter
+    permission_classes = [IsAuthenticated]
 
+    def get_queryset(self):
+        # total_amount is never NULL (older orders were backfilled by migration 0010), so ordering by it keeps every order
+        return Order.objects.filter(user=self.request.user).with_items()
 
 
 class OrderDetailAPIView(APIView):
@@ -117,24 +103,69 @@ class OrderDetailAPIView(APIView):
     def get(self, request, order_id, *args, **kwargs):
         user = request.user
         try:
-            order = Order.objects.get(id=order_id, user=user)
+            order = Order.objects.with_items().select_related('job').get(id=order_id, user=user)
         except Order.DoesNotExist:
             return Response({"error": "Order not found."}, status=status.HTTP_404_NOT_FOUND)
 
-        order_items = order.items.all()
-        items_data = [{
-            "product_name": item.product.name,
-            "quantity": item.quantity,
-            "total_price": item.total_price()
-        } for item in order_items]
-
-        data = {
-            "order_id": order.id,
-            "status": order.status,
-            "created_at": order.created_at,
-            "updated_at": order.updated_at,
-            "total_price": order.total_price(),
-            "items": items_data
-        }
-
-        return Response(data, status=status.HTTP_200_OK)
\ No newline at end of file
+        data = OrderHistorySerializer(order).data
+        # Orders placed asynchronously report their progress: pending, then completed or failed
+        job = getattr(order, 'job', None)
+        if job is not None and job.error:
+            data['error'] = job.error
+        return Response(data, status=status.HTTP_200_OK)
+
+
+class SalesRollupView(generics.ListAPIView):
+    # Read-only sales reports for staff, answered from the daily rollups (orders.rollups) without touching orders
+    permission_classes = [IsAdminUser]
+    pagination_class = SalesPagination
+    model = None
+    keys = ()
+
+    def get_queryset(self):
+        return self.model.objects.all()
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if self.request.query_params.get('group') == 'total':
+            group_by, ordering = self.keys, ['-revenue_total', *self.keys]  # Best sellers first
+        else:
+            group_by = ordering = ['day', *self.keys]
+        return queryset.values(*group_by).annotate(
+            revenue_total=Sum('revenue'), units_total=Sum('units'), orders_total=Sum('orders'),
+        ).order_by(*ordering)
+
+
+class ProductSalesAPIView(SalesRollupView):
+    model = DailyProductSales
+    serializer_class = ProductSalesSerializer
+    filterset_class = ProductSalesFilter
+    keys = ['product_id', 'category_id']
+
+
+class CategorySalesAPIView(SalesRollupView):
+    model = DailyCategorySales
+    serializer_class = CategorySalesSerializer
+    filterset_class = CategorySalesFilter
+    keys = ['category_id']
+
+
+# Every order and line item for accounting, streamed in constant memory (Admin only)
+class OrderExportView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        file_format = request.query_params.get('file_format', 'ndjson')
+        if file_format not in FORMATS:
+            return Response({"error": f"file_format must be one of {', '.join(FORMATS)}."}, status=status.HTTP_400_BAD_REQUEST)
+        # Same created_after / created_before / status filters as the order list
+        filterset = OrderFilter(request.query_params, queryset=Order.objects.all())
+        if not filterset.is_valid():
+            return Response(filterset.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        content_type = 'text/csv' if file_format == 'csv' else 'application/x-ndjson'
+        response = StreamingHttpResponse(
+            stream_export(EXPORT_FIELDS, export_rows(filterset.qs), file_format), content_type=content_type,
+        )
+        response['Content-Disposition'] = f'attachment; filename="orders.{file_format}"'
+        return response
@@ -1,5 +1,7 @@
 from django.contrib import admin
-from .models import Product, Category, Review, ProductImage, Wishlist, Discount
+from .models import Product, Category, Review, ProductImage, Wishlist, Discount, DiscountCampaign
+from .campaigns import cancel_campaign
+from .inventory import disable_sharding, enable_sharding, restocked
 
 
 class ProductImageInline(admin.TabularInline):
@@ -15,12 +17,28 @@ class ReviewInline(admin.TabularInline):
 
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
-    list_display = ('name', 'category', 'price', 'stock_quantity', 'created_date', 'updated')
+    list_display = ('name', 'category', 'price', 'stock_quantity', 'sharded_stock', 'created_date', 'updated')
     search_fields = ('name', 'category__name')
-    list_filter = ('category', 'price', 'stock_quantity', 'created_date')
+    list_filter = ('category', 'price', 'stock_quantity', 'sharded_stock', 'created_date')
     inlines = [ProductImageInline, ReviewInline]  # Show related images and reviews in product admin
     date_hierarchy = 'created_date'
     readonly_fields = ('created_date', 'updated')
+    actions = ['shard_stock', 'merge_stock_shards']
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if change and 'stock_quantity' in form.changed_data:
+            restocked([obj.pk])
+
+    @admin.action(description="Shard stock of selected products (for hot SKUs)")
+    def shard_stock(self, request, queryset):
+        for product_id in queryset.values_list('pk', flat=True):
+            enable_sharding(product_id)
+
+    @admin.action(description="Merge stock shards of selected products")
+    def merge_stock_shards(self, request, queryset):
+        for product_id in queryset.filter(sharded_stock=True).values_list('pk', flat=True):
+            disable_sharding(product_id)
 
 
 @admin.register(Category)
@@ -55,3 +73,26 @@ class DiscountAdmin(admin.ModelAdmin):
     list_display = ('product', 'discount_percentage', 'start_date', 'end_date')
     list_filter = ('start_date', 'end_date')
     search_fields = ('product__name',)
+
+
+@admin.register(DiscountCampaign)
+class DiscountCampaignAdmin(admin.ModelAdmin):
+    list_display = ('name', 'discount_percentage', 'start_date', 'end_date', 'category')
+    list_filter = ('start_date', 'end_date')
+    search_fields = ('name',)
+
+    def has_add_permission(self, request):
+        return False  # Launched through the API, which creates the campaign's discounts with it
+
+    def get_readonly_fields(self, request, obj=None):
+        # The discounts are copies taken at launch, so a launched campaign can only be cancelled
+        if obj is not None:
+            return ('name', 'discount_percentage', 'start_date', 'end_date', 'category', 'created_by')
+        return super().get_readonly_fields(request, obj)
+
+    def delete_model(self, request, obj):
+        cancel_campaign(obj)  # Reprices the affected products once instead of per discount
+
+    def delete_queryset(self, request, queryset):
+        for campaign in queryset:
+            cancel_campaign(campaign)
@@ -0,0 +1,183 @@
+"""
+Streaming bulk import and export of the product catalogue (NDJSON and CSV).
+"""
+import codecs
+import csv
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+
+from .cache import catalogue_changed
+from .inventory import restocked
+from .models import Product, ProductRatingSummary
+from .pricing import refresh_effective_prices
+from .registry import categories
+from .search import index_products
+from .serializers import ProductImportSerializer
+
+FORMATS = ('ndjson', 'csv')
+IMPORT_FIELDS = ['name', 'description', 'price', 'category', 'stock_quantity', 'image_url']
+EXPORT_FIELDS = ['id', 'name', 'description', 'price', 'effective_price', 'category', 'stock_quantity', 'image_url', 'created_date', 'updated']
+UPSERT_FIELDS = ['description', 'price', 'effective_price', 'category', 'stock_quantity', 'image_url', 'updated']
+MAX_REPORTED_ERRORS = 1000
+
+
+def read_rows(stream, file_format):
+    # Yield (line number, row dict or None, error) from a byte stream without loading it all into memory
+    lines = codecs.iterdecode(stream, 'utf-8-sig')
+    if file_format == 'csv':
+        reader = csv.DictReader(lines)
+        for row in reader:
+            yield reader.line_num, row, None
+        return
+
+    for line_number, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as exc:
+            yield line_number, None, f"Invalid JSON: {exc}"
+            continue
+        if not isinstance(row, dict):
+            yield line_number, None, "Each line must be a JSON object."
+            continue
+        yield line_number, row, None
+
+
+class ProductImporter:
+    """
+    Upserts products by name from a stream of rows, validating and writing them in batches.
+    Rows that fail validation are skipped and reported; valid rows in the same batch are still written.
+    """
+
+    def __init__(self, user, batch_size=1000):
+        self.user = user
+        self.batch_size = batch_size
+        self.processed = 0
+        self.upserted = 0
+        self.failed = 0
+        self.errors = []
+
+    def run(self, stream, file_format):
+        batch = []
+        for line_number, row, error in read_rows(stream, file_format):
+            self.processed += 1
+            if error:
+                self.add_error(line_number, error)
+                continue
+            batch.append((line_number, row))
+            if len(batch) >= self.batch_size:
+                self.write_batch(batch)
+                batch = []
+        if batch:
+            self.write_batch(batch)
+        return self.report()
+
+    def report(self):
+        return {
+            "processed": self.processed,
+            "upserted": self.upserted,
+            "failed": self.failed,
+            "errors": sorted(self.errors, key=lambda error: error["line"]),
+        }
+
+    def add_error(self, line_number, errors):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"line": line_number, "errors": errors})
+
+    def build_product(self, line_number, row):
+        serializer = ProductImportSerializer(data=row)
+        if not serializer.is_valid():
+            self.add_error(line_number, serializer.errors)
+            return None
+        data = serializer.validated_data
+        category_id = categories.resolve(data['category'])
+        if category_id is None:
+            self.add_error(line_number, {"category": [f"Category with name '{data['category']}' does not exist."]})
+            return None
+        return Product(
+            name=data['name'],
+            description=data['description'],
+            price=data['price'],
+            # Discounts are applied by refresh_effective_prices once the batch is written
+            effective_price=data['price'],
+            category_id=category_id,
+            stock_quantity=data['stock_quantity'],
+            image_url=data['image_url'],
+            created_by=self.user,
+        )
+
+    def write_batch(self, rows):
+        products = {}
+        for line_number, row in rows:
+            product = self.build_product(line_number, row)
+            if product is not None:
+                products[product.name] = product  # A later row for the same name wins
+        if not products:
+            return
+
+        options = {'update_conflicts': True, 'update_fields': UPSERT_FIELDS}
+        # MySQL upserts on any unique key and rejects an explicit conflict target
+        if connection.features.supports_update_conflicts_with_target:
+            options['unique_fields'] = ['name']
+        with transaction.atomic():
+            Product.objects.bulk_create(products.values(), **options)
+            # bulk_create skips save() and signals, so catch up on derived data for the batch
+            product_ids = list(Product.objects.filter(name__in=products.keys()).values_list('pk', flat=True))
+            refresh_effective_prices(product_ids)
+            restocked(product_ids)
+            index_products(product_ids)
+            ProductRatingSummary.objects.bulk_create(
+                [ProductRatingSummary(product_id=product_id) for product_id in product_ids], ignore_conflicts=True
+            )
+            catalogue_changed()
+        self.upserted += len(products)
+
+
+class Echo:
+    # File-like object whose write() hands the value back, so csv.writer can feed a streaming response
+    def write(self, value):
+        return value
+
+
+def export_rows(queryset=None, chunk_size=2000):
+    """
+    Tuples in EXPORT_FIELDS order, read in primary key chunks so only one chunk is held at a time, even where
+    the driver buffers whole results client-side (MySQL) and iterator() wouldn't help.
+    """
+    queryset = Product.objects.all() if queryset is None else queryset
+    columns = [('category_id' if field == 'category' else field) for field in EXPORT_FIELDS]
+    category_index = EXPORT_FIELDS.index('category')
+    last_pk = 0
+    while True:
+        rows = list(queryset.filter(pk__gt=last_pk).order_by('pk').values_list(*columns)[:chunk_size])
+        if not rows:
+            return
+        last_pk = rows[-1][0]  # id is the first column
+        for row in rows:
+            row = list(row)
+            row[category_index] = categories.name_for(row[category_index])  # In memory, no join
+            yield row
+
+
+def stream_csv(fields, rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(fields)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def stream_ndjson(fields, rows):
+    encoder = DjangoJSONEncoder()
+    for row in rows:
+        yield encoder.encode(dict(zip(fields, row))) + '\n'
+
+
+def stream_export(fields, rows, file_format):
+    if file_format == 'csv':
+        return stream_csv(fields, rows)
+    return stream_ndjson(fields, rows)
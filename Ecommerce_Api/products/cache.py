@@ -0,0 +1,192 @@
+"""
+Versioned read-through cache for catalogue responses.
+
+Every cache key embeds the catalogue version, and any write to products, categories, discounts or images bumps it,
+so stale entries are never read again and simply expire.
+"""
+import hashlib
+import json
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from rest_framework import status
+from rest_framework.response import Response
+
+CATALOGUE_VERSION_KEY = 'catalogue:version'
+
+
+def get_cache():
+    return caches[getattr(settings, 'CATALOGUE_CACHE_ALIAS', 'default')]
+
+
+def get_version(key):
+    cache = get_cache()
+    version = cache.get(key)
+    if version is None:
+        # Seed from the clock so a version lost to eviction is never reused
+        cache.add(key, int(time.time() * 1000), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(key):
+    try:
+        get_cache().incr(key)
+    except ValueError:
+        get_version(key)
+
+
+def get_catalogue_version():
+    return get_version(CATALOGUE_VERSION_KEY)
+
+
+def bump_catalogue_version():
+    bump_version(CATALOGUE_VERSION_KEY)
+
+
+def review_version_key(product_id):
+    return f'reviews:{product_id}:version'
+
+
+def reviews_changed(product_id):
+    # Invalidates the cached first page of a product's review feed once the transaction commits
+    transaction.on_commit(lambda: bump_version(review_version_key(product_id)))
+
+
+def wishlist_version_key(user_id):
+    return f'wishlist:{user_id}:version'
+
+
+def wishlist_changed(user_id):
+    # Invalidates the user's cached wishlist once the transaction commits; product changes bump the catalogue
+    transaction.on_commit(lambda: bump_version(wishlist_version_key(user_id)))
+
+
+def catalogue_changed():
+    """
+    Bump the catalogue version once the surrounding transaction commits, so readers never cache pre-commit data
+    under the new version. Bulk writes call this per row, so one bump is scheduled per atomic block: the pending
+    callback is tracked by a weak reference, which dies with it if the block rolls back.
+    """
+    connection = transaction.get_connection()
+    pending, savepoints = getattr(connection, 'pending_catalogue_bump', (None, None))
+    if connection.in_atomic_block and savepoints == connection.savepoint_ids and pending() is not None:
+        return
+
+    def bump():
+        connection.pending_catalogue_bump = (None, None)
+        bump_catalogue_version()
+
+    connection.pending_catalogue_bump = (weakref.ref(bump), list(connection.savepoint_ids))
+    transaction.on_commit(bump)
+
+
+class NegativeResultCache:
+    """
+    Bounded, process-local LRU of keys known to have no results. An entry only counts while it is younger
+    than `ttl` seconds and was recorded under the current catalogue version, so any product write clears it.
+    """
+
+    def __init__(self, max_entries=10000, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def contains(self, key, version):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return False
+            recorded_version, expires_at = entry
+            if recorded_version != version or expires_at < time.monotonic():
+                del self.entries[key]
+                return False
+            self.entries.move_to_end(key)
+            return True
+
+    def add(self, key, version):
+        with self.lock:
+            self.entries[key] = (version, time.monotonic() + self.ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+def compute_etag(data):
+    payload = json.dumps(data, cls=DjangoJSONEncoder, sort_keys=True).encode('utf-8')
+    return '"%s"' % hashlib.md5(payload).hexdigest()
+
+
+class CachedResponseMixin:
+    """
+    Serves list/retrieve from the catalogue cache with ETags.
+    Concurrent misses on the same key are coalesced: one request rebuilds while the others wait for its result.
+    """
+    cache_lock_timeout = 5  # Seconds a rebuild may hold the lock before others give up waiting
+    cache_poll_interval = 0.05
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
+
+    def get_response_cache_key(self, request):
+        # Sorted query parameters so ?a=1&b=2 and ?b=2&a=1 share an entry; the host is part of the pagination links
+        query = sorted((key, request.query_params.getlist(key)) for key in request.query_params)
+        raw = json.dumps([request.get_host(), request.path, query])
+        digest = hashlib.md5(raw.encode('utf-8')).hexdigest()
+        return f'catalogue:{get_catalogue_version()}:{self.basename}:{self.action}:{digest}'
+
+    def cached_response(self, build, request, *args, **kwargs):
+        cache = get_cache()
+        key = self.get_response_cache_key(request)
+        entry = cache.get(key)
+        if entry is None:
+            lock_key = f'{key}:lock'
+            if cache.add(lock_key, 1, timeout=self.cache_lock_timeout):
+                try:
+                    response = build(request, *args, **kwargs)
+                    if response.status_code != status.HTTP_200_OK:
+                        return response
+                    entry = (compute_etag(response.data), response.data)
+                    cache.set(key, entry, timeout=getattr(settings, 'CATALOGUE_CACHE_TIMEOUT', 300))
+                finally:
+                    cache.delete(lock_key)
+            else:
+                entry = self.wait_for_entry(cache, key, lock_key)
+                if entry is None:
+                    # The rebuild failed or took too long; build this one ourselves without caching it
+                    response = build(request, *args, **kwargs)
+                    if response.status_code != status.HTTP_200_OK:
+                        return response
+                    entry = (compute_etag(response.data), response.data)
+
+        etag, data = entry
+        if etag in self.parse_if_none_match(request):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+        return Response(data, headers={'ETag': etag})
+
+    def wait_for_entry(self, cache, key, lock_key):
+        deadline = time.monotonic() + self.cache_lock_timeout
+        while time.monotonic() < deadline:
+            time.sleep(self.cache_poll_interval)
+            entry = cache.get(key)
+            if entry is not None or cache.get(lock_key) is None:
+                return entry
+        return None
+
+    def parse_if_none_match(self, request):
+        header = request.headers.get('If-None-Match', '')
+        return {tag.strip().removeprefix('W/') for tag in header.split(',') if tag.strip()}
@@ -0,0 +1,86 @@
+"""
+Discount campaigns: one percentage over one date window, applied to every product of a category or to a
+list of products with a single bulk insert.
+"""
+from django.db import transaction
+
+from .cache import catalogue_changed
+from .models import Discount, Product
+from .pricing import defer_price_refresh, refresh_effective_prices
+
+
+class CampaignError(Exception):
+    def __init__(self, message, product_ids=()):
+        super().__init__(message)
+        self.product_ids = sorted(product_ids)
+
+
+def overlapping_products(products, start_date, end_date, exclude_discount_id=None):
+    # Ids of the given products (ids or a product queryset) that already have a discount touching the window,
+    # found with one query. Windows include both ends, like the active-discount lookups in products.pricing
+    discounts = Discount.objects.filter(product__in=products, start_date__lte=end_date, end_date__gte=start_date)
+    if exclude_discount_id is not None:
+        discounts = discounts.exclude(pk=exclude_discount_id)
+    return set(discounts.values_list('product_id', flat=True).distinct())
+
+
+def lock_products(product_ids):
+    # Lock the product rows in id order, as checkout does, so concurrent discount writers for the same products
+    # queue up here and each overlap check sees the discounts the previous one inserted. Returns the ids found
+    return set(Product.objects.select_for_update().filter(pk__in=product_ids).order_by('pk').values_list('pk', flat=True))
+
+
+def target_products(category_id=None, product_ids=None):
+    if category_id is not None:
+        return Product.objects.filter(category_id=category_id)
+    return Product.objects.filter(pk__in=product_ids)
+
+
+@transaction.atomic
+def launch_campaign(campaign, category_id=None, product_ids=None, skip_conflicts=False):
+    """
+    Save `campaign` and give each target product a Discount in one bulk insert, then reprice them in one pass.
+    Products that already have an overlapping discount make the whole campaign fail with CampaignError, or are
+    left out when `skip_conflicts` is set. Returns the ids of the products left out.
+    """
+    products = target_products(category_id, product_ids)
+    targets = lock_products(products.values('pk'))
+    if product_ids is not None:
+        missing = set(product_ids) - targets
+        if missing:
+            raise CampaignError("Products not found.", missing)
+    if not targets:
+        raise CampaignError("The campaign does not apply to any product.")
+
+    conflicts = overlapping_products(targets, campaign.start_date, campaign.end_date)
+    if conflicts and not skip_conflicts:
+        raise CampaignError("These products already have a discount in the campaign window.", conflicts)
+    targets -= conflicts
+    if not targets:
+        raise CampaignError("Every product already has a discount in the campaign window.", conflicts)
+
+    campaign.category_id = category_id
+    campaign.save()
+    # bulk_create skips the Discount signals, so reprice and invalidate the cache here instead
+    Discount.objects.bulk_create([
+        Discount(
+            product_id=product_id,
+            discount_percentage=campaign.discount_percentage,
+            start_date=campaign.start_date,
+            end_date=campaign.end_date,
+            campaign=campaign,
+        )
+        for product_id in sorted(targets)
+    ], batch_size=1000)
+    refresh_effective_prices(targets)
+    catalogue_changed()
+    campaign.discount_count = len(targets)
+    return sorted(conflicts)
+
+
+@transaction.atomic
+def cancel_campaign(campaign):
+    # Deleting the campaign cascades to its discounts; their per-row signals only collect product ids, which
+    # are repriced together once the delete is done
+    with defer_price_refresh():
+        campaign.delete()
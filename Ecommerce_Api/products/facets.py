@@ -0,0 +1,87 @@
+"""
+Facet counts (category, price band, stock) for a filtered product queryset.
+
+Each facet family is one aggregate query over the already filtered queryset, and results are cached on the
+filter signature plus the catalogue version so any product change invalidates them.
+"""
+import hashlib
+import json
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db.models import Count, Q
+
+from .cache import get_cache, get_catalogue_version
+from .registry import categories
+
+DEFAULT_PRICE_BOUNDARIES = [25, 50, 100, 250, 500]
+MAX_PRICE_BUCKETS = 20
+# Query parameters that change the page but not the set of matching products
+NON_FILTER_PARAMS = {'page', 'page_size', 'cursor', 'pagination', 'ordering', 'facets', 'price_buckets'}
+
+
+def parse_price_boundaries(value):
+    # "10,50,100" -> [Decimal('10'), Decimal('50'), Decimal('100')]; None when malformed
+    if not value:
+        return [Decimal(str(boundary)) for boundary in getattr(settings, 'PRODUCT_PRICE_FACET_BOUNDARIES', DEFAULT_PRICE_BOUNDARIES)]
+    try:
+        boundaries = sorted({Decimal(part.strip()) for part in value.split(',') if part.strip()})
+    except InvalidOperation:
+        return None
+    if not boundaries or len(boundaries) >= MAX_PRICE_BUCKETS or boundaries[0] <= 0:
+        return None
+    return boundaries
+
+
+def category_facet(queryset):
+    # Grouped on the indexed foreign key; names come from the registry rather than a join
+    rows = queryset.values('category_id').annotate(count=Count('pk')).order_by('-count', 'category_id')
+    return [
+        {"id": row['category_id'], "name": categories.name_for(row['category_id']), "count": row['count']}
+        for row in rows
+    ]
+
+
+def price_facet(queryset, boundaries):
+    edges = [None, *boundaries, None]
+    buckets = []
+    for low, high in zip(edges, edges[1:]):
+        condition = Q()
+        if low is not None:
+            condition &= Q(effective_price__gte=low)
+        if high is not None:
+            condition &= Q(effective_price__lt=high)
+        buckets.append((low, high, condition))
+
+    counts = queryset.aggregate(**{f'bucket_{i}': Count('pk', filter=condition) for i, (_, _, condition) in enumerate(buckets)})
+    return [
+        {"min": low, "max": high, "count": counts[f'bucket_{i}']}
+        for i, (low, high, _) in enumerate(buckets)
+    ]
+
+
+def stock_facet(queryset):
+    return queryset.aggregate(
+        in_stock=Count('pk', filter=Q(stock_quantity__gt=0)),
+        out_of_stock=Count('pk', filter=Q(stock_quantity=0)),
+    )
+
+
+def filter_signature(query_params):
+    return sorted((key, query_params.getlist(key)) for key in query_params if key not in NON_FILTER_PARAMS)
+
+
+def get_facets(queryset, query_params, boundaries):
+    signature = json.dumps([filter_signature(query_params), [str(boundary) for boundary in boundaries]])
+    key = f'facets:{get_catalogue_version()}:{hashlib.md5(signature.encode("utf-8")).hexdigest()}'
+    cache = get_cache()
+    facets = cache.get(key)
+    if facets is None:
+        queryset = queryset.order_by()
+        facets = {
+            "category": category_facet(queryset),
+            "price": price_facet(queryset, boundaries),
+            "stock": stock_facet(queryset),
+        }
+        cache.set(key, facets, timeout=getattr(settings, 'CATALOGUE_CACHE_TIMEOUT', 300))
+    return facets
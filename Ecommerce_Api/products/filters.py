@@ -1,13 +1,77 @@
 import django_filters
-from .models import Product
+from rest_framework import filters
+from django.utils import timezone
+from rest_framework.settings import api_settings
+from .models import Product, Review, Discount
+from .registry import categories
+from .search import search_products
 
 class ProductFilter(django_filters.FilterSet):
-    price_min = django_filters.NumberFilter(field_name='price', lookup_expr='gte')
-    price_max = django_filters.NumberFilter(field_name='price', lookup_expr='lte')
+    # Price bounds apply to what customers pay, i.e. after any active discount
+    price_min = django_filters.NumberFilter(field_name='effective_price', lookup_expr='gte')
+    price_max = django_filters.NumberFilter(field_name='effective_price', lookup_expr='lte')
+    # For products with sharded stock this is the cached sum of the shards (products.inventory)
     stock_min = django_filters.NumberFilter(field_name='stock_quantity', lookup_expr='gte')
     stock_max = django_filters.NumberFilter(field_name='stock_quantity', lookup_expr='lte')
-    category = django_filters.CharFilter(field_name='category__name', lookup_expr='icontains')  # Filter by category name (partial match)
+    category = django_filters.CharFilter(method='filter_category')  # Filter by category name (partial match)
+    category_exact = django_filters.CharFilter(method='filter_category_exact')  # Filter by exact category name
 
     class Meta:
         model = Product
-        fields = ['price_min', 'price_max', 'stock_min', 'stock_max', 'category']
+        fields = ['price_min', 'price_max', 'stock_min', 'stock_max', 'category', 'category_exact']
+
+    # Both resolve names to ids in memory and filter on the indexed category_id, with no join
+    def filter_category(self, queryset, name, value):
+        return queryset.filter(category_id__in=categories.matching(value))
+
+    def filter_category_exact(self, queryset, name, value):
+        category_id = categories.resolve(value)
+        if category_id is None:
+            return queryset.none()
+        return queryset.filter(category_id=category_id)
+
+
+class ReviewFilter(django_filters.FilterSet):
+    rating_min = django_filters.NumberFilter(field_name='rating', lookup_expr='gte')
+    rating_max = django_filters.NumberFilter(field_name='rating', lookup_expr='lte')
+
+    class Meta:
+        model = Review
+        fields = ['rating', 'rating_min', 'rating_max']
+
+
+class DiscountFilter(django_filters.FilterSet):
+    # ?status= splits the history on start_date/end_date, which are indexed
+    status = django_filters.ChoiceFilter(
+        choices=[('active', 'Active'), ('upcoming', 'Upcoming'), ('expired', 'Expired')], method='filter_status',
+    )
+    category = django_filters.CharFilter(method='filter_category')  # Filter by exact category name
+
+    class Meta:
+        model = Discount
+        fields = ['status', 'product', 'campaign', 'category']
+
+    def filter_status(self, queryset, name, value):
+        now = timezone.now()
+        if value == 'active':
+            return queryset.filter(start_date__lte=now, end_date__gte=now)
+        if value == 'upcoming':
+            return queryset.filter(start_date__gt=now)
+        return queryset.filter(end_date__lt=now)
+
+    def filter_category(self, queryset, name, value):
+        return queryset.filter(product__category_id=categories.resolve(value))
+
+
+class ProductSearchFilter(filters.SearchFilter):
+    # ?search= served by the inverted index in products.search instead of LIKE '%term%' scans
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param, '').strip()
+        if not query:
+            return queryset
+
+        queryset = search_products(queryset, query)
+        # Rank by relevance unless the client asked for an explicit ordering
+        if not request.query_params.get(api_settings.ORDERING_PARAM):
+            queryset = queryset.order_by('-search_rank', 'pk')
+        return queryset
@@ -0,0 +1,185 @@
+"""
+Sharded stock for hot SKUs. A product with sharded_stock set keeps its stock in StockShard rows, so concurrent
+orders decrement different rows instead of queueing on the product row. Its stock_quantity is then a cached sum
+of the shards, which listings and filters read: refreshed when an order commits, at most once every
+STOCK_SUM_SYNC_INTERVAL seconds. Orders inside an interval mark the product dirty instead; the next order after
+it, the process_order_jobs worker (sync_dirty_stock_sums) or rebalance_stock_shards catch it up.
+
+Locks are always taken in the same order as orders.checkout: product rows, then shards by (product id, index).
+"""
+import random
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Sum
+
+from .cache import catalogue_changed, get_cache
+from .models import Product, StockShard
+
+RESERVE_ATTEMPTS = 3  # Shards tried before giving up on an order that one shard could cover
+
+
+class StockError(Exception):
+    pass
+
+
+class InsufficientStock(StockError):
+    def __init__(self, available):
+        super().__init__(f"Only {available} in stock.")
+        self.available = available
+
+
+def split_stock(total, shards):
+    # Spread `total` as evenly as possible over `shards` counters
+    return [total // shards + (1 if index < total % shards else 0) for index in range(shards)]
+
+
+def lock_shards(product_ids):
+    # {product id: [shards in index order]}, locked with one SELECT ... FOR UPDATE
+    shards = {}
+    for shard in StockShard.objects.select_for_update().filter(product_id__in=product_ids).order_by('product_id', 'index'):
+        shards.setdefault(shard.product_id, []).append(shard)
+    return shards
+
+
+def take_from_shards(shards_by_product, quantities):
+    # Take {product id: quantity} out of shards locked by lock_shards, leaving the rest spread evenly
+    changed = []
+    for product_id, quantity in quantities.items():
+        shards = shards_by_product[product_id]
+        remaining = sum(shard.quantity for shard in shards) - quantity
+        if remaining < 0:
+            raise InsufficientStock(remaining + quantity)
+        for shard, shard_quantity in zip(shards, split_stock(remaining, len(shards))):
+            if shard.quantity != shard_quantity:
+                shard.quantity = shard_quantity
+                changed.append(shard)
+        stock_changed(product_id)
+    StockShard.objects.bulk_update(changed, ['quantity'])
+
+
+@transaction.atomic
+def reserve(product_id, quantity):
+    """
+    Take `quantity` of a sharded product's stock from one shard holding enough, trying them in index order from a
+    random one. When none could cover it alone at read time, every shard is locked and merged. Raises
+    InsufficientStock when the shards don't hold enough between them, or StockError when the product is no
+    longer sharded or the shards it tried were drained by concurrent orders.
+    """
+    candidates = list(
+        StockShard.objects.filter(product_id=product_id, quantity__gte=quantity).order_by('index')
+        .values_list('index', flat=True)
+    )
+    if candidates:
+        # Always upwards, never wrapping: a failed UPDATE keeps its row lock on MySQL, so going back to a lower
+        # shard (or merging them all) could deadlock with an order locking shards in index order
+        start = random.randrange(len(candidates))
+        for index in candidates[start:start + RESERVE_ATTEMPTS]:
+            # Conditional, as another order may have drained the shard since it was read
+            if StockShard.objects.filter(product_id=product_id, index=index, quantity__gte=quantity).update(
+                quantity=F('quantity') - quantity
+            ):
+                stock_changed(product_id)
+                return
+        raise StockError("Stock changed while it was being reserved.")
+
+    # No locks held on this product's shards yet, so they can all be taken in index order
+    shards = lock_shards([product_id])
+    if not shards:
+        raise StockError("Stock is no longer sharded for this product.")
+    take_from_shards(shards, {product_id: quantity})
+
+
+def stock_changed(product_id):
+    # Refresh the product's cached sum once the transaction commits, at most once per interval so the product
+    # row isn't written by every order; within the interval, leave it for sync_dirty_stock_sums
+    cache = get_cache()
+    interval = getattr(settings, 'STOCK_SUM_SYNC_INTERVAL', 5)
+    if cache.add(f'stock:{product_id}:synced', 1, timeout=interval):
+        transaction.on_commit(lambda: sync_stock_sums([product_id]))
+    else:
+        transaction.on_commit(lambda: cache.set(f'stock:{product_id}:dirty', 1, timeout=None))
+
+
+def sync_dirty_stock_sums():
+    # Refresh the sums skipped by stock_changed, so they catch up once a burst of orders stops
+    cache = get_cache()
+    keys = {
+        f'stock:{product_id}:dirty': product_id
+        for product_id in Product.objects.filter(sharded_stock=True).values_list('pk', flat=True)
+    }
+    dirty = cache.get_many(keys) if keys else {}
+    if not dirty:
+        return 0
+    cache.delete_many(dirty)  # Before the shards are read, so an order committing meanwhile marks it again
+    return sync_stock_sums([keys[key] for key in dirty])
+
+
+def sync_stock_sums(product_ids):
+    # Copy each sharded product's shard total into stock_quantity; plain reads, so orders aren't blocked
+    totals = (
+        StockShard.objects.filter(product_id__in=product_ids).order_by()
+        .values('product_id').annotate(total=Sum('quantity')).values_list('product_id', 'total')
+    )
+    updated = 0
+    for product_id, total in totals:
+        updated += Product.objects.filter(pk=product_id, sharded_stock=True).exclude(stock_quantity=total).update(
+            stock_quantity=total
+        )
+    if updated:
+        catalogue_changed()
+    return updated
+
+
+@transaction.atomic
+def redistribute(product_id, total=None):
+    """
+    Spread a sharded product's stock evenly over its shards and refresh its cached sum. `total` replaces the
+    stock (a restock), otherwise the shards' current total is kept. Returns the total, or None when the product
+    isn't sharded.
+    """
+    if not Product.objects.select_for_update().filter(pk=product_id, sharded_stock=True).exists():
+        return None
+    shards = lock_shards([product_id])[product_id]
+    if total is None:
+        total = sum(shard.quantity for shard in shards)
+    for shard, quantity in zip(shards, split_stock(total, len(shards))):
+        shard.quantity = quantity
+    StockShard.objects.bulk_update(shards, ['quantity'])
+    if Product.objects.filter(pk=product_id).exclude(stock_quantity=total).update(stock_quantity=total):
+        catalogue_changed()
+    return total
+
+
+def restocked(product_ids):
+    # stock_quantity was just written (e.g. by an import or an edit): make it the new stock of sharded products
+    for product_id, total in Product.objects.filter(pk__in=product_ids, sharded_stock=True).values_list('pk', 'stock_quantity'):
+        redistribute(product_id, total)
+
+
+@transaction.atomic
+def enable_sharding(product_id, shards=None):
+    # Split the product's stock over `shards` counters (STOCK_SHARDS by default); re-splits an already sharded one
+    shards = shards or getattr(settings, 'STOCK_SHARDS', 8)
+    product = Product.objects.select_for_update().only('pk', 'stock_quantity', 'sharded_stock').get(pk=product_id)
+    total = product.stock_quantity
+    if product.sharded_stock:
+        total = sum(shard.quantity for shard in lock_shards([product_id]).get(product_id, []))
+        StockShard.objects.filter(product_id=product_id).delete()
+    StockShard.objects.bulk_create([
+        StockShard(product_id=product_id, index=index, quantity=quantity)
+        for index, quantity in enumerate(split_stock(total, shards))
+    ])
+    Product.objects.filter(pk=product_id).update(sharded_stock=True, stock_quantity=total)
+    catalogue_changed()
+
+
+@transaction.atomic
+def disable_sharding(product_id):
+    # Merge the shards back into stock_quantity
+    if not Product.objects.select_for_update().filter(pk=product_id, sharded_stock=True).exists():
+        return
+    total = sum(shard.quantity for shard in lock_shards([product_id]).get(product_id, []))
+    StockShard.objects.filter(product_id=product_id).delete()
+    Product.objects.filter(pk=product_id).update(sharded_stock=False, stock_quantity=total)
+    catalogue_changed()
@@ -0,0 +1,94 @@
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from products.models import Category, Discount, Product
+from products.pricing import PriceBook
+
+
+class Command(BaseCommand):
+    help = (
+        "Times pricing N products one query at a time against a single PriceBook. "
+        "Runs on throwaway rows inside a transaction that is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=10000)
+        parser.add_argument('--discount-every', type=int, default=3, help="Give every Nth product two overlapping discounts.")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            products = self.create_catalogue(options['products'], options['discount_every'])
+            now = timezone.now()
+
+            legacy, legacy_queries, legacy_prices = self.measure(lambda: self.price_one_by_one(products, now))
+            batched, batched_queries, batched_prices = self.measure(
+                lambda: PriceBook.for_products([product.pk for product in products], now).prices(products)
+            )
+            transaction.set_rollback(True)
+
+        discounted = sum(1 for product in products if batched_prices[product.pk] != product.price)
+        self.stdout.write(f"{len(products)} products, {discounted} discounted")
+        self.stdout.write(f"one query per product: {legacy:.3f}s, {legacy_queries} queries")
+        self.stdout.write(f"PriceBook:             {batched:.3f}s, {batched_queries} queries")
+        self.stdout.write(self.style.SUCCESS(f"Speed-up: {legacy / batched:.1f}x"))
+
+    def measure(self, fn):
+        queries = []
+
+        def count_query(execute, sql, params, many, context):
+            queries.append(sql)
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(count_query):
+            started = time.perf_counter()
+            result = fn()
+            elapsed = time.perf_counter() - started
+        return elapsed, len(queries), result
+
+    def price_one_by_one(self, products, now):
+        # What pricing used to cost: a discount lookup per product
+        prices = {}
+        for product in products:
+            discount = product.discounts.filter(start_date__lte=now, end_date__gte=now).order_by('id').first()
+            prices[product.pk] = product.price - product.price * discount.discount_percentage / 100 if discount else product.price
+        return prices
+
+    def create_catalogue(self, count, discount_every):
+        user = get_user_model()(email='pricing-benchmark@example.invalid', username='pricing-benchmark')
+        user.set_unusable_password()
+        user.save()
+        category = Category.objects.create(name='Pricing benchmark')
+        products = Product.objects.bulk_create([
+            Product(
+                name=f'Benchmark product {i}',
+                description='Pricing benchmark',
+                price=Decimal(100 + i % 900) + Decimal('0.99'),
+                effective_price=Decimal(100 + i % 900) + Decimal('0.99'),
+                category=category,
+                stock_quantity=1,
+                image_url='https://example.com/benchmark.jpg',
+                created_by=user,
+            )
+            for i in range(count)
+        ], batch_size=1000)
+        if not connection.features.can_return_rows_from_bulk_insert:
+            products = list(Product.objects.filter(category=category).order_by('id'))
+
+        now = timezone.now()
+        Discount.objects.bulk_create([
+            Discount(
+                product=product,
+                discount_percentage=percentage,
+                start_date=now - timedelta(days=1),
+                end_date=now + timedelta(days=1),
+            )
+            for product in products[::discount_every]
+            for percentage in (Decimal('10.00'), Decimal('12.50'))
+        ], batch_size=1000)
+        return products
@@ -0,0 +1,22 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from products.bulk import EXPORT_FIELDS, FORMATS, export_rows, stream_export
+
+
+class Command(BaseCommand):
+    help = "Streams the product catalogue as NDJSON or CSV."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=FORMATS, default='ndjson')
+        parser.add_argument('--output', default='-', help="File to write, or - for standard output.")
+        parser.add_argument('--chunk-size', type=int, default=2000, help="Rows fetched per database round trip.")
+
+    def handle(self, *args, **options):
+        chunks = stream_export(EXPORT_FIELDS, export_rows(chunk_size=options['chunk_size']), options['format'])
+        if options['output'] == '-':
+            sys.stdout.writelines(chunks)
+        else:
+            with open(options['output'], 'w', newline='', encoding='utf-8') as output:
+                output.writelines(chunks)
@@ -0,0 +1,37 @@
+import sys
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from products.bulk import FORMATS, ProductImporter
+
+
+class Command(BaseCommand):
+    help = "Upserts products by name from an NDJSON or CSV file, streaming it in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to import, or - for standard input.")
+        parser.add_argument('--format', choices=FORMATS, help="Defaults to the file extension, or ndjson.")
+        parser.add_argument('--user', required=True, help="Email of the user recorded as creator of new products.")
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        try:
+            user = get_user_model().objects.get(email=options['user'])
+        except get_user_model().DoesNotExist:
+            raise CommandError(f"No user with email {options['user']}.")
+
+        path = options['path']
+        file_format = options['format'] or ('csv' if path.endswith('.csv') else 'ndjson')
+        importer = ProductImporter(user, batch_size=options['batch_size'])
+        if path == '-':
+            report = importer.run(sys.stdin.buffer, file_format)
+        else:
+            with open(path, 'rb') as stream:
+                report = importer.run(stream, file_format)
+
+        for error in report['errors']:
+            self.stderr.write(f"line {error['line']}: {error['errors']}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Processed {report['processed']} rows: {report['upserted']} upserted, {report['failed']} failed."
+        ))
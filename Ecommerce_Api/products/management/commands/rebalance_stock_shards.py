@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from products.inventory import redistribute
+from products.models import Product
+
+
+class Command(BaseCommand):
+    help = (
+        "Spreads the stock of every sharded product evenly over its shards again and refreshes its cached "
+        "stock_quantity. Schedule it every minute or so while sharding is in use."
+    )
+
+    def handle(self, *args, **options):
+        product_ids = list(Product.objects.filter(sharded_stock=True).order_by('pk').values_list('pk', flat=True))
+        for product_id in product_ids:
+            redistribute(product_id)  # One short transaction per product
+        self.stdout.write(self.style.SUCCESS(f"Rebalanced stock shards of {len(product_ids)} products."))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from products.ratings import rebuild_rating_summaries
+
+
+class Command(BaseCommand):
+    help = "Recomputes every product's rating summary from its reviews."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="Products summarized per query.")
+
+    def handle(self, *args, **options):
+        rebuilt = rebuild_rating_summaries(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt rating summaries for {rebuilt} products."))
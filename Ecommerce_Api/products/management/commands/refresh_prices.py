@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from products.cache import bump_catalogue_version
+from products.pricing import next_price_boundary, products_due_for_refresh, refresh_effective_prices
+
+
+class Command(BaseCommand):
+    help = "Applies discount start/end boundaries that have passed to Product.effective_price."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help="Recompute every product instead of only those due.")
+        parser.add_argument('--watch', action='store_true', help="Keep running, waking up at each discount boundary.")
+        parser.add_argument('--max-sleep', type=float, default=60, help="Longest pause between checks in watch mode, in seconds.")
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        if options['all']:
+            self.refresh(None, options['batch_size'])
+        if not options['watch']:
+            if not options['all']:
+                self.refresh(products_due_for_refresh(), options['batch_size'])
+            return
+
+        while True:
+            self.refresh(products_due_for_refresh(), options['batch_size'])
+            # Sleep until just past the next boundary, but re-check periodically for discounts created meanwhile
+            boundary = next_price_boundary()
+            pause = options['max_sleep']
+            if boundary is not None:
+                pause = min(pause, max((boundary - timezone.now()).total_seconds(), 0) + 0.001)
+            time.sleep(pause)
+
+    def refresh(self, product_ids, batch_size):
+        updated = refresh_effective_prices(product_ids, batch_size=batch_size)
+        if updated:
+            bump_catalogue_version()
+            self.stdout.write(f"{timezone.now().isoformat()} updated the effective price of {updated} products.")
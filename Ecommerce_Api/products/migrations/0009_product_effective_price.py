@@ -0,0 +1,40 @@
+# Generated by Django 5.1.1 on 2026-10-18 18:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def copy_base_price(apps, schema_editor):
+    # Existing rows start at their base price; `manage.py refresh_prices --all` then applies active discounts
+    Product = apps.get_model('products', 'Product')
+    Product.objects.update(effective_price=models.F('price'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0008_searchterm'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='effective_price',
+            field=models.DecimalField(decimal_places=2, editable=False, max_digits=10, null=True),
+        ),
+        migrations.RunPython(copy_base_price, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='product',
+            name='effective_price',
+            field=models.DecimalField(decimal_places=2, editable=False, max_digits=10),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='active_discount',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='products.discount'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['effective_price', 'id'], name='product_eff_price_id_idx'),
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.1.1 on 2026-10-18 17:58
+
+import django.db.models.deletion
+from decimal import Decimal
+
+from django.db import migrations, models
+
+
+def create_summaries(apps, schema_editor):
+    # One summary per existing product, filled from its reviews (`manage.py rebuild_rating_summaries` does the same)
+    Product = apps.get_model('products', 'Product')
+    Review = apps.get_model('products', 'Review')
+    ProductRatingSummary = apps.get_model('products', 'ProductRatingSummary')
+
+    stats = {}
+    for product_id, rating in Review.objects.values_list('product_id', 'rating').iterator():
+        summary = stats.setdefault(product_id, {'review_count': 0, 'rating_total': 0, **{f'stars_{n}': 0 for n in range(1, 6)}})
+        summary['review_count'] += 1
+        summary['rating_total'] += rating
+        summary[f'stars_{rating}'] += 1
+
+    summaries = []
+    for product_id in Product.objects.values_list('pk', flat=True).iterator():
+        summary = stats.get(product_id, {})
+        if summary:
+            summary['average_rating'] = (Decimal(summary['rating_total']) / summary['review_count']).quantize(Decimal('0.01'))
+        summaries.append(ProductRatingSummary(product_id=product_id, **summary))
+    ProductRatingSummary.objects.bulk_create(summaries, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0009_product_effective_price'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductRatingSummary',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='rating_summary', serialize=False, to='products.product')),
+                ('review_count', models.PositiveIntegerField(default=0)),
+                ('rating_total', models.PositiveIntegerField(default=0)),
+                ('average_rating', models.DecimalField(decimal_places=2, default=0, max_digits=3)),
+                ('stars_1', models.PositiveIntegerField(default=0)),
+                ('stars_2', models.PositiveIntegerField(default=0)),
+                ('stars_3', models.PositiveIntegerField(default=0)),
+                ('stars_4', models.PositiveIntegerField(default=0)),
+                ('stars_5', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['average_rating', 'product'], name='rating_avg_product_idx')],
+            },
+        ),
+        migrations.RunPython(create_summaries, migrations.RunPython.noop),
+    ]
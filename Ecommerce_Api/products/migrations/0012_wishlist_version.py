@@ -0,0 +1,18 @@
+# Generated by Django 5.1.1 on 2026-10-18 18:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0011_review_feed_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='wishlist',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
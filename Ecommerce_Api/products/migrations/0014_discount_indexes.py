@@ -0,0 +1,25 @@
+# Generated by Django 5.1.1 on 2026-10-18 18:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0013_discount_campaigns'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='discount',
+            index=models.Index(fields=['product', 'start_date', 'end_date'], name='discount_product_window_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='discount',
+            index=models.Index(fields=['start_date', 'id'], name='discount_start_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='discount',
+            index=models.Index(fields=['end_date', 'id'], name='discount_end_id_idx'),
+        ),
+    ]
@@ -4,6 +4,8 @@ from django.conf import settings
 from django.utils import timezone
 from decimal import Decimal
 
+from .cache import wishlist_changed
+
 
 class Category(models.Model):
     name = models.CharField(max_length=255, unique = True)
@@ -14,6 +16,21 @@ class Category(models.Model):
         return self.name 
 
 
+class ProductQuerySet(models.QuerySet):
+    def with_listing_data(self):
+        # Batch the rating summary, images and currently active discount so serializing a page costs a fixed
+        # number of queries; category names come from products.registry
+        now = timezone.now()
+        return self.select_related('rating_summary').prefetch_related(
+            models.Prefetch('images', queryset=ProductImage.objects.order_by('id')),
+            models.Prefetch(
+                'discounts',
+                queryset=Discount.objects.filter(start_date__lte=now, end_date__gte=now).order_by('id'),
+                to_attr='active_discounts'
+            ),
+        )
+
+
 class Product(models.Model):
     name = models.CharField(max_length=255, unique=True)
     description = models.TextField()
@@ -24,8 +41,47 @@ class Product(models.Model):
     created_date = models.DateTimeField(auto_now_add=True)   
     created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.PROTECT, null= False, blank=False)
     updated = models.DateTimeField(auto_now=True)
+    # Price customers pay right now, kept in step with Discount windows by products.pricing
+    effective_price = models.DecimalField(max_digits=10, decimal_places=2, editable=False)
+    active_discount = models.ForeignKey('Discount', on_delete=models.SET_NULL, null=True, blank=True, editable=False, related_name='+')
+    # Opt-in for hot SKUs: stock lives in StockShard rows and stock_quantity becomes their cached sum (products.inventory)
+    sharded_stock = models.BooleanField(default=False, editable=False)
+
+    objects = ProductQuerySet.as_manager()
+
+    class Meta:
+        # (sort key, id) pairs for keyset pagination; name is unique so its own index already serves that ordering
+        indexes = [
+            models.Index(fields=['created_date', 'id'], name='product_created_id_idx'),
+            models.Index(fields=['price', 'id'], name='product_price_id_idx'),
+            models.Index(fields=['stock_quantity', 'id'], name='product_stock_id_idx'),
+            models.Index(fields=['effective_price', 'id'], name='product_eff_price_id_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or 'price' in update_fields:
+            self.refresh_effective_price()
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'effective_price', 'active_discount'}
+        super().save(*args, **kwargs)
+
+    def refresh_effective_price(self):
+        from .pricing import PriceBook
+
+        book = PriceBook.for_products([self.pk] if self.pk else [])
+        self.effective_price = book.price_for(self)
+        self.active_discount = book.discount_for(self.pk)
 
     def reduce_stock_quantity(self, quantity):
+        if self.sharded_stock:
+            from .inventory import StockError, reserve
+
+            try:
+                reserve(self.pk, quantity)
+            except StockError:
+                raise ValueError("Not enough stock available")
+            return
         if self.stock_quantity >= quantity:
             self.stock_quantity -= quantity
             self.save()
@@ -35,12 +91,26 @@ class Product(models.Model):
     def __str__(self):
         return self.name
     
-    def get_discounted_price(self):
-        active_discount = self.discounts.filter(start_date__lte=timezone.now(), end_date__gte=timezone.now()).first()
-        if active_discount:
-            discount_amount = self.price * (active_discount.discount_percentage / 100)
-            return self.price - discount_amount
-        return self.price
+    def get_discounted_price(self, as_of=None):
+        # For many products at once, use products.pricing.PriceBook directly
+        from .pricing import PriceBook
+
+        return PriceBook.for_products([self.pk], as_of).price_for(self)
+
+class StockShard(models.Model):
+    # One slice of a sharded product's stock, so concurrent orders for the product decrement different rows
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='stock_shards')
+    index = models.PositiveSmallIntegerField()
+    quantity = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'index'], name='stockshard_product_index_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} shard {self.index}: {self.quantity}"
+
 
 class Review(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='reviews')
@@ -49,9 +119,40 @@ class Review(models.Model):
     comment = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        # Back the review feed's keyset pagination by date and by rating within a product
+        indexes = [
+            models.Index(fields=['product', 'created_at'], name='review_product_created_idx'),
+            models.Index(fields=['product', 'rating'], name='review_product_rating_idx'),
+        ]
+
     def __str__(self):
         return f'{self.product.name} - {self.user.email}' 
 
+class ProductRatingSummary(models.Model):
+    # Denormalized review stats, kept current by products.ratings as reviews are written
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='rating_summary')
+    review_count = models.PositiveIntegerField(default=0)
+    rating_total = models.PositiveIntegerField(default=0)
+    average_rating = models.DecimalField(max_digits=3, decimal_places=2, default=0)
+    stars_1 = models.PositiveIntegerField(default=0)
+    stars_2 = models.PositiveIntegerField(default=0)
+    stars_3 = models.PositiveIntegerField(default=0)
+    stars_4 = models.PositiveIntegerField(default=0)
+    stars_5 = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['average_rating', 'product'], name='rating_avg_product_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.product_id}: {self.average_rating} ({self.review_count} reviews)'
+
+    def histogram(self):
+        return {str(stars): getattr(self, f'stars_{stars}') for stars in range(1, 6)}
+
+
 class ProductImage(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='images')
     image_url = models.URLField()
@@ -59,7 +160,27 @@ class ProductImage(models.Model):
 class Wishlist(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     products = models.ManyToManyField(Product, related_name='wishlisted_by')
-   
+    version = models.PositiveIntegerField(default=0)  # Bumped on every change so clients can skip no-op syncs
+
+    def apply_changes(self, add_ids=(), remove_ids=()):
+        # Set-based add/remove on the through table; call inside a transaction holding this row locked.
+        # Product ids to add must already be validated. Returns how many products were added and removed.
+        through = Wishlist.products.through
+        rows = through.objects.filter(wishlist_id=self.pk)
+        added = []
+        if add_ids:
+            present = set(rows.filter(product_id__in=add_ids).values_list('product_id', flat=True))
+            added = [product_id for product_id in sorted(set(add_ids)) if product_id not in present]
+            through.objects.bulk_create(
+                [through(wishlist_id=self.pk, product_id=product_id) for product_id in added],
+                ignore_conflicts=True,
+            )
+        removed = rows.filter(product_id__in=remove_ids).delete()[0] if remove_ids else 0
+        if added or removed:
+            self.version += 1
+            Wishlist.objects.filter(pk=self.pk).update(version=self.version)
+            wishlist_changed(self.user_id)
+        return len(added), removed
 
     # class Meta:
     #     unique_together = ('user', 'product')  # Prevents duplicate entries of the same product in a user's wishlist
@@ -67,16 +188,55 @@ class Wishlist(models.Model):
     def __str__(self):
         return f"{self.user.email} - {self.product.name}"
     
+class DiscountCampaign(models.Model):
+    # One percentage over a date window, applied to a whole category or a list of products in one go
+    name = models.CharField(max_length=255)
+    discount_percentage = models.DecimalField(max_digits=5, decimal_places=2)
+    start_date = models.DateTimeField()
+    end_date = models.DateTimeField()
+    category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True, blank=True, related_name='campaigns')
+    created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.PROTECT)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.discount_percentage}% off)"
+
+
 class Discount(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='discounts')
     discount_percentage = models.DecimalField(max_digits=5, decimal_places=2)
     start_date = models.DateTimeField()
     end_date = models.DateTimeField()
-
+    # Set for discounts created by a campaign; cancelling the campaign deletes them
+    campaign = models.ForeignKey(DiscountCampaign, on_delete=models.CASCADE, null=True, blank=True, related_name='discounts')
+
+    class Meta:
+        indexes = [
+            # Active-discount lookups for a batch of products (pricing) and per-product discount listings
+            models.Index(fields=['product', 'start_date', 'end_date'], name='discount_product_window_idx'),
+            # Keyset pages of the discount list, and its active/upcoming/expired filters
+            models.Index(fields=['start_date', 'id'], name='discount_start_id_idx'),
+            models.Index(fields=['end_date', 'id'], name='discount_end_id_idx'),
+        ]
 
     def __str__(self):
         return f"{self.discount_percentage}% off on {self.product.name}"
 
     def is_active(self):
         now = timezone.now()
-        return self.start_date <= now <= self.end_date
\ No newline at end of file
+        return self.start_date <= now <= self.end_date
+
+class SearchTerm(models.Model):
+    # Inverted index row: one normalized term per product, weighted by where and how often it appears
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='search_terms')
+    term = models.CharField(max_length=64)
+    weight = models.PositiveIntegerField()
+
+    class Meta:
+        constraints = [
+            # Also serves the term prefix lookups made by products.search
+            models.UniqueConstraint(fields=['term', 'product'], name='searchterm_term_product_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.term} -> {self.product_id} ({self.weight})"
@@ -0,0 +1,152 @@
+import binascii
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+from datetime import datetime
+from decimal import Decimal
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class ProductPagination(PageNumberPagination):
+    # Lets clients pick the page size with ?page_size=, bounded so one request can't pull the whole catalogue
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination that seeks on (sort key, id) instead of counting and offsetting,
+    so every page costs the same no matter how deep it is.
+    """
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+    cursor_query_param = 'cursor'
+    ordering_param = 'ordering'
+    ordering_fields = ()  # Sort keys a client may pick with ?ordering=
+    default_ordering = None  # e.g. 'created_date' or '-created_at'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(request)
+        field = self.ordering.lstrip('-')
+        descending = self.ordering.startswith('-')
+
+        cursor = self.decode_cursor(request)
+        self.reverse = bool(cursor and cursor['r'])
+        seek_descending = descending != self.reverse
+
+        if cursor:
+            # key >= value AND (key > value OR id > pk) lets the (key, id) index do a single range seek
+            lookup = 'lt' if seek_descending else 'gt'
+            queryset = queryset.filter(**{f'{field}__{lookup}e': cursor['k']}).filter(
+                Q(**{f'{field}__{lookup}': cursor['k']}) | Q(**{f'pk__{lookup}': cursor['i']})
+            )
+        if seek_descending:
+            queryset = queryset.order_by(f'-{field}', '-pk')
+        else:
+            queryset = queryset.order_by(field, 'pk')
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if self.reverse:
+            results.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, cursor is not None
+
+        self.page = results
+        return results
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+            if size > 0:
+                return min(size, self.max_page_size)
+        except (KeyError, ValueError):
+            pass
+        return self.page_size
+
+    def get_ordering(self, request):
+        value = request.query_params.get(self.ordering_param, '')
+        # Only the first term is used; id is always the tiebreaker
+        ordering = value.split(',')[0].strip()
+        if ordering.lstrip('-') in self.ordering_fields:
+            return ordering
+        return self.default_ordering
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            cursor = json.loads(urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+            # A cursor is only valid for the ordering it was issued for
+            if cursor['o'] != self.ordering:
+                raise ValueError
+            cursor['i'] = int(cursor['i'])
+            return cursor
+        except (TypeError, ValueError, KeyError, UnicodeError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, obj, reverse):
+        value = getattr(obj, self.ordering.lstrip('-'))
+        if isinstance(value, datetime):
+            value = value.isoformat()
+        elif isinstance(value, Decimal):
+            value = str(value)
+        cursor = {'o': self.ordering, 'k': value, 'i': obj.pk, 'r': int(reverse)}
+        encoded = urlsafe_b64encode(json.dumps(cursor, separators=(',', ':')).encode('utf-8')).decode('ascii')
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class ProductKeysetPagination(KeysetPagination):
+    ordering_fields = ('created_date', 'price', 'effective_price', 'name', 'stock_quantity', 'average_rating')
+    default_ordering = 'created_date'
+
+
+class ReviewKeysetPagination(KeysetPagination):
+    ordering_fields = ('created_at', 'rating')
+    default_ordering = '-created_at'
+
+
+class DiscountKeysetPagination(KeysetPagination):
+    ordering_fields = ('start_date', 'end_date')
+    default_ordering = '-start_date'
@@ -0,0 +1,167 @@
+import threading
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Product, Discount
+
+CENT = Decimal('0.01')
+
+
+def select_discount(discounts):
+    # Overlapping discounts resolve to the biggest percentage, then the oldest discount
+    return min(discounts, key=lambda discount: (-discount.discount_percentage, discount.pk), default=None)
+
+
+def apply_discount(price, discount):
+    # Integer-cents arithmetic: prices have 2 decimal places and percentages 2 decimal places (basis points),
+    # so the result is exact, rounded half-up to the cent and never below zero
+    if discount is None:
+        return price
+    cents = int(price * 100)
+    remaining_bp = max(10000 - int(discount.discount_percentage * 100), 0)
+    return Decimal((cents * remaining_bp * 2 + 10000) // 20000) * CENT
+
+
+def active_discounts(product_ids=None, now=None):
+    # One query for the discounts in force at `now`, grouped by product
+    now = now or timezone.now()
+    discounts = Discount.objects.filter(start_date__lte=now, end_date__gte=now)
+    if product_ids is not None:
+        discounts = discounts.filter(product_id__in=product_ids)
+    by_product = {}
+    for discount in discounts:
+        by_product.setdefault(discount.product_id, []).append(discount)
+    return by_product
+
+
+class PriceBook:
+    """
+    Effective prices for a batch of products as of one moment. The discounts come from a single query, or from
+    discounts already prefetched onto the products, and overlaps resolve through select_discount().
+    """
+
+    def __init__(self, discounts_by_product, as_of=None):
+        self.as_of = as_of
+        self.discounts = {
+            product_id: select_discount(discounts)
+            for product_id, discounts in discounts_by_product.items()
+            if discounts
+        }
+
+    @classmethod
+    def for_products(cls, product_ids=None, as_of=None):
+        # `product_ids=None` loads the discounts for the whole catalogue
+        as_of = as_of or timezone.now()
+        if product_ids is not None:
+            product_ids = list(product_ids)
+            if not product_ids:
+                return cls({}, as_of)
+        return cls(active_discounts(product_ids, as_of), as_of)
+
+    @classmethod
+    def from_prefetched(cls, products):
+        # Products from Product.objects.with_listing_data() carry their active discounts already
+        return cls({product.pk: product.active_discounts for product in products})
+
+    def discount_for(self, product_id):
+        return self.discounts.get(product_id)
+
+    def price_for(self, product):
+        return apply_discount(product.price, self.discount_for(product.pk))
+
+    def prices(self, products):
+        return {product.pk: self.price_for(product) for product in products}
+
+
+def effective_prices(product_ids, as_of=None):
+    # {product id: effective price} for the given ids, from one product query and one discount query
+    products = list(Product.objects.filter(pk__in=list(product_ids)).only('pk', 'price'))
+    return PriceBook.for_products([product.pk for product in products], as_of).prices(products)
+
+
+def refresh_effective_prices(product_ids=None, now=None, batch_size=1000):
+    """
+    Recompute Product.effective_price and active_discount for the given products (or the whole catalogue)
+    and write back only the rows that changed. Returns the number of products updated.
+    """
+    if product_ids is not None:
+        product_ids = list(product_ids)
+        if not product_ids:
+            return 0
+    book = PriceBook.for_products(product_ids, now)
+
+    products = Product.objects.order_by().only('pk', 'price', 'effective_price', 'active_discount_id')
+    if product_ids is not None:
+        products = products.filter(pk__in=product_ids)
+
+    changed = []
+    updated = 0
+    for product in products.iterator(chunk_size=batch_size):
+        discount = book.discount_for(product.pk)
+        effective_price = book.price_for(product)
+        discount_id = discount.pk if discount else None
+        if product.effective_price != effective_price or product.active_discount_id != discount_id:
+            product.effective_price = effective_price
+            product.active_discount_id = discount_id
+            changed.append(product)
+        if len(changed) >= batch_size:
+            updated += Product.objects.bulk_update(changed, ['effective_price', 'active_discount'])
+            changed = []
+    if changed:
+        updated += Product.objects.bulk_update(changed, ['effective_price', 'active_discount'])
+    return updated
+
+
+_deferred = threading.local()
+
+
+@contextmanager
+def defer_price_refresh():
+    # Collect the products whose discounts change inside the block (e.g. a cascade deleting thousands of
+    # discounts, each sending post_delete) and reprice them in one pass at the end
+    if getattr(_deferred, 'product_ids', None) is not None:
+        yield  # Already deferred by an outer block
+        return
+    _deferred.product_ids = set()
+    try:
+        yield
+        product_ids = _deferred.product_ids
+    finally:
+        _deferred.product_ids = None
+    refresh_effective_prices(product_ids)
+
+
+def discounts_changed(product_ids):
+    # Reprice now, or at the end of the enclosing defer_price_refresh() block
+    pending = getattr(_deferred, 'product_ids', None)
+    if pending is not None:
+        pending.update(product_ids)
+    else:
+        refresh_effective_prices(product_ids)
+
+
+def products_due_for_refresh(now=None):
+    # Products whose stored discount no longer matches the discounts in force at `now`
+    now = now or timezone.now()
+    expired = Product.objects.filter(active_discount__isnull=False).exclude(
+        active_discount__start_date__lte=now, active_discount__end_date__gte=now
+    ).values_list('pk', flat=True)
+    moved = Product.objects.filter(active_discount__isnull=False).exclude(
+        active_discount__product=F('pk')
+    ).values_list('pk', flat=True)
+    started = Discount.objects.filter(start_date__lte=now, end_date__gte=now).exclude(
+        product__active_discount=F('pk')
+    ).values_list('product_id', flat=True)
+    return set(expired) | set(moved) | set(started)
+
+
+def next_price_boundary(now=None):
+    # The next moment a discount starts or ends, i.e. when some effective price flips
+    now = now or timezone.now()
+    next_start = Discount.objects.filter(start_date__gt=now).order_by('start_date').values_list('start_date', flat=True).first()
+    next_end = Discount.objects.filter(end_date__gte=now).order_by('end_date').values_list('end_date', flat=True).first()
+    boundaries = [boundary for boundary in (next_start, next_end) if boundary is not None]
+    return min(boundaries) if boundaries else None
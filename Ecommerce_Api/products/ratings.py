@@ -0,0 +1,86 @@
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, Count, DecimalField, ExpressionWrapper, F, Q, Sum, Value, When
+from django.db.models.functions import Coalesce
+
+from .cache import catalogue_changed
+from .models import Product, ProductRatingSummary, Review
+
+
+def _apply(product_id, count_delta, total_delta, star_deltas):
+    # Adjust the counters with F() so concurrent reviews on the same product never lose an update
+    updates = {
+        'review_count': F('review_count') + count_delta,
+        'rating_total': F('rating_total') + total_delta,
+    }
+    for stars, delta in star_deltas.items():
+        if delta:
+            updates[f'stars_{stars}'] = F(f'stars_{stars}') + delta
+
+    with transaction.atomic():
+        ProductRatingSummary.objects.get_or_create(product_id=product_id)
+        summary = ProductRatingSummary.objects.filter(product_id=product_id)
+        summary.update(**updates)
+        # A separate statement, since MySQL would otherwise see the already-updated counters mid-UPDATE
+        summary.update(average_rating=Case(
+            When(review_count=0, then=Value(0)),
+            default=ExpressionWrapper(F('rating_total') * 1.0 / F('review_count'), output_field=DecimalField()),
+            output_field=DecimalField(),
+        ))
+        catalogue_changed()  # Product responses include the summary
+
+
+def review_added(review):
+    _apply(review.product_id, 1, review.rating, {review.rating: 1})
+
+
+def review_rating_changed(product_id, old_rating, new_rating):
+    if old_rating != new_rating:
+        _apply(product_id, 0, new_rating - old_rating, {old_rating: -1, new_rating: 1})
+
+
+def review_removed(review):
+    _apply(review.product_id, -1, -review.rating, {review.rating: -1})
+
+
+def summary_rows(product_ids):
+    # Fresh summaries for the given products from a single grouped query over Review
+    stats = {
+        row['product_id']: row
+        for row in Review.objects.filter(product_id__in=product_ids).order_by().values('product_id').annotate(
+            review_count=Count('pk'),
+            rating_total=Coalesce(Sum('rating'), 0),
+            **{f'stars_{stars}': Count('pk', filter=Q(rating=stars)) for stars in range(1, 6)},
+        )
+    }
+    for product_id in product_ids:
+        row = stats.get(product_id)
+        if row is None:
+            yield ProductRatingSummary(product_id=product_id)
+            continue
+        yield ProductRatingSummary(
+            product_id=product_id,
+            review_count=row['review_count'],
+            rating_total=row['rating_total'],
+            average_rating=(Decimal(row['rating_total']) / row['review_count']).quantize(Decimal('0.01')),
+            **{f'stars_{stars}': row[f'stars_{stars}'] for stars in range(1, 6)},
+        )
+
+
+def rebuild_rating_summaries(batch_size=1000):
+    # Recompute every summary from scratch, one batch of products at a time
+    product_ids = Product.objects.order_by('pk').values_list('pk', flat=True)
+    rebuilt = 0
+    with transaction.atomic():
+        ProductRatingSummary.objects.all().delete()
+        batch = []
+        for product_id in product_ids.iterator(chunk_size=batch_size):
+            batch.append(product_id)
+            if len(batch) >= batch_size:
+                rebuilt += len(ProductRatingSummary.objects.bulk_create(summary_rows(batch)))
+                batch = []
+        if batch:
+            rebuilt += len(ProductRatingSummary.objects.bulk_create(summary_rows(batch)))
+        catalogue_changed()
+    return rebuilt
@@ -0,0 +1,88 @@
+"""
+Process-local map of category names to ids.
+
+Categories change rarely but are looked up on every product read and write. Each worker keeps the whole table
+in memory and reloads it when the version key in the shared cache moves (bumped on any category write). That key
+is read at most once every version_check_interval seconds, so per-row lookups stay in memory instead of each
+costing a cache round trip.
+"""
+import threading
+import time
+
+from django.db import transaction
+
+from .cache import bump_version, get_version
+from .models import Category
+
+
+class CategoryRegistry:
+    version_key = 'categories:version'
+    miss_reload_interval = 1.0  # Seconds between reloads triggered by unknown names or ids
+    version_check_interval = 1.0  # Seconds a loaded copy is trusted before the shared version is read again
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = None
+        self.loaded_at = 0.0
+        self.checked_at = None
+        self.ids_by_name = {}
+        self.names_by_id = {}
+
+    def load(self, version):
+        rows = list(Category.objects.values_list('pk', 'name'))
+        with self.lock:
+            self.ids_by_name = {name.casefold(): pk for pk, name in rows}
+            self.names_by_id = dict(rows)
+            self.version = version
+            self.loaded_at = time.monotonic()
+
+    def current(self):
+        now = time.monotonic()
+        if self.checked_at is not None and now - self.checked_at < self.version_check_interval:
+            return self
+        version = get_version(self.version_key)
+        if version != self.version:
+            self.load(version)
+        self.checked_at = now
+        return self
+
+    def refresh(self):
+        # Read the shared version now rather than after the interval, e.g. once the cache has been cleared
+        self.checked_at = None
+        return self.current()
+
+    def reload_after_miss(self):
+        # Covers a category created moments ago whose version bump hasn't reached us; rate-limited against junk input
+        if time.monotonic() - self.loaded_at < self.miss_reload_interval:
+            return False
+        self.load(self.version)
+        return True
+
+    def resolve(self, name):
+        # Case-insensitive exact match -> category id, or None
+        key = name.strip().casefold()
+        category_id = self.current().ids_by_name.get(key)
+        if category_id is None and self.reload_after_miss():
+            category_id = self.ids_by_name.get(key)
+        return category_id
+
+    def name_for(self, category_id):
+        name = self.current().names_by_id.get(category_id)
+        if name is None and self.reload_after_miss():
+            name = self.names_by_id.get(category_id)
+        return name
+
+    def matching(self, fragment):
+        # Ids of categories whose name contains `fragment`, case-insensitively
+        fragment = fragment.strip().casefold()
+        return [pk for name, pk in self.current().ids_by_name.items() if fragment in name]
+
+    def invalidate(self):
+        # Bump now so this connection sees its own write, and again after commit so other workers
+        # can't keep a copy they loaded before the write became visible to them
+        self.checked_at = None  # This worker checks again on its next lookup
+        bump_version(self.version_key)
+        transaction.on_commit(lambda: bump_version(self.version_key))
+
+
+categories = CategoryRegistry()
@@ -0,0 +1,103 @@
+"""
+Inverted-index product search.
+
+Name, description and category name are tokenized into SearchTerm rows (term, product, weight).
+A query matches products that have every query word as a term prefix (so "lap" finds "laptop"), ranked by the
+summed weight of the matching terms.
+"""
+import re
+import unicodedata
+from collections import Counter
+from functools import reduce
+from operator import or_
+
+from django.db import transaction
+from django.db.models import Case, IntegerField, Max, OuterRef, Q, Subquery, Sum, Value, When
+
+from .models import Product, SearchTerm
+
+# How much a single occurrence of a word counts, by the field it came from
+FIELD_WEIGHTS = {'name': 3, 'category': 2, 'description': 1}
+# Product fields an index entry is built from, as they may appear in save(update_fields=...)
+INDEXED_FIELDS = frozenset(['name', 'description', 'category', 'category_id'])
+MAX_TERM_LENGTH = 64
+MAX_QUERY_TERMS = 8
+STOP_WORDS = frozenset([
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'in', 'is', 'it',
+    'of', 'on', 'or', 'that', 'the', 'to', 'with',
+])
+WORD_RE = re.compile(r'\w+')
+
+
+def tokenize(text):
+    # Strip accents, case-fold and split on anything that isn't a word character
+    if not text:
+        return []
+    text = unicodedata.normalize('NFKD', text)
+    text = ''.join(char for char in text if not unicodedata.combining(char)).casefold()
+    return [word[:MAX_TERM_LENGTH] for word in WORD_RE.findall(text) if word not in STOP_WORDS]
+
+
+def build_terms(name, description, category_name):
+    weights = Counter()
+    for field, text in (('name', name), ('description', description), ('category', category_name)):
+        for word in tokenize(text):
+            weights[word] += FIELD_WEIGHTS[field]
+    return weights
+
+
+def _term_rows(rows):
+    for product_id, name, description, category_name in rows:
+        for term, weight in build_terms(name, description, category_name).items():
+            yield SearchTerm(product_id=product_id, term=term, weight=weight)
+
+
+def index_products(product_ids):
+    # Replace the index entries of the given products with freshly computed ones
+    product_ids = list(product_ids)
+    if not product_ids:
+        return
+    rows = Product.objects.filter(pk__in=product_ids).values_list('pk', 'name', 'description', 'category__name')
+    with transaction.atomic():
+        SearchTerm.objects.filter(product_id__in=product_ids).delete()
+        SearchTerm.objects.bulk_create(_term_rows(rows), batch_size=1000)
+
+
+def rebuild_index(batch_size=1000):
+    # Drop the whole index and rebuild it from the catalogue, streaming products in chunks
+    rows = Product.objects.order_by().values_list('pk', 'name', 'description', 'category__name')
+    created = 0
+    with transaction.atomic():
+        SearchTerm.objects.all().delete()
+        batch = []
+        for term in _term_rows(rows.iterator(chunk_size=batch_size)):
+            batch.append(term)
+            if len(batch) >= batch_size:
+                SearchTerm.objects.bulk_create(batch)
+                created += len(batch)
+                batch = []
+        SearchTerm.objects.bulk_create(batch)
+        created += len(batch)
+    return created
+
+
+def search_products(queryset, query):
+    # Filter to products matching every word of the query and annotate them with search_rank
+    terms = list(dict.fromkeys(tokenize(query)))[:MAX_QUERY_TERMS]
+    if not terms:
+        return queryset.none()
+
+    hits = {
+        f'hit_{i}': Max(Case(When(term__startswith=term, then=Value(1)), default=Value(0), output_field=IntegerField()))
+        for i, term in enumerate(terms)
+    }
+    matches = (
+        SearchTerm.objects
+        .filter(reduce(or_, [Q(term__startswith=term) for term in terms]))
+        .values('product')
+        .annotate(rank=Sum('weight'), **hits)
+        .filter(**{name: 1 for name in hits})
+    )
+    return queryset.filter(pk__in=matches.values('product')).annotate(
+        search_rank=Subquery(matches.filter(product=OuterRef('pk')).values('rank')[:1])
+    )
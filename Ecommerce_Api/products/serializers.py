@@ -1,6 +1,12 @@
 from rest_framework import serializers
-from .models import Product, Category, Review, ProductImage, Wishlist, Discount 
+from .models import Product, Category, Review, ProductImage, Wishlist, Discount, DiscountCampaign, ProductRatingSummary
+from django.db import transaction
 from django.utils import timezone
+from decimal import Decimal
+from .registry import categories
+from .pricing import PriceBook
+from .campaigns import CampaignError, launch_campaign, lock_products, overlapping_products
+from .inventory import restocked
 
 
 # Serializer for Category to handle CRUD for categories
@@ -21,40 +27,57 @@ class ProductImageSerializer(serializers.ModelSerializer):
         return value
 
 
+class CategoryNameField(serializers.Field):
+    # Reads and writes a category by name (case-insensitive) through the in-memory registry, without a query
+    def to_representation(self, value):
+        return categories.name_for(value)
+
+    def to_internal_value(self, data):
+        if not isinstance(data, str):
+            raise serializers.ValidationError("Category must be given by name.")
+        category_id = categories.resolve(data)
+        if category_id is None:
+            raise serializers.ValidationError(f"Category with name '{data}' does not exist.")
+        return category_id
+
+
 class ProductSerializer(serializers.ModelSerializer):
     discounted_price = serializers.SerializerMethodField() 
     images = serializers.SerializerMethodField()
-    category = serializers.SlugRelatedField(
-        slug_field='name',  # This allows us to use the category's name instead of its ID
-        queryset=Category.objects.all()  # Ensures that the category exists in the database
-    )
+    rating = serializers.SerializerMethodField()
+    category = CategoryNameField(source='category_id')  # The category's name instead of its ID
 
     class Meta:
         model = Product
         fields = [
-            'id', 'name', 'description', 'price', 'discounted_price', 'category', 
-            'stock_quantity', 'image_url', 'created_date', 'created_by', 'updated', 'images'
+            'id', 'name', 'description', 'price', 'discounted_price', 'effective_price', 'category', 
+            'stock_quantity', 'image_url', 'created_date', 'created_by', 'updated', 'images', 'rating'
         ]
 
-    def validate_category(self, value):
-        try:
-            category = Category.objects.get(name__iexact=value)
-            return category
-        except Category.DoesNotExist:
-            raise serializers.ValidationError(f"Category with name '{value}' does not exist.")
-
      # Method to return image URLs separated by commas
     def get_images(self, obj):
-        images = obj.images.all()  # Assuming 'images' is the related_name for ProductImage model
+        images = obj.images.all()  # Served from the prefetch cache when listing
         image_urls = [image.image_url for image in images]
         return ', '.join(image_urls)  # Return the URLs as a comma-separated string
 
+    def get_rating(self, obj):
+        # Read from the denormalized summary (select_related when listing) instead of aggregating reviews
+        try:
+            summary = obj.rating_summary
+        except ProductRatingSummary.DoesNotExist:
+            summary = ProductRatingSummary(product=obj)
+        return {
+            "average": summary.average_rating,
+            "count": summary.review_count,
+            "histogram": summary.histogram(),
+        }
+
     def update(self, instance, validated_data):
         # Handle the update of the product's fields
         instance.name = validated_data.get('name', instance.name)
         instance.description = validated_data.get('description', instance.description)
         instance.price = validated_data.get('price', instance.price)
-        instance.category = validated_data.get('category', instance.category)
+        instance.category_id = validated_data.get('category_id', instance.category_id)
         instance.stock_quantity = validated_data.get('stock_quantity', instance.stock_quantity)
         instance.image_url = validated_data.get('image_url', instance.image_url)
         
@@ -66,14 +89,20 @@ class ProductSerializer(serializers.ModelSerializer):
                 ProductImage.objects.create(product=instance, **image_data)
 
         instance.save()
+        if instance.sharded_stock and 'stock_quantity' in validated_data:
+            restocked([instance.pk])  # A sharded product's new stock goes to its shards
         return instance
 
     def get_discounted_price(self, obj):
-        # Retrieve the discount for the product, if it exists
-        discount = Discount.objects.filter(product=obj).first()
+        # Use the active discounts prefetched by Product.objects.with_listing_data(), if present
+        if hasattr(obj, 'active_discounts'):
+            book = PriceBook.from_prefetched([obj])
+        else:
+            book = PriceBook.for_products([obj.pk])
+        discount = book.discount_for(obj.pk)
         if discount:
             return {
-                "discounted_price": obj.price - (obj.price * discount.discount_percentage / 100),
+                "discounted_price": book.price_for(obj),
                 "start_date": discount.start_date,
                 "end_date": discount.end_date
             }
@@ -93,10 +122,25 @@ class ReviewSerializer(serializers.ModelSerializer):
     def validate(self, data):
         user = self.context['request'].user
         product = self.context['view'].kwargs['product_id']
-        if Review.objects.filter(user=user, product_id=product).exists():
+        existing = Review.objects.filter(user=user, product_id=product)
+        if self.instance is not None:
+            existing = existing.exclude(pk=self.instance.pk)  # Editing your own review is not a duplicate
+        if existing.exists():
             raise serializers.ValidationError("You have already submitted a review for this product.")
         return data
 
+class ProductReviewFeedSerializer(serializers.ModelSerializer):
+    # Same shape as ReviewSerializer, but the product name comes from the view once instead of once per review
+    user = serializers.StringRelatedField(read_only=True)
+    product = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Review
+        fields = ['id', 'product', 'user', 'rating', 'comment', 'created_at']
+
+    def get_product(self, obj):
+        return self.context['product'].name
+
 class DiscountSerializer(serializers.ModelSerializer):
     product_name = serializers.CharField(source='product.name', read_only=True)  # For product name
     product_id = serializers.PrimaryKeyRelatedField(
@@ -112,8 +156,74 @@ class DiscountSerializer(serializers.ModelSerializer):
         # Ensure start_date is before end_date
         if data['start_date'] >= data['end_date']:
             raise serializers.ValidationError("End date must be after the start date.")
+
+        return data
+
+    def check_overlap(self, data):
+        # Overlapping discounts make it ambiguous which one the customer gets. Checked with the product row
+        # locked, in the transaction that writes the discount, so two requests can't both pass it
+        product = data.get('product', getattr(self.instance, 'product', None))
+        lock_products([product.pk])
+        exclude_id = self.instance.pk if self.instance is not None else None
+        if overlapping_products([product.pk], data['start_date'], data['end_date'], exclude_id):
+            raise serializers.ValidationError("This product already has a discount in that period.")
+
+    @transaction.atomic
+    def create(self, validated_data):
+        self.check_overlap(validated_data)
+        return super().create(validated_data)
+
+    @transaction.atomic
+    def update(self, instance, validated_data):
+        self.check_overlap(validated_data)
+        return super().update(instance, validated_data)
+
+
+class DiscountCampaignSerializer(serializers.ModelSerializer):
+    # Targets either every product of a category (by name) or an explicit list of product ids
+    category = CategoryNameField(source='category_id', required=False, allow_null=True)
+    product_ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1), required=False, write_only=True, max_length=10000,
+    )
+    skip_conflicts = serializers.BooleanField(default=False, write_only=True)
+    discount_count = serializers.IntegerField(read_only=True)
+    skipped_product_ids = serializers.SerializerMethodField()
+
+    class Meta:
+        model = DiscountCampaign
+        fields = [
+            'id', 'name', 'discount_percentage', 'start_date', 'end_date', 'category', 'product_ids',
+            'skip_conflicts', 'discount_count', 'skipped_product_ids', 'created_by', 'created_at',
+        ]
+        read_only_fields = ['created_by', 'created_at']
+
+    def get_skipped_product_ids(self, obj):
+        # Only known right after creation
+        return getattr(obj, 'skipped_product_ids', [])
+
+    def validate_discount_percentage(self, value):
+        if not Decimal('0') < value <= Decimal('100'):
+            raise serializers.ValidationError("Discount percentage must be greater than 0 and at most 100.")
+        return value
+
+    def validate(self, data):
+        if data['start_date'] >= data['end_date']:
+            raise serializers.ValidationError("End date must be after the start date.")
+        if (data.get('category_id') is None) == (not data.get('product_ids')):
+            raise serializers.ValidationError("Provide either a category or a list of product_ids.")
         return data
 
+    def create(self, validated_data):
+        category_id = validated_data.pop('category_id', None)
+        product_ids = validated_data.pop('product_ids', None)
+        skip_conflicts = validated_data.pop('skip_conflicts')
+        campaign = DiscountCampaign(**validated_data)
+        try:
+            campaign.skipped_product_ids = launch_campaign(campaign, category_id, product_ids, skip_conflicts)
+        except CampaignError as error:
+            raise serializers.ValidationError({"error": str(error), "product_ids": error.product_ids})
+        return campaign
+
 
 class WishlistSerializer(serializers.ModelSerializer):
     product_name = serializers.CharField(source='product.name', read_only=True)
@@ -122,4 +232,57 @@ class WishlistSerializer(serializers.ModelSerializer):
         model = Wishlist
         fields = ['id', 'user', 'product', 'product_name']
         read_only_fields = ['user']
+
+
+class WishlistItemSerializer(serializers.ModelSerializer):
+    # Wishlist entry with live pricing; expects select_related('active_discount') and a `first_image` annotation
+    discount_percentage = serializers.DecimalField(
+        source='active_discount.discount_percentage', max_digits=5, decimal_places=2, read_only=True, default=None,
+    )
+    in_stock = serializers.SerializerMethodField()
+    image = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Product
+        fields = [
+            'id', 'name', 'description', 'price', 'effective_price', 'discount_percentage', 'stock_quantity',
+            'in_stock', 'image',
+        ]
+
+    def get_in_stock(self, obj):
+        return obj.stock_quantity > 0
+
+    def get_image(self, obj):
+        # First gallery image, falling back to the product's main image
+        return obj.first_image or obj.image_url
+
+
+class WishlistSyncSerializer(serializers.Serializer):
+    # Batched wishlist changes, e.g. an offline mobile wishlist being synced in one request
+    add = serializers.ListField(child=serializers.IntegerField(min_value=1), default=list, max_length=1000)
+    remove = serializers.ListField(child=serializers.IntegerField(min_value=1), default=list, max_length=1000)
+
+    def validate(self, data):
+        if not data['add'] and not data['remove']:
+            raise serializers.ValidationError("Provide product ids to 'add' and/or 'remove'.")
+        overlap = set(data['add']) & set(data['remove'])
+        if overlap:
+            raise serializers.ValidationError(f"Product ids cannot be both added and removed: {sorted(overlap)}")
+
+        # One query validates every id being added; removing a product that no longer exists is a no-op
+        found = set(Product.objects.filter(id__in=data['add']).values_list('id', flat=True)) if data['add'] else set()
+        missing = sorted(set(data['add']) - found)
+        if missing:
+            raise serializers.ValidationError({'add': f"Products not found: {missing}"})
+        return data
     
+
+
+class ProductImportSerializer(serializers.Serializer):
+    # Validates one row of a bulk import; the category stays a name and is resolved through the registry
+    name = serializers.CharField(max_length=255)
+    description = serializers.CharField()
+    price = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=Decimal('0.01'))
+    category = serializers.CharField(max_length=255)
+    stock_quantity = serializers.IntegerField(min_value=1)  # As the model's validator
+    image_url = serializers.URLField()
@@ -0,0 +1,80 @@
+from django.db.models.signals import pre_save, post_save, post_delete, m2m_changed
+from django.db.models import F
+from django.dispatch import receiver
+
+from .models import Product, Category, Discount, ProductImage, ProductRatingSummary, Review, Wishlist
+from .cache import catalogue_changed, reviews_changed, wishlist_changed
+from .pricing import discounts_changed
+from .registry import categories
+from . import search
+
+
+@receiver(post_save, sender=Product)
+def index_saved_product(sender, instance, update_fields=None, **kwargs):
+    # Saves limited to other fields (stock, prices, ratings) leave the index entry as it was
+    if update_fields is not None and not update_fields & search.INDEXED_FIELDS:
+        return
+    search.index_products([instance.pk])
+
+
+@receiver(post_save, sender=Product)
+def create_rating_summary(sender, instance, created, **kwargs):
+    # Every product has a summary row so rating ordering can use an inner join and its index
+    if created:
+        ProductRatingSummary.objects.get_or_create(product=instance)
+
+
+@receiver(post_save, sender=Category)
+def index_category_products(sender, instance, created, **kwargs):
+    # The category name is part of every product's index entry
+    if not created:
+        search.index_products(Product.objects.filter(category=instance).values_list('pk', flat=True))
+
+
+@receiver(pre_save, sender=Discount)
+def remember_discounted_product(sender, instance, **kwargs):
+    # A discount moved to another product must reprice the one it leaves as well
+    instance.previous_product_id = (
+        Discount.objects.filter(pk=instance.pk).values_list('product_id', flat=True).first() if instance.pk else None
+    )
+
+
+@receiver([post_save, post_delete], sender=Discount)
+def refresh_discounted_price(sender, instance, **kwargs):
+    previous_product_id = getattr(instance, 'previous_product_id', None)
+    discounts_changed({instance.product_id, previous_product_id} - {None})
+
+
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=Category)
+@receiver([post_save, post_delete], sender=Discount)
+@receiver([post_save, post_delete], sender=ProductImage)
+def invalidate_catalogue_cache(sender, **kwargs):
+    catalogue_changed()
+
+
+@receiver([post_save, post_delete], sender=Review)
+def invalidate_review_feed(sender, instance, **kwargs):
+    reviews_changed(instance.product_id)
+
+
+@receiver([post_save, post_delete], sender=Category)
+def invalidate_category_registry(sender, **kwargs):
+    categories.invalidate()
+
+
+@receiver(m2m_changed, sender=Wishlist.products.through)
+def invalidate_wishlist_on_m2m(sender, instance, action, reverse, pk_set, **kwargs):
+    # Covers products.add()/remove() outside Wishlist.apply_changes (which writes the through table directly),
+    # e.g. the admin
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    wishlists = Wishlist.objects.filter(pk__in=pk_set or ()) if reverse else Wishlist.objects.filter(pk=instance.pk)
+    wishlists.update(version=F('version') + 1)
+    for user_id in wishlists.values_list('user_id', flat=True):
+        wishlist_changed(user_id)
+
+
+@receiver(post_delete, sender=Wishlist)
+def invalidate_deleted_wishlist(sender, instance, **kwargs):
+    wishlist_changed(instance.user_id)
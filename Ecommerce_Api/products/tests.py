@@ -1,3 +1,1076 @@
-from django.test import TestCase
+import json
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.contrib import admin
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.forms.models import model_to_dict
+from django.test import RequestFactory, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from . import bulk, inventory, search
+from .admin import DiscountCampaignAdmin, ProductAdmin
+from .pricing import PriceBook, apply_discount, products_due_for_refresh, refresh_effective_prices, select_discount
+from .cache import catalogue_changed, get_cache, get_version
+from .models import (
+    Product, Category, ProductImage, ProductRatingSummary, Discount, DiscountCampaign, Review, SearchTerm, StockShard, Wishlist,
+)
+from .registry import CategoryRegistry, categories
+from .views import negative_results
+
+User = get_user_model()
+
+
+def make_products(user, category, count, prefix='Product', **fields):
+    # Bulk-created, so without the search index entries and rating summaries signals would add
+    values = {'description': 'Test product', 'price': Decimal('10.00'), 'stock_quantity': 5}
+    values.update(fields)
+    values.setdefault('effective_price', values['price'])
+    Product.objects.bulk_create([
+        Product(
+            name=f'{prefix} {i}', category=category, image_url='https://example.com/product.jpg', created_by=user,
+            **values,
+        )
+        for i in range(count)
+    ])
+    return list(Product.objects.filter(name__startswith=f'{prefix} ').order_by('pk'))
+
+
+class ProductListQueryCountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='lister@example.com', password='pass12345')
+        categories = Category.objects.bulk_create([Category(name=f'Category {i}') for i in range(5)])
+        products = Product.objects.bulk_create([
+            Product(
+                name=f'Product {i}',
+                description='Test product',
+                price=Decimal('10.00'),
+                effective_price=Decimal('10.00'),
+                category=categories[i % len(categories)],
+                stock_quantity=5,
+                image_url='https://example.com/product.jpg',
+                created_by=cls.user,
+            )
+            for i in range(500)
+        ])
+        ProductImage.objects.bulk_create([
+            ProductImage(product=product, image_url=f'https://example.com/{product.pk}-{n}.jpg')
+            for product in products for n in range(2)
+        ])
+        now = timezone.now()
+        Discount.objects.bulk_create([
+            Discount(
+                product=product,
+                discount_percentage=Decimal('10.00'),
+                start_date=now - timedelta(days=1),
+                end_date=now + timedelta(days=1),
+            )
+            for product in products[::2]
+        ])
+
+    def setUp(self):
+        get_cache().clear()
+        categories.refresh()  # Load the category registry up front; it is one query per process, not per request
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def count_list_queries(self, page_size):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/products/', {'page_size': page_size}, secure=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), page_size)
+        return len(context.captured_queries)
+
+    def test_query_count_does_not_grow_with_page_size(self):
+        self.assertEqual(self.count_list_queries(10), self.count_list_queries(500))
+
+    def test_list_uses_prefetched_discount_and_images(self):
+        response = self.client.get('/products/', {'page_size': 500}, secure=True)
+        results = {product['name']: product for product in response.data['results']}
+        self.assertEqual(results['Product 0']['discounted_price']['discounted_price'], Decimal('9.00'))
+        self.assertEqual(results['Product 1']['discounted_price'], Decimal('10.00'))
+        self.assertEqual(len(results['Product 1']['images'].split(', ')), 2)
+
+
+class ProductKeysetPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='cursor@example.com', password='pass12345')
+        category = Category.objects.create(name='Cursor')
+        cls.products = make_products(cls.user, category, 30)
+        for i, product in enumerate(cls.products):
+            product.price = product.effective_price = Decimal(10 + i % 4)  # Ties, so id has to break them
+        Product.objects.bulk_update(cls.products, ['price', 'effective_price'])
+
+    def setUp(self):
+        get_cache().clear()
+        categories.refresh()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get_page(self, url, params=None):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, params, secure=True)
+        self.assertEqual(response.status_code, 200)
+        return response.data, len(context.captured_queries)
+
+    def test_every_page_costs_the_same_and_pages_cover_the_catalogue_once(self):
+        page, queries = self.get_page('/products/', {'pagination': 'cursor', 'ordering': 'price', 'page_size': 7})
+        ids, page_queries = [], []
+        while True:
+            ids += [product['id'] for product in page['results']]
+            page_queries.append(queries)
+            if not page['next']:
+                break
+            page, queries = self.get_page(page['next'])
+
+        expected = [product.pk for product in sorted(self.products, key=lambda product: (product.price, product.pk))]
+        self.assertEqual(ids, expected)
+        self.assertEqual(len(page_queries), 5)
+        self.assertEqual(len(set(page_queries)), 1)
+
+    def test_previous_link_returns_the_page_before(self):
+        first, _ = self.get_page('/products/', {'pagination': 'cursor', 'ordering': '-price', 'page_size': 7})
+        second, _ = self.get_page(first['next'])
+        back, _ = self.get_page(second['previous'])
+        self.assertEqual(back['results'], first['results'])
+        self.assertIsNone(first['previous'])
+
+    def test_cursor_is_only_valid_for_its_ordering(self):
+        first, _ = self.get_page('/products/', {'pagination': 'cursor', 'ordering': 'price', 'page_size': 7})
+        response = self.client.get(first['next'].replace('ordering=price', 'ordering=name'), secure=True)
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get('/products/', {'cursor': 'not-a-cursor'}, secure=True)
+        self.assertEqual(response.status_code, 404)
+
+
+class ProductSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='search@example.com', password='pass12345')
+        cls.category = Category.objects.create(name='Computers')
+        cls.laptop = Product.objects.create(
+            name='Gaming Laptop', description='A fast laptop with a large screen', price=Decimal('900.00'),
+            category=cls.category, stock_quantity=3, image_url='https://example.com/laptop.jpg', created_by=cls.user,
+        )
+        cls.lamp = Product.objects.create(
+            name='Desk Lamp', description='Lights up the laptop keyboard', price=Decimal('20.00'),
+            category=cls.category, stock_quantity=3, image_url='https://example.com/lamp.jpg', created_by=cls.user,
+        )
+
+    def setUp(self):
+        get_cache().clear()
+        categories.refresh()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def search(self, query):
+        response = self.client.get('/products/', {'search': query}, secure=True)
+        self.assertEqual(response.status_code, 200)
+        return [product['id'] for product in response.data['results']]
+
+    def test_saved_product_is_indexed_by_name_description_and_category(self):
+        terms = dict(SearchTerm.objects.filter(product=self.laptop).values_list('term', 'weight'))
+        self.assertEqual(terms['laptop'], 3 + 1)  # In the name and the description
+        self.assertEqual(terms['computers'], 2)
+        self.assertNotIn('a', terms)  # Stop word
+
+    def test_words_match_as_prefixes_and_all_must_match(self):
+        self.assertEqual(self.search('lap'), [self.laptop.pk, self.lamp.pk])  # Ranked: name beats description
+        self.assertEqual(self.search('LAPTOP desk'), [self.lamp.pk])
+        self.assertEqual(self.search('comp gam'), [self.laptop.pk])
+        response = self.client.get('/products/', {'search': 'laptops'}, secure=True)
+        self.assertEqual(response.status_code, 400)  # A search with no matches is an error
+
+    def test_rename_reindexes_but_stock_only_saves_do_not(self):
+        self.laptop.name = 'Gaming Notebook'
+        self.laptop.save()
+        self.assertEqual(self.search('notebook'), [self.laptop.pk])
+
+        SearchTerm.objects.filter(product=self.laptop).delete()
+        self.laptop.stock_quantity = 1
+        self.laptop.save(update_fields=['stock_quantity'])
+        self.assertFalse(SearchTerm.objects.filter(product=self.laptop).exists())
+        self.laptop.save(update_fields=['description'])
+        self.assertTrue(SearchTerm.objects.filter(product=self.laptop).exists())
+
+    def test_category_rename_reindexes_its_products(self):
+        self.category.name = 'Electronics'
+        self.category.save()
+        self.assertEqual(self.search('electro'), [self.laptop.pk, self.lamp.pk])
+
+
+class CatalogueCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='etag@example.com', password='pass12345')
+        cls.category = Category.objects.create(name='Cached')
+        cls.product = make_products(cls.user, cls.category, 3)[0]
+
+    def setUp(self):
+        get_cache().clear()
+        categories.refresh()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_etag_answers_304_and_repeat_reads_skip_the_database(self):
+        first = self.client.get('/products/', secure=True)
+        self.assertEqual(first.status_code, 200)
+        self.assertTrue(first['ETag'])
+
+        with CaptureQueriesContext(connection) as context:
+            again = self.client.get('/products/', secure=True)
+        self.assertEqual(len(context.captured_queries), 0)
+        self.assertEqual(again['ETag'], first['ETag'])
+
+        response = self.client.get('/products/', secure=True, HTTP_IF_NONE_MATCH=f'W/{first["ETag"]}')
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], first['ETag'])
+
+    def test_write_invalidates_cached_list_and_detail(self):
+        url = f'/products/{self.product.pk}/'
+        listing = self.client.get('/products/', secure=True)
+        detail = self.client.get(url, secure=True)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(pk=self.product.pk).update(name='Renamed product')
+            self.product.refresh_from_db()
+            self.product.save()
+
+        response = self.client.get(url, secure=True, HTTP_IF_NONE_MATCH=detail['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['name'], 'Renamed product')
+        response = self.client.get('/products/', secure=True, HTTP_IF_NONE_MATCH=listing['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], listing['ETag'])
+
+    def test_category_write_invalidates_category_list(self):
+        first = self.client.get('/products/categories/', secure=True)
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.create(name='Fresh')
+        response = self.client.get('/products/categories/', secure=True, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Fresh', str(response.data))
+
+
+class BulkImportExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create(email='bulk@example.com', username='bulk', password='!', is_staff=True)
+        cls.category = Category.objects.create(name='Garden')
+        make_products(cls.staff, cls.category, 5, prefix='Rake')
+
+    def setUp(self):
+        get_cache().clear()
+        categories.refresh()
+        self.client = APIClient()
+        self.client.force_authenticate(self.staff)
+
+    def import_rows(self, body, file_format='ndjson'):
+        response = self.client.post(
+            f'/products/import/?file_format={file_format}&batch_size=2', data=body,
+            content_type='text/csv' if file_format == 'csv' else 'application/x-ndjson', secure=True,
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def row(self, name, **fields):
+        row = {
+            'name': name, 'description': 'Imported', 'price': '4.50', 'category': 'Garden',
+            'stock_quantity': 7, 'image_url': 'https://example.com/import.jpg',
+        }
+        row.update(fields)
+        return json.dumps(row)
+
+    def test_import_upserts_by_name(self):
+        body = '\n'.join([self.row('Rake 0', price='99.00'), self.row('Shovel'), self.row('Shovel', stock_quantity=9)])
+        report = self.import_rows(body)
+        self.assertEqual(report['processed'], 3)
+        self.assertEqual(report['failed'], 0)
+
+        self.assertEqual(Product.objects.get(name='Rake 0').price, Decimal('99.00'))
+        shovel = Product.objects.get(name='Shovel')
+        self.assertEqual(shovel.stock_quantity, 9)  # A later row for the same name wins
+        self.assertEqual(shovel.category, self.category)
+        self.assertTrue(SearchTerm.objects.filter(product=shovel, term='shovel').exists())
+        self.assertEqual(Product.objects.count(), 6)
+
+    def test_import_reports_bad_rows_and_keeps_good_ones(self):
+        body = '\n'.join([
+            self.row('Hoe'),
+            '{not json',
+            self.row('Trowel', stock_quantity=0),
+            self.row('Fork', category='Nowhere'),
+            '[1, 2]',
+        ])
+        report = self.import_rows(body)
+        self.assertEqual((report['processed'], report['failed']), (5, 4))
+        errors = {error['line']: error['errors'] for error in report['errors']}
+        self.assertEqual(sorted(errors), [2, 3, 4, 5])
+        self.assertIn('stock_quantity', errors[3])
+        self.assertIn('category', errors[4])
+        self.assertEqual(list(Product.objects.filter(name__in=['Hoe', 'Trowel', 'Fork']).values_list('name', flat=True)), ['Hoe'])
+
+    def test_csv_import(self):
+        body = 'name,description,price,category,stock_quantity,image_url\nHose,Green,12.00,Garden,3,https://example.com/h.jpg\n'
+        report = self.import_rows(body, 'csv')
+        self.assertEqual(report['failed'], 0)
+        self.assertEqual(Product.objects.get(name='Hose').price, Decimal('12.00'))
+
+    def test_export_streams_every_product_in_chunks(self):
+        rows = list(bulk.export_rows(chunk_size=2))
+        self.assertEqual([row[1] for row in rows], [f'Rake {i}' for i in range(5)])
+        self.assertEqual({row[5] for row in rows}, {'Garden'})
+
+        response = self.client.get('/products/export/?file_format=ndjson', secure=True)
+        lines = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual(len(lines), 5)
+        self.assertEqual(set(lines[0]), set(bulk.EXPORT_FIELDS))
+        self.assertEqual(lines[0]['category'], 'Garden')
+
+        response = self.client.get('/products/export/?file_format=csv', secure=True)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], ','.join(bulk.EXPORT_FIELDS))
+        self.assertEqual(len(lines), 6)
+
+    def test_export_and_import_are_staff_only(self):
+        self.client.force_authenticate(User.objects.create(email='shopper@example.com', username='shopper', password='!!'))
+        self.assertEqual(self.client.get('/products/export/', secure=True).status_code, 403)
+        response = self.client.post('/products/import/', data=self.row('Hoe'), content_type='application/x-ndjson', secure=True)
+        self.assertEqual(response.status_code, 403)
+
+
+class CatalogueChangedTests(TestCase):
+    def test_one_bump_per_transaction(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            for _ in range(3):
+                catalogue_changed()
+        self.assertEqual(len(callbacks), 1)
+
+    def test_rolled_back_bump_is_scheduled_again(self):
+        try:
+            with transaction.atomic():
+                catalogue_changed()
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        with self.captureOnCommitCallbacks() as callbacks:
+            catalogue_changed()
+        self.assertEqual(len(callbacks), 1)
+
+    def test_bump_changes_the_version_on_commit(self):
+        version = get_cache().get('catalogue:version') or 0
+        with self.captureOnCommitCallbacks(execute=True):
+            catalogue_changed()
+            catalogue_changed()
+        self.assertGreater(get_cache().get('catalogue:version'), version)
+        with self.captureOnCommitCallbacks() as callbacks:
+            catalogue_changed()  # The next transaction schedules its own
+        self.assertEqual(len(callbacks), 1)
+
+
+class BulkProductImageTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='images@example.com', password='pass12345')
+        category = Category.objects.create(name='Pictured')
+        cls.first, cls.second = make_products(cls.user, category, 2)
+        ProductImage.objects.create(product=cls.first, image_url='https://example.com/old.jpg')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def post(self, data):
+        return self.client.post('/products/product-images/bulk/', data, format='json', secure=True)
+
+    def test_replace_with_an_empty_list_clears_images(self):
+        response = self.post({'images': {str(self.first.pk): [], str(self.second.pk): ['https://example.com/new.jpg']}, 'replace': True})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data, {'products': 2, 'created': 1, 'deleted': 1})
+        self.assertFalse(ProductImage.objects.filter(product=self.first).exists())
+
+    def test_unknown_product_is_rejected_even_without_urls(self):
+        response = self.post({'images': {'999999': []}, 'replace': True})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['error'], {'999999': ['Product not found.']})
+        self.assertTrue(ProductImage.objects.filter(product=self.first).exists())
+
+    def test_invalid_urls_are_reported_together(self):
+        response = self.post({'images': {str(self.first.pk): ['nope', 'https://example.com/ok.jpg'], 'x': []}})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.data['error']), {str(self.first.pk), 'x'})
+        self.assertEqual(ProductImage.objects.count(), 1)
+
+
+class ProductFacetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='facets@example.com', password='pass12345')
+        cls.tools = Category.objects.create(name='Tools')
+        cls.toys = Category.objects.create(name='Toys')
+        products = make_products(cls.user, cls.tools, 12, prefix='Hammer') + make_products(cls.user, cls.toys, 8, prefix='Kite')
+        for i, product in enumerate(products):
+            product.price = product.effective_price = Decimal(5 + i * 7)
+            product.stock_quantity = i % 3
+        Product.objects.bulk_update(products, ['price', 'effective_price', 'stock_quantity'])
+        search.rebuild_index()
+
+    def setUp(self):
+        get_cache().clear()
+        categories.refresh()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def assert_facets_match_listing(self, params):
+        response = self.client.get('/products/', {'facets': 'true', 'page_size': 100, **params}, secure=True)
+        self.assertEqual(response.status_code, 200)
+        results, facets = response.data['results'], response.data['facets']
+
+        category_counts = {}
+        for product in results:
+            category_counts[product['category']] = category_counts.get(product['category'], 0) + 1
+        self.assertEqual({facet['name']: facet['count'] for facet in facets['category']}, category_counts)
+
+        for bucket in facets['price']:
+            expected = [
+                product for product in results
+                if (bucket['min'] is None or Decimal(product['effective_price']) >= bucket['min'])
+                and (bucket['max'] is None or Decimal(product['effective_price']) < bucket['max'])
+            ]
+            self.assertEqual(bucket['count'], len(expected), bucket)
+
+        in_stock = sum(1 for product in results if product['stock_quantity'] > 0)
+        self.assertEqual(facets['stock'], {'in_stock': in_stock, 'out_of_stock': len(results) - in_stock})
+        return facets
+
+    def test_counts_match_the_filtered_listing(self):
+        facets = self.assert_facets_match_listing({})
+        self.assertEqual(sum(bucket['count'] for bucket in facets['price']), 20)
+        self.assert_facets_match_listing({'price_min': 30, 'stock_min': 1})
+        self.assert_facets_match_listing({'category': 'toy', 'price_buckets': '50,100'})
+        self.assert_facets_match_listing({'search': 'kite', 'price_max': 120})
+
+    def test_malformed_price_buckets_are_rejected(self):
+        response = self.client.get('/products/', {'facets': 'true', 'price_buckets': '10,abc'}, secure=True)
+        self.assertEqual(response.status_code, 400)
+
+
+class NegativeResultCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='empty@example.com', password='pass12345')
+        cls.category = Category.objects.create(name='Outdoor')
+        make_products(cls.user, cls.category, 2, prefix='Tent')
+
+    def setUp(self):
+        get_cache().clear()
+        categories.refresh()
+        negative_results.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def list_products(self, **params):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/products/', params, secure=True)
+        return response, context.captured_queries
+
+    def test_known_empty_search_skips_the_database(self):
+        response, queries = self.list_products(category='Outdoor', search='canoe')
+        self.assertEqual(response.status_code, 400)
+        self.assertTrue(queries)
+
+        # A different page size misses the response cache but not the negative one
+        response, queries = self.list_products(category='Outdoor', search='canoe', page_size=5)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data, {'error': "There is no category like 'Outdoor'"})
+        self.assertEqual(queries, [])
+
+    def test_creating_a_matching_product_clears_the_entry(self):
+        self.assertEqual(self.list_products(search='canoe')[0].status_code, 400)
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(
+                name='Red Canoe', description='Two seats', price=Decimal('300.00'), category=self.category,
+                stock_quantity=1, image_url='https://example.com/canoe.jpg', created_by=self.user,
+            )
+        response, _ = self.list_products(search='canoe', page_size=5)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([product['name'] for product in response.data['results']], ['Red Canoe'])
+
+
+class RatingSummaryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='rater@example.com', password='pass12345')
+        cls.other = User.objects.create(email='other-rater@example.com', username='other-rater', password='!')
+        cls.category = Category.objects.create(name='Rated')
+        cls.product = Product.objects.create(
+            name='Rated product', description='Reviewed', price=Decimal('10.00'), category=cls.category,
+            stock_quantity=5, image_url='https://example.com/rated.jpg', created_by=cls.user,
+        )
+
+    def setUp(self):
+        get_cache().clear()
+        categories.refresh()
+        self.client = APIClient()
+
+    def review(self, user, rating):
+        self.client.force_authenticate(user)
+        response = self.client.post(
+            f'/products/{self.product.pk}/reviews/add/', {'rating': rating, 'comment': 'Fine'}, format='json', secure=True,
+        )
+        self.assertEqual(response.status_code, 201)
+        return Review.objects.get(user=user, product=self.product)
+
+    def summary(self):
+        summary = ProductRatingSummary.objects.get(product=self.product)
+        return summary.review_count, summary.rating_total, summary.average_rating, summary.stars_5, summary.stars_2
+
+    def test_summary_follows_review_create_update_and_delete(self):
+        self.assertEqual(self.summary(), (0, 0, Decimal('0'), 0, 0))
+        self.review(self.user, 5)
+        review = self.review(self.other, 2)
+        self.assertEqual(self.summary(), (2, 7, Decimal('3.50'), 1, 1))
+
+        response = self.client.patch(
+            f'/products/{self.product.pk}/reviews/{review.pk}/update/', {'rating': 5}, format='json', secure=True,
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.summary(), (2, 10, Decimal('5.00'), 2, 0))
+
+        response = self.client.delete(f'/products/{self.product.pk}/reviews/{review.pk}/delete/', secure=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.summary(), (1, 5, Decimal('5.00'), 1, 0))
+
+    def test_rating_cursor_covers_products_without_a_summary(self):
+        self.review(self.user, 4)
+        unrated = make_products(self.user, self.category, 4, prefix='Unrated')  # bulk_create: no summary rows
+        self.assertFalse(ProductRatingSummary.objects.filter(product__in=unrated).exists())
+
+        url, params, ids = '/products/', {'pagination': 'cursor', 'ordering': '-average_rating', 'page_size': 2}, []
+        while url:
+            response = self.client.get(url, params, secure=True)
+            self.assertEqual(response.status_code, 200)
+            ids += [product['id'] for product in response.data['results']]
+            url, params = response.data['next'], None
+        self.assertEqual(ids, [self.product.pk] + [product.pk for product in reversed(unrated)])  # Ties by -id
+
+
+class ReviewFeedTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        owner = User.objects.create_user(email='feed@example.com', password='pass12345')
+        cls.product = make_products(owner, Category.objects.create(name='Feed'), 1, prefix='Reviewed')[0]
+        cls.reviewers = User.objects.bulk_create([
+            User(email=f'reviewer{i}@example.com', username=f'reviewer{i}', password=f'!{i}') for i in range(9)
+        ])
+        Review.objects.bulk_create([
+            Review(product=cls.product, user=user, rating=i % 5 + 1, comment=f'Review {i}')
+            for i, user in enumerate(cls.reviewers)
+        ])
+        cls.reviews = list(Review.objects.filter(product=cls.product))
+
+    def setUp(self):
+        get_cache().clear()
+        self.client = APIClient()
+        self.url = f'/products/{self.product.pk}/reviews/'
+
+    def walk(self, params):
+        url, ids, page_queries = self.url, [], []
+        while url:
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(url, params, secure=True)
+            self.assertEqual(response.status_code, 200)
+            ids += [review['id'] for review in response.data['results']]
+            page_queries.append(len(context.captured_queries))
+            url, params = response.data['next'], None
+        return ids, page_queries
+
+    def test_cursor_walks_newest_first_at_a_constant_cost(self):
+        ids, page_queries = self.walk({'page_size': 4})
+        expected = sorted(self.reviews, key=lambda review: (review.created_at, review.pk), reverse=True)
+        self.assertEqual(ids, [review.pk for review in expected])
+        self.assertEqual(len(page_queries), 3)
+        self.assertEqual(len(set(page_queries[1:])), 1)  # The first page may come from the cache
+
+    def test_rating_order_and_filters(self):
+        ids, _ = self.walk({'ordering': 'rating', 'page_size': 2, 'rating_min': 3})
+        expected = sorted((review for review in self.reviews if review.rating >= 3), key=lambda review: (review.rating, review.pk))
+        self.assertEqual(ids, [review.pk for review in expected])
+
+    def test_cached_first_page_is_invalidated_by_a_new_review(self):
+        first = self.client.get(self.url, secure=True).data
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(self.client.get(self.url, secure=True).data, first)
+        self.assertEqual(len(context.captured_queries), 0)
+
+        newcomer = User.objects.create(email='newcomer@example.com', username='newcomer', password='!new')
+        with self.captureOnCommitCallbacks(execute=True):
+            review = Review.objects.create(product=self.product, user=newcomer, rating=5, comment='Latest')
+        self.assertEqual(self.client.get(self.url, secure=True).data['results'][0]['id'], review.pk)
+
+    def test_cursor_from_another_ordering_is_rejected(self):
+        next_url = self.client.get(self.url, {'page_size': 2}, secure=True).data['next']
+        response = self.client.get(next_url + '&ordering=rating', secure=True)
+        self.assertEqual(response.status_code, 404)
+
+
+class CategoryRegistryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Kitchen')
+
+    def setUp(self):
+        get_cache().clear()
+        categories.refresh()
+        # Stands in for another worker process: its own in-memory copy, the same shared cache
+        self.worker = CategoryRegistry().current()
+
+    def test_worker_picks_up_a_rename_made_elsewhere(self):
+        self.assertEqual(self.worker.resolve('kitchen'), self.category.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.name = 'Cookware'
+            self.category.save()
+
+        # Trusted until the version check interval runs out
+        self.assertEqual(self.worker.name_for(self.category.pk), 'Kitchen')
+        self.worker.checked_at -= self.worker.version_check_interval
+        self.assertEqual(self.worker.name_for(self.category.pk), 'Cookware')
+        self.assertEqual(self.worker.resolve('COOKWARE'), self.category.pk)
+        self.assertIsNone(self.worker.resolve('Kitchen'))
+        self.assertEqual(self.worker.matching('ware'), [self.category.pk])
+
+    def test_unbumped_new_category_is_found_after_a_miss(self):
+        Category.objects.bulk_create([Category(name='Pantry')])  # No signal, so no version bump
+        self.worker.miss_reload_interval = 0
+        self.assertEqual(self.worker.resolve('pantry'), Category.objects.get(name='Pantry').pk)
+
+    def test_lookups_do_not_query_once_loaded(self):
+        with CaptureQueriesContext(connection) as context:
+            self.worker.resolve('Kitchen')
+            self.worker.name_for(self.category.pk)
+        self.assertEqual(context.captured_queries, [])
+
+    def test_version_is_read_once_per_interval(self):
+        with mock.patch('products.registry.get_version', wraps=get_version) as version_reads:
+            for _ in range(200):
+                self.worker.name_for(self.category.pk)
+            self.assertEqual(version_reads.call_count, 0)
+            self.worker.checked_at -= self.worker.version_check_interval
+            for _ in range(200):
+                self.worker.resolve('kitchen')
+            self.assertEqual(version_reads.call_count, 1)
+
+
+class WishlistSyncTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='sync@example.com', password='pass12345')
+        cls.products = make_products(cls.user, Category.objects.create(name='Wished'), 30, prefix='Wish')
+        cls.ids = [product.pk for product in cls.products]
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def sync(self, add=(), remove=()):
+        return self.client.post('/products/wishlist/sync/', {'add': list(add), 'remove': list(remove)}, format='json', secure=True)
+
+    def wishlist_ids(self):
+        return set(Wishlist.objects.get(user=self.user).products.values_list('pk', flat=True))
+
+    def test_version_moves_only_when_something_changes(self):
+        response = self.sync(add=self.ids[:5])
+        self.assertEqual(response.data, {'version': 1, 'added': 5, 'removed': 0})
+
+        response = self.sync(add=self.ids[:3], remove=[self.ids[10]])  # Already there / never there
+        self.assertEqual(response.data, {'version': 1, 'added': 0, 'removed': 0})
+
+        response = self.sync(add=self.ids[5:7], remove=self.ids[:2])
+        self.assertEqual(response.data, {'version': 2, 'added': 2, 'removed': 2})
+        self.assertEqual(self.wishlist_ids(), set(self.ids[2:7]))
+
+    def test_conflicting_or_unknown_ids_are_rejected_without_changes(self):
+        self.sync(add=self.ids[:2])
+        response = self.sync(add=[self.ids[3]], remove=[self.ids[3]])
+        self.assertEqual(response.status_code, 400)
+        response = self.sync(add=[self.ids[4], 999999])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('999999', str(response.data))
+        self.assertEqual(self.wishlist_ids(), set(self.ids[:2]))
+        self.assertEqual(Wishlist.objects.get(user=self.user).version, 1)
+
+    def test_query_count_does_not_grow_with_the_batch(self):
+        self.sync(add=self.ids[:1])
+        with CaptureQueriesContext(connection) as small:
+            self.sync(add=self.ids[1:3], remove=self.ids[:1])
+        with CaptureQueriesContext(connection) as large:
+            self.sync(add=self.ids[3:30], remove=self.ids[1:3])
+        self.assertEqual(len(large.captured_queries), len(small.captured_queries))
+
+
+class WishlistReadTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='reader@example.com', password='pass12345')
+        cls.products = make_products(cls.user, Category.objects.create(name='Listed'), 20, prefix='Listed', price=Decimal('40.00'))
+        cls.wishlist = Wishlist.objects.create(user=cls.user)
+        cls.wishlist.apply_changes(add_ids=[product.pk for product in cls.products[:2]])
+
+    def setUp(self):
+        get_cache().clear()
+        categories.refresh()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def read(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/products/wishlist/', secure=True)
+        self.assertEqual(response.status_code, 200)
+        return response.data, len(context.captured_queries)
+
+    def test_query_count_does_not_depend_on_length(self):
+        _, short = self.read()
+        self.wishlist.apply_changes(add_ids=[product.pk for product in self.products])
+        get_cache().clear()
+        data, long = self.read()
+        self.assertEqual(len(data['wishlist']), 20)
+        self.assertEqual(long, short)
+
+    def test_items_carry_live_price_stock_and_first_image(self):
+        first = self.products[0]
+        ProductImage.objects.create(product=first, image_url='https://example.com/second.jpg')
+        ProductImage.objects.create(product=first, image_url='https://example.com/third.jpg')
+        now = timezone.now()
+        Discount.objects.create(product=first, discount_percentage=Decimal('25.00'), start_date=now - timedelta(days=1), end_date=now + timedelta(days=1))
+        Product.objects.filter(pk=self.products[1].pk).update(stock_quantity=0)
+        get_cache().clear()
+
+        items = {item['id']: item for item in self.read()[0]['wishlist']}
+        self.assertEqual(items[first.pk]['effective_price'], '30.00')
+        self.assertEqual(items[first.pk]['discount_percentage'], '25.00')
+        self.assertEqual(items[first.pk]['image'], 'https://example.com/second.jpg')
+        self.assertIsNone(items[self.products[1].pk]['discount_percentage'])
+        self.assertFalse(items[self.products[1].pk]['in_stock'])
+        self.assertEqual(items[self.products[1].pk]['image'], 'https://example.com/product.jpg')
+
+    def test_cache_is_dropped_by_wishlist_and_product_changes(self):
+        data, _ = self.read()
+        self.assertEqual(self.read()[1], 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/products/wishlist/sync/', {'add': [self.products[2].pk]}, format='json', secure=True)
+        data, _ = self.read()
+        self.assertEqual((len(data['wishlist']), data['version']), (3, 2))
+
+        product = self.products[0]
+        with self.captureOnCommitCallbacks(execute=True):
+            product.price = Decimal('12.00')
+            product.save(update_fields=['price'])
+        items = {item['id']: item for item in self.read()[0]['wishlist']}
+        self.assertEqual(items[product.pk]['effective_price'], '12.00')
+
+
+class PricingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='pricing@example.com', password='pass12345')
+        cls.product = make_products(cls.user, Category.objects.create(name='Priced'), 1, prefix='Priced', price=Decimal('19.99'))[0]
+
+    def discount(self, percentage, start_days=-1, end_days=1, product=None):
+        now = timezone.now()
+        return Discount.objects.create(
+            product=product or self.product, discount_percentage=Decimal(percentage),
+            start_date=now + timedelta(days=start_days), end_date=now + timedelta(days=end_days),
+        )
+
+    def test_discounts_round_half_up_to_the_cent(self):
+        cases = [
+            ('19.99', '15.00', '16.99'),  # 16.9915
+            ('0.05', '50.00', '0.03'),  # 0.025
+            ('10.00', '33.33', '6.67'),  # 6.667
+            ('2.50', '12.50', '2.19'),  # 2.1875
+            ('10.00', '100.00', '0.00'),
+            ('10.00', '150.00', '0.00'),  # Never below zero
+        ]
+        for price, percentage, expected in cases:
+            discount = Discount(pk=1, discount_percentage=Decimal(percentage))
+            self.assertEqual(apply_discount(Decimal(price), discount), Decimal(expected), (price, percentage))
+        self.assertEqual(apply_discount(Decimal('10.00'), None), Decimal('10.00'))
+
+    def test_overlapping_discounts_resolve_to_the_biggest_then_the_oldest(self):
+        small = self.discount('10.00')
+        big = self.discount('30.00')
+        tied = self.discount('30.00')
+        self.discount('90.00', start_days=2, end_days=3)  # Not started yet
+        self.discount('80.00', start_days=-3, end_days=-2)  # Already over
+
+        self.assertEqual(select_discount([small, tied, big]), big)
+        book = PriceBook.for_products([self.product.pk])
+        self.assertEqual(book.discount_for(self.product.pk), big)
+        self.assertEqual(book.price_for(self.product), Decimal('13.99'))  # 13.993
+
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.effective_price, self.product.active_discount_id), (Decimal('13.99'), big.pk))
+
+    def test_expired_discount_is_found_and_refreshed(self):
+        discount = self.discount('50.00')
+        Discount.objects.filter(pk=discount.pk).update(end_date=timezone.now() - timedelta(minutes=1))
+        self.assertEqual(products_due_for_refresh(), {self.product.pk})
+        self.assertEqual(refresh_effective_prices(products_due_for_refresh()), 1)
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.effective_price, self.product.active_discount), (Decimal('19.99'), None))
+        self.assertEqual(products_due_for_refresh(), set())
+
+    def test_moving_a_discount_reprices_both_products(self):
+        other = make_products(self.user, self.product.category, 1, prefix='Other', price=Decimal('100.00'))[0]
+        discount = self.discount('50.00')
+        staff = User.objects.create(email='pricer@example.com', username='pricer', password='!', is_staff=True)
+        client = APIClient()
+        client.force_authenticate(staff)
+        response = client.put(f'/products/discounts/update/{discount.pk}/', {
+            'product_id': other.pk, 'discount_percentage': '50.00',
+            'start_date': discount.start_date.isoformat(), 'end_date': discount.end_date.isoformat(),
+        }, format='json', secure=True)
+        self.assertEqual(response.status_code, 200)
+        prices = dict(Product.objects.values_list('pk', 'effective_price'))
+        self.assertEqual((prices[self.product.pk], prices[other.pk]), (Decimal('19.99'), Decimal('50.00')))
+        self.assertEqual(Product.objects.get(pk=self.product.pk).active_discount, None)
+        self.assertEqual(products_due_for_refresh(), set())
+
+        # A move that bypassed the signals is still found
+        Discount.objects.filter(pk=discount.pk).update(product=self.product)
+        self.assertEqual(products_due_for_refresh(), {self.product.pk, other.pk})
+
+
+class DiscountCampaignTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create(email='campaigns@example.com', username='campaigns', password='!', is_staff=True)
+        cls.category = Category.objects.create(name='Seasonal')
+        cls.products = make_products(cls.staff, cls.category, 4, prefix='Seasonal', price=Decimal('20.00'))
+        cls.start = timezone.now() - timedelta(hours=1)
+        cls.end = timezone.now() + timedelta(days=7)
+        # Touches the campaign window at its last moment: windows include both ends
+        Discount.objects.create(
+            product=cls.products[0], discount_percentage=Decimal('5.00'), start_date=cls.end, end_date=cls.end + timedelta(days=1),
+        )
+
+    def setUp(self):
+        get_cache().clear()
+        categories.refresh()
+        self.client = APIClient()
+        self.client.force_authenticate(self.staff)
+
+    def launch(self, **fields):
+        data = {
+            'name': 'Summer', 'discount_percentage': '10.00', 'start_date': self.start.isoformat(),
+            'end_date': self.end.isoformat(), 'category': 'Seasonal',
+        }
+        data.update(fields)
+        return self.client.post('/products/discounts/campaigns/', data, format='json', secure=True)
+
+    def test_overlap_rejects_the_whole_campaign(self):
+        response = self.launch()
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['product_ids'], [str(self.products[0].pk)])
+        self.assertFalse(DiscountCampaign.objects.exists())
+        self.assertEqual(Discount.objects.count(), 1)
+
+    def test_skip_conflicts_then_cancel(self):
+        response = self.launch(skip_conflicts=True)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['skipped_product_ids'], [self.products[0].pk])
+        self.assertEqual(response.data['discount_count'], 3)
+        prices = dict(Product.objects.values_list('pk', 'effective_price'))
+        self.assertEqual(prices[self.products[1].pk], Decimal('18.00'))
+        self.assertEqual(prices[self.products[0].pk], Decimal('20.00'))
+
+        response = self.client.delete(f'/products/discounts/campaigns/{response.data["id"]}/', secure=True)
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(Discount.objects.count(), 1)
+        self.assertEqual(set(Product.objects.values_list('effective_price', flat=True)), {Decimal('20.00')})
+
+    def test_launched_campaign_is_read_only_in_the_admin(self):
+        campaign = DiscountCampaign.objects.get(pk=self.launch(skip_conflicts=True).data['id'])
+        request = RequestFactory().get('/')
+        request.user = User(email='admin@example.com', is_staff=True, is_superuser=True)
+        model_admin = DiscountCampaignAdmin(DiscountCampaign, admin.site)
+        self.assertFalse(model_admin.has_add_permission(request))
+        form = model_admin.get_form(request, campaign, change=True)
+        self.assertEqual(list(form.base_fields), [])
+
+    def test_product_list_campaign_reports_unknown_ids(self):
+        response = self.launch(category=None, product_ids=[self.products[1].pk, 999999])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['product_ids'], ['999999'])
+
+    def test_single_discount_overlap_is_rejected(self):
+        data = {
+            'product_id': self.products[0].pk, 'discount_percentage': '15.00',
+            'start_date': self.start.isoformat(), 'end_date': self.end.isoformat(),
+        }
+        response = self.client.post('/products/discounts/create/', data, format='json', secure=True)
+        self.assertEqual(response.status_code, 400)
+        data['product_id'] = self.products[1].pk
+        response = self.client.post('/products/discounts/create/', data, format='json', secure=True)
+        self.assertEqual(response.status_code, 201)
+
+        # Moving an existing discount onto the other one's window is an overlap too, but not with itself
+        discount = Discount.objects.get(product=self.products[0])
+        data.update(product_id=self.products[0].pk, start_date=discount.start_date.isoformat(), end_date=discount.end_date.isoformat())
+        response = self.client.put(f'/products/discounts/update/{discount.pk}/', data, format='json', secure=True)
+        self.assertEqual(response.status_code, 200)
+        moved = Discount.objects.get(product=self.products[1])
+        response = self.client.put(f'/products/discounts/update/{moved.pk}/', data, format='json', secure=True)
+        self.assertEqual(response.status_code, 400)
+
+
+class DiscountListTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='discounts@example.com', password='pass12345')
+        cls.shoes = make_products(cls.user, Category.objects.create(name='Shoes'), 3, prefix='Shoe')
+        cls.hats = make_products(cls.user, Category.objects.create(name='Hats'), 3, prefix='Hat')
+        now = timezone.now()
+        windows = {'expired': (-10, -5), 'active': (-1, 1), 'upcoming': (5, 10)}
+        discounts = []
+        for i, product in enumerate(cls.shoes + cls.hats):
+            for status, (start, end) in windows.items():
+                discounts.append(Discount(
+                    product=product, discount_percentage=Decimal('10.00'),
+                    start_date=now + timedelta(days=start, minutes=i), end_date=now + timedelta(days=end, minutes=i),
+                ))
+        Discount.objects.bulk_create(discounts)
+        cls.discounts = list(Discount.objects.all())
+
+    def setUp(self):
+        categories.refresh()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def walk(self, params):
+        url, ids, page_queries = '/products/discounts/', [], []
+        while url:
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(url, params, secure=True)
+            self.assertEqual(response.status_code, 200)
+            ids += [discount['id'] for discount in response.data['results']]
+            page_queries.append(len(context.captured_queries))
+            url, params = response.data['next'], None
+        return ids, page_queries
+
+    def test_cursor_walks_newest_start_first_at_a_constant_cost(self):
+        ids, page_queries = self.walk({'page_size': 4})
+        expected = sorted(self.discounts, key=lambda discount: (discount.start_date, discount.pk), reverse=True)
+        self.assertEqual(ids, [discount.pk for discount in expected])
+        self.assertEqual(len(set(page_queries)), 1)
+
+        ids, _ = self.walk({'page_size': 5, 'ordering': 'end_date'})
+        expected = sorted(self.discounts, key=lambda discount: (discount.end_date, discount.pk))
+        self.assertEqual(ids, [discount.pk for discount in expected])
+
+    def test_status_product_and_category_filters(self):
+        now = timezone.now()
+        ids, _ = self.walk({'status': 'active', 'page_size': 4})
+        self.assertEqual(len(ids), 6)
+        self.assertTrue(all(discount.is_active() for discount in Discount.objects.filter(pk__in=ids)))
+        ids, _ = self.walk({'status': 'upcoming'})
+        self.assertTrue(all(discount.start_date > now for discount in Discount.objects.filter(pk__in=ids)))
+        ids, _ = self.walk({'status': 'expired', 'category': 'hats'})
+        self.assertEqual(set(Discount.objects.filter(pk__in=ids).values_list('product_id', flat=True)), {hat.pk for hat in self.hats})
+        self.assertEqual(len(ids), 3)
+        ids, _ = self.walk({'product': self.shoes[0].pk})
+        self.assertEqual(len(ids), 3)
+
+
+class ShardedStockTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create(email='shards@example.com', username='shards', password='!', is_staff=True)
+        cls.product = make_products(cls.staff, Category.objects.create(name='Hot'), 1, prefix='Hot', stock_quantity=30)[0]
+
+    def setUp(self):
+        get_cache().clear()
+        categories.refresh()
+        inventory.enable_sharding(self.product.pk, shards=4)
+
+    def shards(self):
+        return list(StockShard.objects.filter(product=self.product).order_by('index').values_list('quantity', flat=True))
+
+    def stock(self):
+        return Product.objects.get(pk=self.product.pk).stock_quantity
+
+    def test_enable_splits_and_disable_merges(self):
+        self.assertEqual(self.shards(), [8, 8, 7, 7])
+        self.assertTrue(Product.objects.get(pk=self.product.pk).sharded_stock)
+
+        inventory.enable_sharding(self.product.pk, shards=2)  # Re-split keeps the total
+        self.assertEqual(self.shards(), [15, 15])
+        inventory.reserve(self.product.pk, 4)
+        inventory.disable_sharding(self.product.pk)
+        product = Product.objects.get(pk=self.product.pk)
+        self.assertEqual((product.sharded_stock, product.stock_quantity, self.shards()), (False, 26, []))
+
+    def test_reserve_takes_from_a_single_shard(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            inventory.reserve(self.product.pk, 5)
+        shards = self.shards()
+        self.assertEqual(sum(shards), 25)
+        self.assertEqual(sorted(before - after for before, after in zip([8, 8, 7, 7], shards)), [0, 0, 0, 5])
+        self.assertEqual(self.stock(), 25)  # The cached sum is refreshed on commit
+
+    def test_orders_inside_the_sync_interval_are_caught_up(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            inventory.reserve(self.product.pk, 5)
+        with self.captureOnCommitCallbacks(execute=True):
+            inventory.reserve(self.product.pk, 3)
+        self.assertEqual(self.stock(), 25)  # Second order was inside the interval
+        self.assertEqual(inventory.sync_dirty_stock_sums(), 1)
+        self.assertEqual(self.stock(), 22)
+        self.assertEqual(inventory.sync_dirty_stock_sums(), 0)
+
+        # The next order after the interval refreshes it too
+        with self.captureOnCommitCallbacks(execute=True):
+            inventory.reserve(self.product.pk, 2)
+        get_cache().delete(f'stock:{self.product.pk}:synced')
+        with self.captureOnCommitCallbacks(execute=True):
+            inventory.reserve(self.product.pk, 1)
+        self.assertEqual(self.stock(), 19)
+
+    def test_merge_when_no_single_shard_covers_the_order(self):
+        inventory.reserve(self.product.pk, 20)
+        self.assertEqual(self.shards(), [3, 3, 2, 2])  # What's left, spread evenly
+        with self.assertRaises(inventory.InsufficientStock) as raised:
+            inventory.reserve(self.product.pk, 11)
+        self.assertEqual(raised.exception.available, 10)
+        self.assertEqual(sum(self.shards()), 10)
+
+    def test_unsharded_product_is_a_stock_error(self):
+        inventory.disable_sharding(self.product.pk)
+        with self.assertRaises(inventory.StockError):
+            inventory.reserve(self.product.pk, 40)
+
+    def test_restock_through_the_api_goes_to_the_shards(self):
+        client = APIClient()
+        client.force_authenticate(self.staff)
+        response = client.patch(f'/products/{self.product.pk}/', {'stock_quantity': 50}, format='json', secure=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.shards(), [13, 13, 12, 12])
+        self.assertEqual(self.stock(), 50)
+
+    def test_restock_through_the_admin_goes_to_the_shards(self):
+        request = RequestFactory().post('/')
+        request.user = User(email='admin@example.com', is_staff=True, is_superuser=True)
+        model_admin = ProductAdmin(Product, admin.site)
+        product = Product.objects.get(pk=self.product.pk)
+        form = model_admin.get_form(request, product, change=True)(dict(model_to_dict(product), stock_quantity=9), instance=product)
+        self.assertTrue(form.is_valid(), form.errors)
+        model_admin.save_model(request, form.save(commit=False), form, change=True)
+        self.assertEqual(self.shards(), [3, 2, 2, 2])
+        self.assertEqual(self.stock(), 9)
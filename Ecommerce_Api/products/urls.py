@@ -1,6 +1,7 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import ProductViewSet, CategoryViewSet, SubmitReviewAPIView, ProductReviewListAPIView,ReviewUpdateAPIView,ReviewDeleteAPIView, ProductImageViewSet, DiscountCreateView, DiscountUpdateView, DiscountDeleteView, AddToWishlistView, WishlistAPIView, WishlistUpdateAPIView,DiscountListAPIView
+from .views import ProductImportView, ProductExportView, DiscountCampaignListCreateView, DiscountCampaignDetailView
+from .views import ProductViewSet, CategoryViewSet, SubmitReviewAPIView, ProductReviewListAPIView,ReviewUpdateAPIView,ReviewDeleteAPIView, ProductImageViewSet, DiscountCreateView, DiscountUpdateView, DiscountDeleteView, AddToWishlistView, WishlistAPIView, WishlistUpdateAPIView, WishlistSyncAPIView,DiscountListAPIView
 
 router = DefaultRouter()
 router.register(r'categories', CategoryViewSet, basename='category')
@@ -12,12 +13,17 @@ router.register(r'', ProductViewSet, basename='product')
 
 urlpatterns = [
     path('wishlist/', WishlistAPIView.as_view(), name='wishlist'),  # Get wishlist
+    path('import/', ProductImportView.as_view(), name='product-import'),
+    path('export/', ProductExportView.as_view(), name='product-export'),
     path('discounts/create/', DiscountCreateView.as_view(), name='create-discount'),
     path('discounts/update/<int:pk>/', DiscountUpdateView.as_view(), name='update-discount'),
     path('discounts/delete/<int:pk>/', DiscountDeleteView.as_view(), name='delete-discount'),
     path('discounts/', DiscountListAPIView.as_view(), name='discount-list'),
+    path('discounts/campaigns/', DiscountCampaignListCreateView.as_view(), name='discount-campaigns'),
+    path('discounts/campaigns/<int:pk>/', DiscountCampaignDetailView.as_view(), name='discount-campaign-detail'),
     path('wishlist/add/', AddToWishlistView.as_view(), name='wishlist-add'),
     path('wishlist/update/', WishlistUpdateAPIView.as_view(), name='wishlist-update'),  # Add/Remove product
+    path('wishlist/sync/', WishlistSyncAPIView.as_view(), name='wishlist-sync'),  # Add/Remove many products at once
     path('<int:product_id>/reviews/', ProductReviewListAPIView.as_view(), name='product-reviews-list'),
     path('<int:product_id>/reviews/add/', SubmitReviewAPIView.as_view(), name='submit-review'),
     path('<int:product_id>/reviews/<int:pk>/update/', ReviewUpdateAPIView.as_view(), name='update-review'),
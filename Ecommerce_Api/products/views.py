@@ -1,53 +1,157 @@
+import hashlib
+import json
+from decimal import Decimal
+
+from django.conf import settings
 from django.shortcuts import render
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework import viewsets, permissions, filters, status, generics
-from rest_framework.permissions import IsAuthenticated, IsAuthenticatedOrReadOnly, AllowAny
-from .models import Product, Category, Review, ProductImage,Discount, Wishlist
-from .serializers import ProductSerializer, CategorySerializer, ReviewSerializer, ProductImageSerializer, DiscountSerializer, WishlistSerializer
+from rest_framework.permissions import IsAuthenticated, IsAuthenticatedOrReadOnly, AllowAny, IsAdminUser
+from .models import Product, Category, Review, ProductImage,Discount, DiscountCampaign, Wishlist
+from .serializers import ProductSerializer, CategorySerializer, ReviewSerializer, ProductImageSerializer, DiscountSerializer, DiscountCampaignSerializer, WishlistSerializer, WishlistItemSerializer, WishlistSyncSerializer, ProductReviewFeedSerializer
 from django_filters.rest_framework import DjangoFilterBackend
-from .filters import ProductFilter
-from django.db.models import Q
+from .filters import ProductFilter, ProductSearchFilter, ReviewFilter, DiscountFilter
+from .pagination import ProductPagination, ProductKeysetPagination, ReviewKeysetPagination, DiscountKeysetPagination
+from .cache import (
+    CachedResponseMixin, NegativeResultCache, catalogue_changed, get_cache, get_catalogue_version, get_version,
+    review_version_key, wishlist_version_key,
+)
+from .facets import filter_signature, get_facets, parse_price_boundaries
+from . import bulk, campaigns, ratings
+from django.db.models import Q, F, Count, DecimalField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
 from django.shortcuts import get_object_or_404
+from django.http import StreamingHttpResponse
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.validators import URLValidator
+from django.db import transaction
 from rest_framework.views import APIView
 from rest_framework.exceptions import ValidationError
 
+# Filter combinations known to match nothing, per worker process
+negative_results = NegativeResultCache(max_entries=10000, ttl=300)
+
+
 # ViewSet for handling CRUD operations for Products
-class ProductViewSet(viewsets.ModelViewSet):
+class ProductViewSet(CachedResponseMixin, viewsets.ModelViewSet):
     queryset = Product.objects.all().order_by('created_date')  # Order by created_date
     serializer_class = ProductSerializer
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
-    filterset_class = ProductFilter
-    search_fields = ['name', 'category__name']  # Enable searching by name and category name
-    ordering_fields = ['price', 'name', 'stock_quantity']
+    filter_backends = [DjangoFilterBackend, ProductSearchFilter, filters.OrderingFilter]
+    filterset_class = ProductFilter  # ?search= matches name, description and category name through the search index
+    ordering_fields = ['price', 'effective_price', 'name', 'stock_quantity', 'average_rating']
+    pagination_class = ProductPagination
     permission_classes = [IsAuthenticated]  # Only authenticated users can manage products
 
-    def filter_queryset(self, queryset):
-        queryset = super().filter_queryset(queryset)
+    @property
+    def paginator(self):
+        # Keyset mode is opt-in with ?pagination=cursor; the links it returns carry ?cursor=
+        if not hasattr(self, '_paginator'):
+            params = self.request.query_params
+            if params.get('pagination') == 'cursor' or 'cursor' in params:
+                self._paginator = ProductKeysetPagination()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
+
+    def paginate_queryset(self, queryset):
+        params = self.request.query_params
+
+        # A category or search with no matches is an error; repeats of a known-empty combination skip the database
+        negative_key = None
+        if params.get('category') or params.get('search'):
+            negative_key = json.dumps(filter_signature(params))
+            version = get_catalogue_version()
+            if negative_results.contains(negative_key, version):
+                self.raise_no_results()
+
+        # ?facets=true adds category, price band and stock counts for the whole filtered result
+        self.facets = None
+        if params.get('facets') in ('true', '1'):
+            boundaries = parse_price_boundaries(params.get('price_buckets'))
+            if boundaries is None:
+                raise ValidationError({"price_buckets": "Use a comma-separated list of positive prices (at most 19)."})
+            self.facets = get_facets(queryset, params, boundaries)
+
+        page = super().paginate_queryset(queryset)
+
+        # Decide "no results" from the first page itself instead of separate exists() queries
+        first_page = params.get('page', '1') == '1' and 'cursor' not in params
+        if negative_key and first_page and not page:
+            negative_results.add(negative_key, version)
+            self.raise_no_results()
+        return page
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        if self.facets is not None:
+            response.data['facets'] = self.facets
+        return response
 
-        # Get the 'category' query parameter
-        category_name = self.request.query_params.get('category', None)
-        search_query = self.request.query_params.get('search', None)
+    def get_queryset(self):
+        # Rating summaries, images and active discounts are fetched in batches rather than once per product;
+        # category names come from the in-process CategoryRegistry without a query
+        queryset = super().get_queryset().with_listing_data()
+        if 'average_rating' in self.request.query_params.get('ordering', ''):
+            # Only join the summary into the filtering query when sorting by it. Products without a summary row
+            # (e.g. bulk-created ones) rank as unrated rather than NULL, which a keyset cursor can't seek from
+            queryset = queryset.annotate(average_rating=Coalesce(
+                F('rating_summary__average_rating'), Value(Decimal('0')), output_field=DecimalField(max_digits=3, decimal_places=2),
+            ))
+        return queryset
 
-        # Handle category filtering and raise error if no results are found
-        if category_name and not queryset.exists():
+    def raise_no_results(self):
+        # Keep the error bodies clients already rely on; category takes precedence over search
+        category_name = self.request.query_params.get('category')
+        if category_name:
             raise ValidationError(
                 detail={"error": f"There is no category like '{category_name}'"},
                 code=status.HTTP_404_NOT_FOUND
             )
+        raise ValidationError(
+            detail={"error": f"No products found matching the search term '{self.request.query_params.get('search')}'"},
+            code=status.HTTP_404_NOT_FOUND
+        )
 
-        # Handle search query and raise error if no results are found
-        if search_query and not queryset.exists():
-            raise ValidationError(
-                detail={"error": f"No products found matching the search term '{search_query}'"},
-                code=status.HTTP_404_NOT_FOUND
-            )
 
-        return queryset
+# Bulk catalogue import: NDJSON or CSV body, parsed and upserted in batches (Admin only)
+class ProductImportView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def post(self, request, *args, **kwargs):
+        file_format = request.query_params.get('file_format') or ('csv' if 'csv' in request.content_type else 'ndjson')
+        if file_format not in bulk.FORMATS:
+            return Response({"error": f"file_format must be one of {', '.join(bulk.FORMATS)}."}, status=status.HTTP_400_BAD_REQUEST)
+        if request.stream is None:
+            return Response({"error": "The request body is empty."}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            batch_size = min(max(int(request.query_params.get('batch_size', 1000)), 1), 5000)
+        except ValueError:
+            return Response({"error": "batch_size must be an integer."}, status=status.HTTP_400_BAD_REQUEST)
+
+        report = bulk.ProductImporter(request.user, batch_size=batch_size).run(request.stream, file_format)
+        return Response(report, status=status.HTTP_200_OK)
+
+
+# Bulk catalogue export, streamed in primary key chunks (Admin only)
+class ProductExportView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        file_format = request.query_params.get('file_format', 'ndjson')
+        if file_format not in bulk.FORMATS:
+            return Response({"error": f"file_format must be one of {', '.join(bulk.FORMATS)}."}, status=status.HTTP_400_BAD_REQUEST)
+
+        rows = bulk.export_rows()
+        content_type = 'text/csv' if file_format == 'csv' else 'application/x-ndjson'
+        response = StreamingHttpResponse(bulk.stream_export(bulk.EXPORT_FIELDS, rows, file_format), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="products.{file_format}"'
+        return response
 
 
 # ViewSet for handling CRUD operations for Categories
-class CategoryViewSet(viewsets.ModelViewSet):
+class CategoryViewSet(CachedResponseMixin, viewsets.ModelViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
     permission_classes = [IsAuthenticatedOrReadOnly]  # Authenticated users can create/update/delete, others can read
@@ -88,6 +192,61 @@ class ProductImageViewSet(viewsets.ModelViewSet):
         serializer = ProductImageSerializer(product_images, many=True)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+    @action(detail=False, methods=['post'], url_path='bulk')
+    def bulk(self, request, *args, **kwargs):
+        # Attach images to many products at once: {"images": {"<product_id>": ["<url>", ...]}, "replace": false}
+        images = request.data.get('images')
+        replace = request.data.get('replace', False)
+        if not isinstance(images, dict) or not isinstance(replace, bool):
+            return Response(
+                {"error": "'images' must map product ids to arrays of image URLs and 'replace' must be a boolean."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        # Validate every id and URL in one pass and report all problems together
+        validate_url = URLValidator()
+        rows = []
+        errors = {}
+        product_ids = set()  # Every product named, so an empty list with "replace" clears its images
+        for product_id, image_urls in images.items():
+            try:
+                product_id = int(product_id)
+            except (TypeError, ValueError):
+                errors[str(product_id)] = ["Product id must be an integer."]
+                continue
+            product_ids.add(product_id)
+            if not isinstance(image_urls, list):
+                errors[str(product_id)] = ["Image URLs must be an array."]
+                continue
+            for image_url in image_urls:
+                try:
+                    validate_url(image_url)
+                except DjangoValidationError:
+                    errors.setdefault(str(product_id), []).append(f"Invalid image URL: {image_url}")
+                else:
+                    rows.append((product_id, image_url))
+
+        existing_ids = set(Product.objects.filter(id__in=product_ids).values_list('id', flat=True))
+        for product_id in product_ids - existing_ids:
+            errors.setdefault(str(product_id), []).append("Product not found.")
+        if errors:
+            return Response({"error": errors}, status=status.HTTP_400_BAD_REQUEST)
+
+        with transaction.atomic():
+            deleted = 0
+            if replace:
+                deleted, _ = ProductImage.objects.filter(product_id__in=product_ids).delete()
+            created = ProductImage.objects.bulk_create(
+                [ProductImage(product_id=product_id, image_url=image_url) for product_id, image_url in rows],
+                batch_size=1000
+            )
+            catalogue_changed()  # bulk_create doesn't send post_save
+
+        return Response(
+            {"products": len(product_ids), "created": len(created), "deleted": deleted},
+            status=status.HTTP_201_CREATED
+        )
+
     def update(self, request, *args, **kwargs):
         partial = kwargs.pop('partial', False)  # Allows partial updates
         instance = self.get_object()  # Get the image instance to be updated
@@ -119,13 +278,41 @@ class DiscountDeleteView(generics.DestroyAPIView):
     queryset = Discount.objects.all()
     permission_classes = [IsAuthenticated]
 
-class DiscountListAPIView(APIView):
+class DiscountCampaignListCreateView(generics.ListCreateAPIView):
+    # Create a discount for a whole category or a list of products at once
+    serializer_class = DiscountCampaignSerializer
+    permission_classes = [IsAdminUser]
+
+    def get_queryset(self):
+        return DiscountCampaign.objects.annotate(discount_count=Count('discounts')).order_by('-created_at', '-id')
+
+    def perform_create(self, serializer):
+        serializer.save(created_by=self.request.user)
+
+
+class DiscountCampaignDetailView(generics.RetrieveDestroyAPIView):
+    # DELETE cancels the campaign and removes all of its discounts
+    serializer_class = DiscountCampaignSerializer
+    permission_classes = [IsAdminUser]
+
+    def get_queryset(self):
+        return DiscountCampaign.objects.annotate(discount_count=Count('discounts'))
+
+    def perform_destroy(self, instance):
+        campaigns.cancel_campaign(instance)
+
+
+class DiscountListAPIView(generics.ListAPIView):
+    # Keyset pages, so deep pages of a large discount history cost the same as the first one
+    serializer_class = DiscountSerializer
+    pagination_class = DiscountKeysetPagination
+    filterset_class = DiscountFilter
     permission_classes = [IsAuthenticated]
 
-    def get(self, request, *args, **kwargs):
-        discounts = Discount.objects.all()
-        serializer = DiscountSerializer(discounts, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+    def get_queryset(self):
+        return Discount.objects.select_related('product').only(
+            'id', 'product_id', 'discount_percentage', 'start_date', 'end_date', 'product__name'
+        )
 
     
 
@@ -143,33 +330,46 @@ class AddToWishlistView(APIView):
         except Product.DoesNotExist:
             return Response({"error": "Product not found."}, status=404)
 
-        # Get or create the user's wishlist
-        wishlist, created = Wishlist.objects.get_or_create(user=request.user)
+        with transaction.atomic():
+            # Get or create the user's wishlist, locked so concurrent changes bump the version in turn
+            wishlist, created = Wishlist.objects.select_for_update().get_or_create(user=request.user)
+            added, _ = wishlist.apply_changes(add_ids=[product.id])
 
-        if product in wishlist.products.all():
-            return Response({"message": "Product already in wishlist."}, status=200)
+        if not added:
+            return Response({"message": "Product already in wishlist.", "version": wishlist.version}, status=200)
 
-        wishlist.products.add(product)  # Add product to wishlist
-        wishlist.save()
-
-        return Response({"message": "Product added to wishlist."}, status=201)
+        return Response({"message": "Product added to wishlist.", "version": wishlist.version}, status=201)
     
 class WishlistAPIView(APIView):
+    # Cached per user; the key carries the user's wishlist version and the catalogue version, so adding or
+    # removing products and any price, stock or discount change both miss the old entry
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        try:
-            wishlist = Wishlist.objects.get(user=request.user)
-            products = wishlist.products.all()
-            product_data = [{
-                "id": product.id,
-                "name": product.name,
-                "price": product.price,
-                "description": product.description
-            } for product in products]
-            return Response({"wishlist": product_data}, status=status.HTTP_200_OK)
-        except Wishlist.DoesNotExist:
-            return Response({"wishlist": []}, status=status.HTTP_200_OK)  # Return an empty wishlist
+        user_id = request.user.pk
+        key = f'wishlist:{user_id}:{get_version(wishlist_version_key(user_id))}:{get_catalogue_version()}'
+        cache = get_cache()
+        data = cache.get(key)
+        if data is None:
+            data = self.build_wishlist(request.user)
+            cache.set(key, data, timeout=getattr(settings, 'CATALOGUE_CACHE_TIMEOUT', 300))
+        return Response(data, status=status.HTTP_200_OK)
+
+    def build_wishlist(self, user):
+        # Two queries however long the wishlist is: the wishlist row, then its products with the active
+        # discount joined and the first image picked by a subquery
+        wishlist = Wishlist.objects.filter(user=user).only('id', 'version').first()
+        if wishlist is None:
+            return {"wishlist": [], "version": 0}  # Return an empty wishlist
+
+        first_image = ProductImage.objects.filter(product=OuterRef('pk')).order_by('id').values('image_url')[:1]
+        products = (
+            Product.objects.filter(wishlisted_by=wishlist)
+            .select_related('active_discount')
+            .annotate(first_image=Subquery(first_image))
+            .order_by('id')
+        )
+        return {"wishlist": list(WishlistItemSerializer(products, many=True).data), "version": wishlist.version}
     
 
 class WishlistUpdateAPIView(APIView):
@@ -189,17 +389,36 @@ class WishlistUpdateAPIView(APIView):
         except Product.DoesNotExist:
             return Response({"error": "Product not found."}, status=status.HTTP_404_NOT_FOUND)
 
-        wishlist, created = Wishlist.objects.get_or_create(user=request.user)
-
-        if action == 'add':
-            wishlist.products.add(product)
-            return Response({"message": "Product added to wishlist."}, status=status.HTTP_200_OK)
-        elif action == 'remove':
-            wishlist.products.remove(product)
-            return Response({"message": "Product removed from wishlist."}, status=status.HTTP_200_OK)
-        else:
+        if action not in ('add', 'remove'):
             return Response({"error": "Invalid action. Use 'add' or 'remove'."}, status=status.HTTP_400_BAD_REQUEST)
 
+        with transaction.atomic():
+            wishlist, created = Wishlist.objects.select_for_update().get_or_create(user=request.user)
+            if action == 'add':
+                wishlist.apply_changes(add_ids=[product.id])
+                message = "Product added to wishlist."
+            else:
+                wishlist.apply_changes(remove_ids=[product.id])
+                message = "Product removed from wishlist."
+        return Response({"message": message, "version": wishlist.version}, status=status.HTTP_200_OK)
+
+
+class WishlistSyncAPIView(APIView):
+    # Applies a batch of adds and removes in one transaction and returns the new wishlist version
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        serializer = WishlistSyncSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        with transaction.atomic():
+            wishlist, created = Wishlist.objects.select_for_update().get_or_create(user=request.user)
+            added, removed = wishlist.apply_changes(
+                add_ids=serializer.validated_data['add'],
+                remove_ids=serializer.validated_data['remove'],
+            )
+        return Response({"version": wishlist.version, "added": added, "removed": removed}, status=status.HTTP_200_OK)
+
 
 
 
@@ -210,20 +429,57 @@ class SubmitReviewAPIView(generics.CreateAPIView):
 
     def perform_create(self, serializer):
         product = Product.objects.get(pk=self.kwargs['product_id'])  # Get product from URL
-        serializer.save(user=self.request.user, product=product)  # Attach user and product to the review
+        with transaction.atomic():
+            review = serializer.save(user=self.request.user, product=product)  # Attach user and product to the review
+            ratings.review_added(review)
 
     def create(self, request, *args, **kwargs):
         response = super().create(request, *args, **kwargs)
         return Response({"message": "Review created successfully!"}, status=status.HTTP_201_CREATED)
 
-# Retrieve Reviews for a Product (List)
+# Retrieve Reviews for a Product (List), newest first with keyset pagination
 class ProductReviewListAPIView(generics.ListAPIView):
-    serializer_class = ReviewSerializer
+    serializer_class = ProductReviewFeedSerializer
+    pagination_class = ReviewKeysetPagination
+    filterset_class = ReviewFilter
     permission_classes = [AllowAny]
 
+    def get_product(self):
+        if not hasattr(self, 'product'):
+            self.product = get_object_or_404(Product.objects.only('id', 'name'), pk=self.kwargs['product_id'])
+        return self.product
+
     def get_queryset(self):
+        product = self.get_product()
+        return Review.objects.filter(product_id=product.pk).select_related('user').only(
+            'id', 'product_id', 'rating', 'comment', 'created_at', 'user__email'
+        )
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['product'] = self.get_product()
+        return context
+
+    def list(self, request, *args, **kwargs):
+        # The first page of each product's feed is cached until one of its reviews or the catalogue changes
+        if 'cursor' in request.query_params:
+            return super().list(request, *args, **kwargs)
+
         product_id = self.kwargs['product_id']
-        return Review.objects.filter(product__id=product_id)
+        query = json.dumps(sorted(request.query_params.lists()))
+        key = 'reviews:{}:{}:{}:{}'.format(
+            product_id,
+            get_version(review_version_key(product_id)),
+            get_catalogue_version(),
+            hashlib.md5(f'{request.get_host()}{query}'.encode('utf-8')).hexdigest(),
+        )
+        cache = get_cache()
+        data = cache.get(key)
+        if data is None:
+            response = super().list(request, *args, **kwargs)
+            cache.set(key, response.data, timeout=getattr(settings, 'CATALOGUE_CACHE_TIMEOUT', 300))
+            return response
+        return Response(data)
 
 # Update a Review
 class ReviewUpdateAPIView(generics.UpdateAPIView):
@@ -234,6 +490,12 @@ class ReviewUpdateAPIView(generics.UpdateAPIView):
         user = self.request.user
         return Review.objects.filter(user=user, product__id=self.kwargs['product_id'])
 
+    def perform_update(self, serializer):
+        old_rating = serializer.instance.rating
+        with transaction.atomic():
+            review = serializer.save()
+            ratings.review_rating_changed(review.product_id, old_rating, review.rating)
+
     def update(self, request, *args, **kwargs):
         response = super().update(request, *args, **kwargs)
         return Response({"message": "Review updated successfully!"}, status=status.HTTP_200_OK)
@@ -247,6 +509,11 @@ class ReviewDeleteAPIView(generics.DestroyAPIView):
         user = self.request.user
         return Review.objects.filter(user=user, product__id=self.kwargs['product_id'])
 
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            instance.delete()
+            ratings.review_removed(instance)
+
     def destroy(self, request, *args, **kwargs):
         super().destroy(request, *args, **kwargs)
         return Response({"message": "Review deleted successfully!"}, status=status.HTTP_200_OK)
\ No newline at end of file